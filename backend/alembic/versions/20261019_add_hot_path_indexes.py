@@ -0,0 +1,122 @@
+"""Add composite and partial indexes for hot queries
+
+Revision ID: 20261019_add_hot_path_indexes
+Revises: 20261019_add_retention_checkpoints
+Create Date: 2026-10-19 13:00:00.000000
+
+All indexes are built with CREATE INDEX CONCURRENTLY so writes are not
+blocked. Postgres cannot build an index concurrently on a partitioned table,
+so for those the index is created on the parent only (ON ONLY, initially
+invalid), built concurrently on each partition and then attached; the parent
+index becomes valid once every partition has one. Partitions created later
+inherit it automatically.
+
+If a concurrent build fails it leaves an INVALID index behind; drop it and
+re-run the migration.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_hot_path_indexes'
+down_revision = '20261019_add_retention_checkpoints'
+branch_labels = None
+depends_on = None
+
+# (index name, partitioned table, columns)
+PARTITIONED_INDEXES = [
+    # Diagnostic history per user, newest first
+    ('ix_diagnostics_user_id_created_at', 'diagnostics', 'user_id, created_at'),
+    # Results per scheduled probe, newest first
+    ('ix_probe_results_scheduled_probe_id_created_at', 'probe_results', 'scheduled_probe_id, created_at'),
+    # Usage per user over a time window
+    ('ix_usage_logs_user_id_timestamp', 'usage_logs', 'user_id, timestamp'),
+]
+
+# (index name, table, columns, WHERE clause) for plain tables
+PARTIAL_INDEXES = [
+    # Active probe counts and listings per user
+    ('ix_scheduled_probes_user_id_active', 'scheduled_probes', 'user_id', 'is_active'),
+    # Active API key counts per user
+    ('ix_api_keys_user_id_active', 'api_keys', 'user_id', 'is_active'),
+]
+
+
+def _partitions(bind, table):
+    return bind.execute(sa.text("""
+        SELECT child.relname
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = :table AND pg_table_is_visible(parent.oid)
+        ORDER BY child.relname
+    """), {"table": table}).scalars().all()
+
+
+def _is_partitioned(bind, table):
+    return bool(bind.execute(sa.text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :table AND pg_table_is_visible(c.oid)
+        )
+    """), {"table": table}).scalar())
+
+
+def _has_unique_index(inspector, table, column):
+    for constraint in inspector.get_unique_constraints(table):
+        if constraint['column_names'] == [column]:
+            return True
+    for index in inspector.get_indexes(table):
+        if index['unique'] and index['column_names'] == [column]:
+            return True
+    return False
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    with op.get_context().autocommit_block():
+        for name, table, columns in PARTITIONED_INDEXES:
+            if not inspector.has_table(table):
+                continue
+            if not _is_partitioned(bind, table):
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+                continue
+
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({columns})")
+            for partition in _partitions(bind, table):
+                partition_index = f"{partition}_{columns.replace(', ', '_')}_idx"
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} ({columns})")
+                # Already attached on a re-run after a partial failure
+                attached = bind.execute(sa.text("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM pg_inherits i
+                        JOIN pg_class c ON c.oid = i.inhrelid
+                        WHERE c.relname = :index
+                    )
+                """), {"index": partition_index}).scalar()
+                if not attached:
+                    op.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+        for name, table, columns, where in PARTIAL_INDEXES:
+            if inspector.has_table(table):
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns}) WHERE {where}")
+
+        # Node authentication looks nodes up by api_key; normally covered by
+        # the unique constraint, but databases built by hand may lack it
+        if inspector.has_table('probe_nodes') and not _has_unique_index(inspector, 'probe_nodes', 'api_key'):
+            op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_probe_nodes_api_key ON probe_nodes (api_key)")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_probe_nodes_api_key")
+        for name, _, _, _ in PARTIAL_INDEXES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        # Partitioned indexes cannot be dropped concurrently; dropping the
+        # parent index drops the attached partition indexes with it
+        for name, _, _ in PARTITIONED_INDEXES:
+            op.execute(f"DROP INDEX IF EXISTS {name}")
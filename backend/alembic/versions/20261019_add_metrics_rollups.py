@@ -0,0 +1,64 @@
+"""Add hourly and daily metrics rollup tables
+
+Revision ID: 20261019_add_metrics_rollups
+Revises: 20261019_add_hot_path_indexes
+Create Date: 2026-10-19 14:00:00.000000
+
+The tables are filled by the rollup compactor (app/rollups.py), which
+backfills from the oldest raw row on its first run.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_metrics_rollups'
+down_revision = '20261019_add_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def _metric_columns():
+    return [
+        sa.Column('count', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('time_count', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('time_sum', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('time_min', sa.Float(), nullable=True),
+        sa.Column('time_max', sa.Float(), nullable=True),
+        sa.Column('latency_sketch', postgresql.JSONB(), nullable=False, server_default='{}'),
+    ]
+
+
+def upgrade():
+    # Per user, tool and status; user_id 0 holds diagnostics without a user
+    op.create_table('diagnostic_rollups',
+        sa.Column('granularity', sa.String(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('tool', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        *_metric_columns(),
+        sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'user_id', 'tool', 'status')
+    )
+    op.create_index('ix_diagnostic_rollups_user_id', 'diagnostic_rollups',
+                    ['user_id', 'granularity', 'bucket_start'])
+
+    # Per scheduled probe and status
+    op.create_table('probe_result_rollups',
+        sa.Column('granularity', sa.String(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('scheduled_probe_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        *_metric_columns(),
+        sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'scheduled_probe_id', 'status')
+    )
+    op.create_index('ix_probe_result_rollups_scheduled_probe_id', 'probe_result_rollups',
+                    ['scheduled_probe_id', 'granularity', 'bucket_start'])
+
+
+def downgrade():
+    op.drop_index('ix_probe_result_rollups_scheduled_probe_id', table_name='probe_result_rollups')
+    op.drop_table('probe_result_rollups')
+    op.drop_index('ix_diagnostic_rollups_user_id', table_name='diagnostic_rollups')
+    op.drop_table('diagnostic_rollups')
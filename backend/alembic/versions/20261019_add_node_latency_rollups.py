@@ -0,0 +1,43 @@
+"""Add per-node latency rollups
+
+Revision ID: 20261019_add_node_latency_rollups
+Revises: 20261019_add_metrics_rollups
+Create Date: 2026-10-19 15:00:00.000000
+
+Filled by the rollup compactor (app/rollups.py), which reads node_diagnostics
+by executed_at; the new index keeps that scan to the recompute window.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_node_latency_rollups'
+down_revision = '20261019_add_metrics_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('node_diagnostic_rollups',
+        sa.Column('granularity', sa.String(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('node_id', sa.Integer(), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('time_count', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('time_sum', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('time_min', sa.Float(), nullable=True),
+        sa.Column('time_max', sa.Float(), nullable=True),
+        sa.Column('latency_sketch', postgresql.JSONB(), nullable=False, server_default='{}'),
+        sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'node_id')
+    )
+    op.create_index('ix_node_diagnostic_rollups_node_id', 'node_diagnostic_rollups',
+                    ['node_id', 'granularity', 'bucket_start'])
+    op.create_index('ix_node_diagnostics_executed_at', 'node_diagnostics', ['executed_at'])
+
+
+def downgrade():
+    op.drop_index('ix_node_diagnostics_executed_at', table_name='node_diagnostics')
+    op.drop_index('ix_node_diagnostic_rollups_node_id', table_name='node_diagnostic_rollups')
+    op.drop_table('node_diagnostic_rollups')
@@ -0,0 +1,31 @@
+"""Add retention_checkpoints table for the history retention engine
+
+Revision ID: 20261019_add_retention_checkpoints
+Revises: 20261019_partition_time_series
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_retention_checkpoints'
+down_revision = '20261019_partition_time_series'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Last user id processed per table, so interrupted passes resume
+    op.create_table('retention_checkpoints',
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('last_user_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('passes_completed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('table_name')
+    )
+
+
+def downgrade():
+    op.drop_table('retention_checkpoints')
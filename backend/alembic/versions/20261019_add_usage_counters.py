@@ -0,0 +1,50 @@
+"""Add usage_counters rollup table for daily/monthly quotas
+
+Revision ID: 20261019_add_usage_counters
+Revises: 20250515_add_probe_connection_fields
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_usage_counters'
+down_revision = '20250515_add_probe_connection_fields'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Per-user request counts, keyed by (user, period, period_start)
+    op.create_table('usage_counters',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('period', sa.String(), nullable=False),
+        sa.Column('period_start', sa.Date(), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'period', 'period_start')
+    )
+    
+    # Seed the current day and month from existing usage logs so quotas
+    # take effect immediately after deployment
+    op.execute("""
+        INSERT INTO usage_counters (user_id, period, period_start, count, updated_at)
+        SELECT user_id, 'day', CAST(timestamp AS DATE), COUNT(*), NOW()
+        FROM usage_logs
+        WHERE user_id IS NOT NULL AND timestamp >= date_trunc('day', NOW() AT TIME ZONE 'UTC')
+        GROUP BY user_id, CAST(timestamp AS DATE)
+    """)
+    op.execute("""
+        INSERT INTO usage_counters (user_id, period, period_start, count, updated_at)
+        SELECT user_id, 'month', CAST(date_trunc('month', timestamp) AS DATE), COUNT(*), NOW()
+        FROM usage_logs
+        WHERE user_id IS NOT NULL AND timestamp >= date_trunc('month', NOW() AT TIME ZONE 'UTC')
+        GROUP BY user_id, CAST(date_trunc('month', timestamp) AS DATE)
+    """)
+
+
+def downgrade():
+    op.drop_table('usage_counters')
@@ -0,0 +1,51 @@
+"""Store API keys as an indexed prefix plus a SHA-256 hash
+
+Revision ID: 20261019_hash_api_keys
+Revises: 20261019_add_usage_counters
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261019_hash_api_keys'
+down_revision = '20261019_add_usage_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('api_keys', sa.Column('prefix', sa.String(length=16), nullable=True))
+    op.add_column('api_keys', sa.Column('key_hash', sa.String(length=64), nullable=True))
+    
+    # Hash existing plaintext keys, then remove the plaintext
+    # (the prefix is the first 8 characters, matching auth.API_KEY_PREFIX_LENGTH)
+    op.execute("""
+        UPDATE api_keys
+        SET prefix = substr(key, 1, 8),
+            key_hash = encode(sha256(convert_to(key, 'UTF8')), 'hex')
+        WHERE key IS NOT NULL
+    """)
+    # The base schema declares key NOT NULL; new keys no longer set it
+    op.alter_column('api_keys', 'key', existing_type=sa.String(length=255), nullable=True)
+    op.execute("UPDATE api_keys SET key = NULL")
+    
+    op.create_index(op.f('ix_api_keys_prefix'), 'api_keys', ['prefix'], unique=False)
+    op.create_unique_constraint('uq_api_keys_key_hash', 'api_keys', ['key_hash'])
+
+
+def downgrade():
+    # Plaintext keys cannot be restored; existing keys stop working after a
+    # downgrade and get a unique placeholder so key can be NOT NULL again
+    op.execute("""
+        UPDATE api_keys
+        SET key = 'revoked-' || id, is_active = false
+        WHERE key IS NULL
+    """)
+    op.alter_column('api_keys', 'key', existing_type=sa.String(length=255), nullable=False)
+    op.drop_constraint('uq_api_keys_key_hash', 'api_keys', type_='unique')
+    op.drop_index(op.f('ix_api_keys_prefix'), table_name='api_keys')
+    op.drop_column('api_keys', 'key_hash')
+    op.drop_column('api_keys', 'prefix')
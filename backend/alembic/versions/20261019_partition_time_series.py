@@ -0,0 +1,130 @@
+"""Partition diagnostics, probe_results and usage_logs by month
+
+Revision ID: 20261019_partition_time_series
+Revises: 20261019_hash_api_keys
+Create Date: 2026-10-19 11:00:00.000000
+
+Each table is rebuilt as a range-partitioned table with one partition per
+month (<table>_pYYYYMM) and a default partition, and existing rows are copied
+over. The primary key becomes (id, <partition column>), as Postgres requires
+the partition key in every unique constraint, so foreign keys pointing at
+these tables (node_diagnostics.diagnostic_id) are dropped.
+
+The copy holds an exclusive lock on each table; run during a maintenance
+window on large databases.
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261019_partition_time_series'
+down_revision = '20261019_hash_api_keys'
+branch_labels = None
+depends_on = None
+
+# Table -> partition column (matches app.partitions.PARTITIONED_TABLES)
+PARTITIONED_TABLES = {
+    'diagnostics': 'created_at',
+    'probe_results': 'created_at',
+    'usage_logs': 'timestamp',
+}
+
+# Months of partitions created after the current one
+# (matches app.partitions.PARTITION_PREMAKE_MONTHS)
+PARTITION_PREMAKE_MONTHS = 3
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _rebuild_table(table, partition_column=None):
+    """
+    Copy a table into a new one with the same columns, either partitioned by
+    month on partition_column or, when it is None, as a plain table.
+    """
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table(table):
+        # Created by the application on first start (Base.metadata.create_all)
+        return
+
+    old = f"{table}_old"
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+    foreign_keys = inspector.get_foreign_keys(table)
+    indexes = [index for index in inspector.get_indexes(table) if not index['unique']]
+
+    # Free the index names for the new table
+    for index in indexes:
+        op.drop_index(index['name'], table_name=table)
+    op.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    op.execute(f"ALTER INDEX IF EXISTS {table}_pkey RENAME TO {old}_pkey")
+
+    if partition_column:
+        op.execute(f"UPDATE {old} SET {partition_column} = now() AT TIME ZONE 'utc' WHERE {partition_column} IS NULL")
+        op.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ({partition_column})")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {partition_column} SET NOT NULL")
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {partition_column})")
+
+        # One partition per month from the oldest row through the premade range
+        first = bind.execute(sa.text(f"SELECT min({partition_column}) FROM {old}")).scalar() or datetime.utcnow()
+        month = date(first.year, first.month, 1)
+        today = datetime.utcnow().date()
+        last = _add_months(date(today.year, today.month, 1), PARTITION_PREMAKE_MONTHS)
+        while month <= last:
+            op.execute(
+                f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+            )
+            month = _add_months(month, 1)
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    else:
+        op.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)")
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)")
+
+    for foreign_key in foreign_keys:
+        op.create_foreign_key(
+            foreign_key['name'], table, foreign_key['referred_table'],
+            foreign_key['constrained_columns'], foreign_key['referred_columns'],
+            ondelete=foreign_key.get('options', {}).get('ondelete')
+        )
+    for index in indexes:
+        op.create_index(index['name'], table, index['column_names'], unique=False)
+
+    op.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+    op.execute(f"DROP TABLE {old}")
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # A foreign key cannot reference diagnostics.id alone once the primary key
+    # includes created_at
+    if inspector.has_table('node_diagnostics'):
+        for foreign_key in inspector.get_foreign_keys('node_diagnostics'):
+            if foreign_key['referred_table'] == 'diagnostics':
+                op.drop_constraint(foreign_key['name'], 'node_diagnostics', type_='foreignkey')
+
+    for table, partition_column in PARTITIONED_TABLES.items():
+        _rebuild_table(table, partition_column)
+
+
+def downgrade():
+    for table in PARTITIONED_TABLES:
+        _rebuild_table(table)
+
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table('node_diagnostics'):
+        # Rows whose diagnostic no longer exists would block the constraint
+        op.execute("DELETE FROM node_diagnostics WHERE diagnostic_id NOT IN (SELECT id FROM diagnostics)")
+        op.create_foreign_key(
+            'node_diagnostics_diagnostic_id_fkey', 'node_diagnostics', 'diagnostics',
+            ['diagnostic_id'], ['id']
+        )
@@ -1,24 +1,55 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
-import uuid
+from typing import Optional, List, Dict, Any, Tuple
+import hashlib
+import hmac
+import secrets
+import time
 import logging
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached
 
 from app.models import User, ApiKey, UserSubscription
 from app.schemas import TokenData, TokenPayload, UserCreate
 from app.config import settings
-from app.database import get_db
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.database import get_async_db
+from app.credential_filter import API_KEY_FILTER
+from app.logging_config import log_event, sampled_debug
+from app.password_hashing import (
+    pwd_context, verify_password_async, hash_password_async, record_login, PasswordHashQueueFull
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 logger = logging.getLogger(__name__)
 
+# Cache of resolved users keyed by token subject (email), in LRU order
+# Structure: {email: (user_columns, expires_at)}
+PRINCIPAL_CACHE: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+PRINCIPAL_CACHE_TTL = 60  # seconds; bounds staleness for changes made via other workers
+PRINCIPAL_CACHE_MAX_SIZE = 10000
+PRINCIPAL_CACHE_STATS = {'hits': 0, 'misses': 0, 'request_hits': 0, 'invalidations': 0}
+
+# API keys are stored as a public prefix plus a SHA-256 hash of the whole key
+API_KEY_PREFIX_LENGTH = 8
+
+# Cache of verified API keys keyed by key hash, in LRU order
+# Structure: {key_hash: (api_key_id, key_expires_at, user_columns, cache_expires_at)}
+API_KEY_CACHE: "OrderedDict[str, Tuple[int, Optional[datetime], Dict[str, Any], float]]" = OrderedDict()
+API_KEY_CACHE_TTL = 60  # seconds; bounds staleness for changes made via other workers
+API_KEY_CACHE_MAX_SIZE = 10000
+API_KEY_CACHE_STATS = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+# Key used in request.state to memoize the principal for the current request
+PRINCIPAL_STATE_KEY = "principal"
+
+# Columns kept in the cache; the password hash never leaves the database layer
+_CACHED_USER_COLUMNS = [column.key for column in User.__table__.columns if column.key != "hashed_password"]
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -28,6 +59,22 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+async def get_password_hash_async(password: str) -> str:
+    """
+    Hash a password in the password hashing pool.
+    Raises 503 when too many passwords are already being hashed or verified.
+    """
+    try:
+        return await hash_password_async(password)
+    except PasswordHashQueueFull:
+        log_event(logger, logging.WARNING, "password_hash_shed", reason="hash_queue_full")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password operations in progress, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+
 def get_user(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
@@ -36,51 +83,70 @@ def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).first()
 
 
-def authenticate_user(db: Session, username: str, password: str):
-    # Print debug info
-    print(f"Auth attempt - Input username/email: {username}")
+async def get_user_async(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    """
+    Authenticate a user by username or email and password.
     
-    # If the username contains @, it's likely an email
+    The bcrypt check runs in the password hashing pool, not on the event loop.
+    Raises 503 when too many logins are already being verified.
+    """
+    start_time = time.perf_counter()
+    user = await _authenticate_user(db, username, password)
+    record_login(bool(user), time.perf_counter() - start_time)
+    return user
+
+
+async def _authenticate_user(db: AsyncSession, username: str, password: str):
+    # If the username contains @, it's likely an email; try that first and
+    # fall back to the other field (some usernames contain @)
     if '@' in username:
-        print(f"Treating as email first: {username}")
-        # Try email login first
-        user = get_user_by_email(db, username)
-        if user:
-            print(f"Found user by email: {user.username}")
-        else:
-            print(f"No user found with email: {username}")
-            # As fallback, try it as a username too (some usernames might contain @)
-            user = get_user(db, username)
-            if user:
-                print(f"Found user by username (containing @): {user.username}")
-            else:
-                print(f"No user found with username: {username}")
+        lookups = (("email", get_user_by_email_async), ("username", get_user_async))
     else:
-        print(f"Treating as username first: {username}")
-        # Try username login first
-        user = get_user(db, username)
+        lookups = (("username", get_user_async), ("email", get_user_by_email_async))
+    
+    user = None
+    for field, lookup in lookups:
+        user = await lookup(db, username)
         if user:
-            print(f"Found user by username: {user.username}")
-        else:
-            print(f"No user found with username: {username}")
-            # As fallback, try it as an email too (unlikely but possible)
-            user = get_user_by_email(db, username)
-            if user:
-                print(f"Found user by email (no @ symbol): {user.username}")
-            else:
-                print(f"No user found with email: {username}")
+            sampled_debug(logger, "login_user_lookup", matched_by=field, user_id=user.id)
+            break
     
     # If no user found, return False
     if not user:
-        print(f"Authentication failed: No matching user found")
+        log_event(logger, logging.INFO, "login_failed", reason="unknown_user")
         return False
     
     # Check password
-    if not verify_password(password, user.hashed_password):
-        print(f"Authentication failed: Password incorrect for user: {user.username}")
+    try:
+        valid, new_hash = await verify_password_async(password, user.hashed_password)
+    except PasswordHashQueueFull:
+        log_event(logger, logging.WARNING, "login_shed", reason="hash_queue_full")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    if not valid:
+        log_event(logger, logging.INFO, "login_failed", reason="bad_password", user_id=user.id)
         return False
     
-    print(f"Authentication successful for user: {user.username}")
+    # Upgrade hashes made with outdated cost parameters
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        log_event(logger, logging.INFO, "password_rehashed", user_id=user.id)
+    
+    log_event(logger, logging.INFO, "login_succeeded", user_id=user.id)
     return user
 
 
@@ -99,6 +165,21 @@ def create_user(db: Session, user: UserCreate, is_admin: bool = False, email_ver
     return db_user
 
 
+async def create_user_async(db: AsyncSession, user: UserCreate, is_admin: bool = False, email_verified: bool = False):
+    """Same as create_user, hashing the password in the password hashing pool."""
+    db_user = User(
+        username=user.username,
+        email=user.email,
+        hashed_password=await get_password_hash_async(user.password),
+        is_admin=is_admin,
+        email_verified=email_verified
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -111,14 +192,31 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 
 def generate_api_key():
-    return str(uuid.uuid4())
+    return secrets.token_urlsafe(32)
+
+
+def hash_api_key(api_key: str) -> str:
+    """Hash an API key for storage and lookup. Keys are random, so a fast hash is sufficient."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def api_key_prefix(api_key: str) -> str:
+    """Get the public prefix used to find an API key."""
+    return api_key[:API_KEY_PREFIX_LENGTH]
 
 
 def create_api_key(db: Session, name: str, user_id: int, expires_at: Optional[datetime] = None):
-    """Create a new API key for a user."""
+    """
+    Create a new API key for a user.
+    
+    Only the prefix and hash are stored. Returns the ApiKey row and the
+    plaintext key, which must be shown to the user now since it cannot be
+    recovered later.
+    """
     key = generate_api_key()
     db_api_key = ApiKey(
-        key=key,
+        prefix=api_key_prefix(key),
+        key_hash=hash_api_key(key),
         name=name,
         user_id=user_id,
         expires_at=expires_at
@@ -126,10 +224,76 @@ def create_api_key(db: Session, name: str, user_id: int, expires_at: Optional[da
     db.add(db_api_key)
     db.commit()
     db.refresh(db_api_key)
-    return db_api_key
+    API_KEY_FILTER.add(db_api_key.prefix)
+    return db_api_key, key
+
+
+def _detached_user(user_columns: Dict[str, Any]) -> User:
+    """
+    Rebuild a cached user as a detached instance without querying the
+    database. Only the cached columns are available; callers that need
+    relationships (e.g. the subscription) must query them explicitly.
+    """
+    user = User(**user_columns)
+    make_transient_to_detached(user)
+    return user
+
+
+def _cache_user(email: str, user: User) -> Dict[str, Any]:
+    """Store a user's columns in PRINCIPAL_CACHE and return them."""
+    user_columns = {key: getattr(user, key) for key in _CACHED_USER_COLUMNS}
+    PRINCIPAL_CACHE[email] = (user_columns, time.time() + PRINCIPAL_CACHE_TTL)
+    PRINCIPAL_CACHE.move_to_end(email)
+    while len(PRINCIPAL_CACHE) > PRINCIPAL_CACHE_MAX_SIZE:
+        PRINCIPAL_CACHE.popitem(last=False)
+    return user_columns
+
+
+async def get_cached_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+    """Look up a user by email, serving repeated lookups from PRINCIPAL_CACHE."""
+    cached = PRINCIPAL_CACHE.get(email)
+    if cached and cached[1] > time.time():
+        PRINCIPAL_CACHE.move_to_end(email)
+        PRINCIPAL_CACHE_STATS['hits'] += 1
+        return _detached_user(cached[0])
+    
+    PRINCIPAL_CACHE_STATS['misses'] += 1
+    result = await db.execute(select(User).where(User.email == email))
+    user = result.scalar_one_or_none()
+    if user is None:
+        return None
+    # Hand out a detached copy, as for cache hits, so the caller never
+    # triggers lazy loads through the async session
+    return _detached_user(_cache_user(email, user))
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def invalidate_cached_user(user_id: int):
+    """Drop a user from PRINCIPAL_CACHE and API_KEY_CACHE after it is updated or deleted."""
+    for email, (user_columns, _) in list(PRINCIPAL_CACHE.items()):
+        if user_columns.get('id') == user_id:
+            del PRINCIPAL_CACHE[email]
+            PRINCIPAL_CACHE_STATS['invalidations'] += 1
+    
+    # Verified API keys carry a copy of their owner as well
+    for key_hash, entry in list(API_KEY_CACHE.items()):
+        if entry[2].get('id') == user_id:
+            del API_KEY_CACHE[key_hash]
+            API_KEY_CACHE_STATS['invalidations'] += 1
+
+
+def get_principal_cache_stats() -> Dict[str, Any]:
+    """Get a snapshot of the principal cache for metrics."""
+    return dict(PRINCIPAL_CACHE_STATS, size=len(PRINCIPAL_CACHE))
+
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    # The rate limiter and the route dependencies resolve the same token;
+    # only do the work once per request
+    memoized = getattr(request.state, PRINCIPAL_STATE_KEY, None)
+    if memoized is not None and memoized[0] == token:
+        PRINCIPAL_CACHE_STATS['request_hits'] += 1
+        return memoized[1]
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -139,45 +303,35 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         # Decode the JWT token
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
         
-        # Print decoded token payload for debugging
-        print("🔍 Decoded JWT payload:", payload)
-        logger.debug(f"Decoded JWT payload: {payload}")
-        
         # Get the subject from payload and validate it's not None
         email = payload.get("sub")
         if email is None:
-            print("❌ Missing 'sub' in JWT payload")
-            logger.error("Missing 'sub' field in JWT payload")
+            log_event(logger, logging.WARNING, "token_rejected", reason="missing_sub")
             raise credentials_exception
         
-        print(f"📧 Found email in token: {email}")
-        
         # Safely create TokenPayload with the email
         token_payload = TokenPayload(sub=email)
-        print("✅ TokenPayload validated:", token_payload.dict())
-        logger.debug(f"TokenPayload validated: {token_payload.dict()}")
         
     except JWTError as e:
-        print(f"❌ JWTError: {e}")
-        logger.error(f"JWT decoding error: {str(e)}")
+        log_event(logger, logging.INFO, "token_rejected", reason="jwt_error", error=str(e))
         raise HTTPException(status_code=401, detail="Invalid token")
     except ValidationError as ve:
-        print(f"❌ TokenPayload validation error: {ve}")
-        logger.error(f"TokenPayload validation error: {str(ve)}")
+        log_event(logger, logging.WARNING, "token_rejected", reason="invalid_schema", error=str(ve))
         raise HTTPException(status_code=422, detail="Invalid token schema")
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Unexpected error: {e}")
         logger.error(f"Unexpected token validation error: {str(e)}")
         raise credentials_exception
     
     # Lookup user by email from token
-    user = get_user_by_email(db, email=token_payload.sub)
+    user = await get_cached_user_by_email(db, email=token_payload.sub)
     if user is None:
-        print(f"❌ User not found for email: {token_payload.sub}")
-        logger.error(f"User not found for email: {token_payload.sub}")
+        log_event(logger, logging.WARNING, "token_rejected", reason="unknown_user")
         raise credentials_exception
     
-    print(f"✅ User found: {user.username} (email: {user.email})")
+    sampled_debug(logger, "principal_resolved", user_id=user.id)
+    setattr(request.state, PRINCIPAL_STATE_KEY, (token, user))
     return user
 
 
@@ -197,18 +351,76 @@ async def get_admin_user(current_user: User = Depends(get_current_active_user)):
     return current_user
 
 
-def validate_api_key(api_key: str, db: Session):
-    """Validate API key and return the associated user if valid."""
-    db_api_key = db.query(ApiKey).filter(ApiKey.key == api_key, ApiKey.is_active == True).first()
-    if db_api_key is None:
+async def validate_api_key(api_key: str, db: AsyncSession):
+    """
+    Validate API key and return the associated user if valid.
+    
+    Successful verifications are cached by key hash, so repeated requests
+    with the same key do not touch the database. The user is returned
+    detached, as for get_current_user.
+    """
+    key_hash = hash_api_key(api_key)
+    
+    cached = API_KEY_CACHE.get(key_hash)
+    if cached and cached[3] > time.time():
+        API_KEY_CACHE.move_to_end(key_hash)
+        API_KEY_CACHE_STATS['hits'] += 1
+        # The key may have expired since it was cached
+        if cached[1] is not None and cached[1] < datetime.utcnow():
+            return None
+        return _detached_user(cached[2])
+    
+    # Keys that cannot exist are rejected without a database query
+    if not await API_KEY_FILTER.might_be_valid_async(api_key_prefix(api_key), key_hash, db):
+        return None
+    
+    API_KEY_CACHE_STATS['misses'] += 1
+    result = await db.execute(
+        select(ApiKey).options(joinedload(ApiKey.user)).where(
+            ApiKey.prefix == api_key_prefix(api_key),
+            ApiKey.is_active == True
+        )
+    )
+    candidates = result.scalars().all()
+    db_api_key = next(
+        (candidate for candidate in candidates
+         if candidate.key_hash and hmac.compare_digest(candidate.key_hash, key_hash)),
+        None
+    )
+    if db_api_key is None or db_api_key.user is None:
+        API_KEY_FILTER.remember_invalid(key_hash)
         return None
         
     # Check if expires_at is set and if it's in the past
     if db_api_key.expires_at is not None:
         if db_api_key.expires_at < datetime.utcnow():
             return None
+    
+    user_columns = {key: getattr(db_api_key.user, key) for key in _CACHED_USER_COLUMNS}
+    API_KEY_CACHE[key_hash] = (
+        db_api_key.id,
+        db_api_key.expires_at,
+        user_columns,
+        time.time() + API_KEY_CACHE_TTL
+    )
+    API_KEY_CACHE.move_to_end(key_hash)
+    while len(API_KEY_CACHE) > API_KEY_CACHE_MAX_SIZE:
+        API_KEY_CACHE.popitem(last=False)
             
-    return db_api_key.user
+    return _detached_user(user_columns)
+
+
+def invalidate_cached_api_key(api_key_id: int):
+    """Drop an API key from API_KEY_CACHE after it is deactivated, activated or deleted."""
+    for key_hash, entry in list(API_KEY_CACHE.items()):
+        if entry[0] == api_key_id:
+            del API_KEY_CACHE[key_hash]
+            API_KEY_CACHE_STATS['invalidations'] += 1
+
+
+def get_api_key_cache_stats() -> Dict[str, Any]:
+    """Get a snapshot of the API key cache for metrics."""
+    return dict(API_KEY_CACHE_STATS, size=len(API_KEY_CACHE))
 
 
 def initialize_default_users(db: Session):
@@ -0,0 +1,196 @@
+"""
+Application bootstrap.
+
+Importing the app and running its startup event do no database work, so a
+worker starts accepting connections immediately even if the database is
+briefly unavailable. Database setup runs afterwards in a background task:
+
+1. schema: create missing tables on a fresh database
+2. partitions: the current and next month's partitions of the time-series
+   tables, so no row lands in a default partition
+3. seed: subscription tiers, default users and subscriptions
+4. caches: subscription limits cache and credential filters
+5. background jobs that need the schema (partition maintenance, retention,
+   rollup compaction, dashboard cache invalidation listener)
+
+Every step is idempotent, so the whole sequence is retried with backoff until
+it succeeds. `/ready` reports 503 until it has, while `/health` only reports
+liveness. How long each phase took is kept in STARTUP_STATS for metrics.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import inspect
+
+from .credential_filter import load_credential_filters
+from .dashboard_cache import start_dashboard_listener
+from .database import Base, SessionLocal, engine
+from .initialize_db import initialize_database
+from .middleware.rate_limit import warm_limits_cache
+from .partitions import ensure_startup_partitions, start_partition_maintenance
+from .retention import start_retention
+from .rollups import start_rollup_compactor
+
+logger = logging.getLogger(__name__)
+
+# Backoff between bootstrap attempts, in seconds
+BOOTSTRAP_RETRY_INITIAL = 1.0
+BOOTSTRAP_RETRY_MAX = 30.0
+
+# Set when the application module starts importing (see mark_import_started)
+_import_started: Optional[float] = None
+
+BOOTSTRAP_STATE = {
+    'ready': False,
+    'phase': 'pending',
+    'attempts': 0,
+    'last_error': None,
+}
+
+# Durations in seconds, for metrics
+STARTUP_STATS: Dict[str, Any] = {
+    'import_seconds': None,
+    'startup_event_seconds': None,
+    'bootstrap_seconds': None,
+    'time_to_ready_seconds': None,
+    'steps': {},
+}
+
+_bootstrap_task: Optional[asyncio.Task] = None
+
+
+def mark_import_started(started: float):
+    """Record when the application started loading (perf_counter), as the reference for startup times."""
+    global _import_started
+    _import_started = started
+
+
+def _since_import() -> Optional[float]:
+    return time.perf_counter() - _import_started if _import_started is not None else None
+
+
+def mark_startup_event(started: float):
+    """Record the import time and how long the startup event itself took."""
+    STARTUP_STATS['startup_event_seconds'] = time.perf_counter() - started
+    if _import_started is not None:
+        STARTUP_STATS['import_seconds'] = started - _import_started
+
+
+def ensure_schema() -> bool:
+    """Create the tables on a fresh database. Returns True if they were created."""
+    if inspect(engine).has_table("probe_nodes"):
+        return False
+    logger.info("Creating missing database tables...")
+    Base.metadata.create_all(bind=engine)
+    return True
+
+
+def seed_database() -> Dict[str, Any]:
+    """Create subscription tiers, default users and subscriptions where missing."""
+    return initialize_database()
+
+
+def warm_caches() -> int:
+    """Load the subscription limits cache and the credential filters."""
+    db = SessionLocal()
+    try:
+        cached_users = warm_limits_cache(db)
+        load_credential_filters(db)
+        return cached_users
+    finally:
+        db.close()
+
+
+def start_dependent_tasks():
+    """Start background jobs that need the schema to exist."""
+    start_partition_maintenance()
+    start_retention()
+    start_rollup_compactor()
+    start_dashboard_listener()
+
+
+async def _run_step(name: str, func):
+    BOOTSTRAP_STATE['phase'] = name
+    start = time.perf_counter()
+    # Blocking database work runs in a worker thread to keep the event loop free
+    result = await asyncio.to_thread(func)
+    STARTUP_STATS['steps'][name] = time.perf_counter() - start
+    return result
+
+
+async def run_bootstrap():
+    """Run the bootstrap steps, retrying with backoff until they all succeed."""
+    start = time.perf_counter()
+    delay = BOOTSTRAP_RETRY_INITIAL
+
+    while True:
+        BOOTSTRAP_STATE['attempts'] += 1
+        try:
+            if await _run_step('schema', ensure_schema):
+                logger.info("Database tables created")
+            created_partitions = await _run_step('partitions', ensure_startup_partitions)
+            if created_partitions:
+                logger.info(f"Created {created_partitions} table partitions")
+            seed_result = await _run_step('seed', seed_database)
+            logger.info(f"Database initialization completed: {seed_result}")
+            cached_users = await _run_step('caches', warm_caches)
+            logger.info(f"Subscription limits cache warmed for {cached_users} users")
+            break
+        except Exception as e:
+            BOOTSTRAP_STATE['last_error'] = str(e)[:200]
+            logger.error(f"Bootstrap step '{BOOTSTRAP_STATE['phase']}' failed, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BOOTSTRAP_RETRY_MAX)
+
+    start_dependent_tasks()
+
+    BOOTSTRAP_STATE['ready'] = True
+    BOOTSTRAP_STATE['phase'] = 'ready'
+    BOOTSTRAP_STATE['last_error'] = None
+    STARTUP_STATS['bootstrap_seconds'] = time.perf_counter() - start
+    STARTUP_STATS['time_to_ready_seconds'] = _since_import()
+    logger.info(
+        f"Bootstrap completed in {STARTUP_STATS['bootstrap_seconds']:.2f}s "
+        f"after {BOOTSTRAP_STATE['attempts']} attempt(s)"
+    )
+
+
+def start_bootstrap():
+    """Start the bootstrap in the background."""
+    global _bootstrap_task
+
+    if _bootstrap_task is not None and not _bootstrap_task.done():
+        return
+    _bootstrap_task = asyncio.create_task(run_bootstrap())
+
+
+async def stop_bootstrap():
+    """Cancel the bootstrap if it is still running."""
+    global _bootstrap_task
+
+    if _bootstrap_task is not None:
+        _bootstrap_task.cancel()
+        try:
+            await _bootstrap_task
+        except asyncio.CancelledError:
+            pass
+        _bootstrap_task = None
+
+
+def is_ready() -> bool:
+    """Check whether the bootstrap has completed."""
+    return BOOTSTRAP_STATE['ready']
+
+
+def get_startup_stats() -> Dict[str, Any]:
+    """Get startup timings and bootstrap state for metrics."""
+    return dict(
+        STARTUP_STATS,
+        steps=dict(STARTUP_STATS['steps']),
+        ready=BOOTSTRAP_STATE['ready'],
+        phase=BOOTSTRAP_STATE['phase'],
+        attempts=BOOTSTRAP_STATE['attempts']
+    )
@@ -1,10 +1,38 @@
 from pydantic_settings import BaseSettings
 from pydantic import validator
+from sqlalchemy.engine import make_url
 import os
 import json
 from typing import Optional, List, Union
 
 
+# libpq connection parameters asyncpg does not accept; sslmode is translated
+# to asyncpg's ssl argument instead
+LIBPQ_ONLY_PARAMETERS = {
+    "sslmode", "sslcert", "sslkey", "sslrootcert", "sslcrl", "sslpassword", "sslcompression",
+    "connect_timeout", "application_name", "options", "target_session_attrs", "gssencmode",
+    "channel_binding", "keepalives", "keepalives_idle", "keepalives_interval", "keepalives_count",
+}
+
+
+def to_async_url(url: str) -> str:
+    """
+    Convert a PostgreSQL URL to use the asyncpg driver.
+
+    libpq-only query parameters are dropped, and `sslmode` becomes asyncpg's
+    `ssl` argument (which takes the same mode names).
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() not in ("postgresql", "postgres"):
+        return url
+
+    query = {name: value for name, value in parsed.query.items() if name not in LIBPQ_ONLY_PARAMETERS}
+    sslmode = parsed.query.get("sslmode")
+    if sslmode and "ssl" not in query:
+        query["ssl"] = sslmode
+    return parsed.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+
+
 class Settings(BaseSettings):
     """Application settings."""
     
@@ -19,15 +47,69 @@ class Settings(BaseSettings):
         """Get the database URL."""
         return self.DATABASE_URL
     
+    # Optional explicit URL for the async engine; derived from DATABASE_URL if unset
+    ASYNC_DATABASE_URL: Optional[str] = os.getenv("ASYNC_DATABASE_URL")
+    
+    @property
+    def async_database_url(self) -> str:
+        """Get the database URL for the async (asyncpg) engine."""
+        return self.ASYNC_DATABASE_URL or to_async_url(self.DATABASE_URL)
+    
+    # Connection pool sizing, applied to each engine (sync/async, primary/replica)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    # Connections allowed beyond DB_POOL_SIZE under load
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    # Seconds to wait for a free connection before failing the checkout
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    # Seconds after which pooled connections are replaced
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "300"))
+    
+    # Optional read replica for read-only endpoints; reads use the primary if unset
+    DATABASE_REPLICA_URL: Optional[str] = os.getenv("DATABASE_REPLICA_URL")
+    # Maximum replication lag (seconds) before reads fall back to the primary
+    REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+    
+    @property
+    def async_replica_database_url(self) -> Optional[str]:
+        """Get the read replica URL for the async (asyncpg) engine."""
+        return to_async_url(self.DATABASE_REPLICA_URL) if self.DATABASE_REPLICA_URL else None
+    
     # JWT settings
     SECRET_KEY: str = os.getenv("SECRET_KEY", "super-secret-key-change-in-production")
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
+    # Password hashing settings
+    # Existing hashes made with a different cost are upgraded on next login
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+    # Maximum hashing jobs running or waiting before logins are shed with 503
+    PASSWORD_HASH_QUEUE_LIMIT: int = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+    
     # CORS settings - using Union type to allow both string and list inputs
     # This enables Pydantic to handle various formats correctly
     CORS_ORIGINS: Union[str, List[str]] = ["*"]
     
+    # Logging settings
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # Per-logger overrides, e.g. "app.auth=DEBUG,sqlalchemy.engine=WARNING"
+    LOG_LEVELS: str = os.getenv("LOG_LEVELS", "uvicorn=INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+    # Maximum sampled debug events per second per event name
+    LOG_SAMPLE_RATE: int = int(os.getenv("LOG_SAMPLE_RATE", "10"))
+    
+    # History retention by tier (SubscriptionTier.max_history_days)
+    RETENTION_ENABLED: bool = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+    # Maximum rows deleted per transaction, and the pause between batches (seconds)
+    RETENTION_BATCH_SIZE: int = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+    RETENTION_BATCH_DELAY: float = float(os.getenv("RETENTION_BATCH_DELAY", "0.2"))
+    
+    # Bearer token required to scrape /metrics. Without a token the endpoint
+    # is disabled, unless METRICS_PUBLIC opts in to serving it unauthenticated
+    # (for scrapers on a private network)
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+    METRICS_PUBLIC: bool = os.getenv("METRICS_PUBLIC", "false").lower() == "true"
+    
     # Diagnostic tool settings
     PROBE_TIMEOUT: int = 5  # seconds
     
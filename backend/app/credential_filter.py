@@ -0,0 +1,241 @@
+"""
+Negative-lookup filters for credentials.
+
+Credential-stuffing bursts against `X-API-Key` and the probe node WebSocket
+would otherwise cost one database query per attempt. Each CredentialFilter
+keeps a counting Bloom filter over the credentials that exist (API key
+prefixes, node API keys) plus a short-lived negative cache of credentials that
+were recently rejected. A credential the filter has never seen is rejected in
+memory; anything else still goes to the database.
+
+The filters are loaded at startup and kept current incrementally: keys created
+in this worker are added immediately and keys created by other workers are
+picked up by a throttled `id > last_seen_id` refresh that runs when an unknown
+credential shows up. Deleting a key removes it from the filter.
+"""
+
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .models import ApiKey, ProbeNode
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between incremental refreshes triggered by unknown credentials
+FILTER_REFRESH_INTERVAL = 1.0
+
+# Seconds a rejected credential stays in the negative cache, and its size
+NEGATIVE_CACHE_TTL = 10.0
+NEGATIVE_CACHE_MAX_SIZE = 50000
+
+
+class CountingBloomFilter:
+    """
+    Bloom filter with small counters instead of bits, so members can be removed.
+    False positives are possible (and only cost a database lookup); false
+    negatives are not, as long as every removed member had been added.
+    """
+
+    def __init__(self, capacity: int = 200000, error_rate: float = 0.001):
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.counters = bytearray(self.size)
+
+    def _positions(self, item: str) -> List[int]:
+        # Double hashing: k positions derived from two 64-bit hashes
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            if self.counters[position] < 255:
+                self.counters[position] += 1
+
+    def remove(self, item: str):
+        for position in self._positions(item):
+            # Saturated counters are left alone; they may be shared by many members
+            if 0 < self.counters[position] < 255:
+                self.counters[position] -= 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.counters[position] for position in self._positions(item))
+
+
+class CredentialFilter:
+    """Membership filter plus negative cache for one kind of credential."""
+
+    def __init__(self, name: str, loader: Callable[[Session, int], Iterable[Tuple[int, str]]]):
+        self.name = name
+        # loader(db, after_id) returns (id, member) rows with id > after_id
+        self._loader = loader
+        self._filter = CountingBloomFilter()
+        self._negative: "OrderedDict[str, float]" = OrderedDict()
+        self.loaded = False
+        self.last_seen_id = 0
+        self.last_refresh = 0.0
+        self.stats = {
+            'checks': 0,
+            'filter_rejections': 0,
+            'negative_cache_rejections': 0,
+            'passed': 0,
+            'refreshes': 0,
+        }
+
+    def load(self, db: Session) -> int:
+        """Load all existing credentials. Returns the number added."""
+        self._filter = CountingBloomFilter()
+        self.last_seen_id = 0
+        added = self.refresh(db)
+        self.loaded = True
+        logger.info(f"Credential filter '{self.name}' loaded with {added} entries")
+        return added
+
+    def refresh(self, db: Session) -> int:
+        """Add credentials created since the last refresh (by any worker)."""
+        # Set first so concurrent checks do not start a second refresh
+        self.last_refresh = time.time()
+        added = 0
+        for row_id, member in self._loader(db, self.last_seen_id):
+            if member:
+                self._filter.add(member)
+                added += 1
+            self.last_seen_id = max(self.last_seen_id, row_id)
+        self.stats['refreshes'] += 1
+        return added
+
+    def add(self, member: str):
+        """Add a newly created credential."""
+        self._filter.add(member)
+
+    def remove(self, member: str):
+        """Remove a deleted credential."""
+        self._filter.remove(member)
+
+    def might_be_valid(self, member: str, credential_hash: str, db: Session) -> bool:
+        """
+        Check whether a credential could be valid.
+
+        `member` is what the filter stores (e.g. the key prefix) and
+        `credential_hash` identifies the full credential in the negative cache.
+        Returns False only for credentials that are certainly invalid.
+        """
+        decision = self._check(member, credential_hash)
+        if decision is not None:
+            return decision
+        try:
+            self.refresh(db)
+        except Exception as e:
+            return self._refresh_failed(e)
+        return self._check_after_refresh(member, credential_hash)
+
+    async def might_be_valid_async(self, member: str, credential_hash: str, db: AsyncSession) -> bool:
+        """Same as might_be_valid, refreshing through an async session."""
+        decision = self._check(member, credential_hash)
+        if decision is not None:
+            return decision
+        try:
+            await db.run_sync(self.refresh)
+        except Exception as e:
+            return self._refresh_failed(e)
+        return self._check_after_refresh(member, credential_hash)
+
+    def _check(self, member: str, credential_hash: str) -> Optional[bool]:
+        """Decide from memory; None means a refresh is due before deciding."""
+        self.stats['checks'] += 1
+
+        expires_at = self._negative.get(credential_hash)
+        if expires_at is not None:
+            if expires_at > time.time():
+                self.stats['negative_cache_rejections'] += 1
+                return False
+            del self._negative[credential_hash]
+
+        if not self.loaded or member in self._filter:
+            self.stats['passed'] += 1
+            return True
+
+        # Possibly created by another worker since our last refresh
+        if time.time() - self.last_refresh >= FILTER_REFRESH_INTERVAL:
+            return None
+
+        self.stats['filter_rejections'] += 1
+        return False
+
+    def _check_after_refresh(self, member: str, credential_hash: str) -> bool:
+        if member in self._filter:
+            self.stats['passed'] += 1
+            return True
+        # Confirmed absent right after a refresh; remember it
+        self.remember_invalid(credential_hash)
+        self.stats['filter_rejections'] += 1
+        return False
+
+    def _refresh_failed(self, error: Exception) -> bool:
+        # Fail open; the database lookup that follows decides
+        logger.error(f"Error refreshing credential filter '{self.name}': {error}")
+        self.stats['passed'] += 1
+        return True
+
+    def remember_invalid(self, credential_hash: str):
+        """Cache a credential that failed verification."""
+        self._negative[credential_hash] = time.time() + NEGATIVE_CACHE_TTL
+        self._negative.move_to_end(credential_hash)
+        while len(self._negative) > NEGATIVE_CACHE_MAX_SIZE:
+            self._negative.popitem(last=False)
+
+    def forget_invalid(self, credential_hash: str):
+        """Drop a credential from the negative cache, e.g. after it is re-activated."""
+        self._negative.pop(credential_hash, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get a snapshot of the filter for metrics, including the rejection rate."""
+        rejections = self.stats['filter_rejections'] + self.stats['negative_cache_rejections']
+        return dict(
+            self.stats,
+            loaded=self.loaded,
+            negative_cache_size=len(self._negative),
+            rejection_rate=rejections / self.stats['checks'] if self.stats['checks'] else 0.0
+        )
+
+
+def _load_api_key_prefixes(db: Session, after_id: int) -> List[Tuple[int, str]]:
+    return db.query(ApiKey.id, ApiKey.prefix).filter(ApiKey.id > after_id).order_by(ApiKey.id).all()
+
+
+def _load_node_api_keys(db: Session, after_id: int) -> List[Tuple[int, str]]:
+    return db.query(ProbeNode.id, ProbeNode.api_key).filter(ProbeNode.id > after_id).order_by(ProbeNode.id).all()
+
+
+# Filter over API key prefixes (keys are stored hashed, prefixes are public)
+API_KEY_FILTER = CredentialFilter("api_keys", _load_api_key_prefixes)
+
+# Filter over probe node API keys
+NODE_KEY_FILTER = CredentialFilter("node_api_keys", _load_node_api_keys)
+
+
+def load_credential_filters(db: Session):
+    """Load all credential filters, e.g. at startup."""
+    API_KEY_FILTER.load(db)
+    NODE_KEY_FILTER.load(db)
+
+
+def hash_credential(credential: str) -> str:
+    """Hash a credential for the negative cache so plaintext is never kept in memory."""
+    return hashlib.sha256(credential.encode("utf-8")).hexdigest()
+
+
+def get_credential_filter_stats() -> Dict[str, Any]:
+    """Get a snapshot of all credential filters for metrics."""
+    return {
+        'api_keys': API_KEY_FILTER.get_stats(),
+        'node_api_keys': NODE_KEY_FILTER.get_stats(),
+    }
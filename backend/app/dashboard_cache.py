@@ -0,0 +1,193 @@
+"""
+Per-user dashboard metrics cache.
+
+`/metrics/dashboard` is polled by the frontend, so its result is cached per
+user for DASHBOARD_CACHE_TTL seconds. Writes that change a user's dashboard
+(API keys, scheduled probes) invalidate the entry, and every worker hears
+about it:
+
+- the writer drops the entry locally and sends `pg_notify` in the same
+  transaction, so the notification is delivered only if the write commits
+- each worker LISTENs on DASHBOARD_CHANNEL with a dedicated connection and
+  drops the entries it is told about
+
+The cache is only used while this worker is listening. After the listener
+connection is lost, the worker bypasses the cache, and when it reconnects it
+clears everything, since notifications may have been missed. A result
+computed while an invalidation arrived is not stored, so a computation that
+raced with a write cannot cache the old value. Dashboards may be read from the
+replica, so one computed right after a write can still miss it by the replica
+lag; the TTL bounds how long such a result is served.
+
+Diagnostic figures come from the rollups, which change only when the
+compactor runs, so new diagnostics do not invalidate the cache; the TTL is
+kept below the compaction interval instead.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_TTL = 30  # seconds
+DASHBOARD_CACHE_MAX_SIZE = 10000
+
+# Postgres notification channel; the payload is the user id, or "*" for all users
+DASHBOARD_CHANNEL = "dashboard_invalidate"
+
+# Seconds between liveness checks of the listener connection, and the
+# longest wait before reconnecting after it fails
+LISTENER_CHECK_INTERVAL = 10.0
+LISTENER_RETRY_MAX = 30.0
+
+# Structure: {user_id: (payload, expires_at)}, in LRU order
+DASHBOARD_CACHE: "OrderedDict[int, Tuple[Dict[str, Any], float]]" = OrderedDict()
+DASHBOARD_CACHE_STATS = {
+    'hits': 0,
+    'misses': 0,
+    'bypassed': 0,
+    'invalidations': 0,
+    'notifications': 0,
+    'listener_connects': 0,
+    'listener_errors': 0,
+}
+
+# Whether notifications from other workers are being received
+_listening = False
+# Incremented on every invalidation, to detect races with a computation
+_invalidation_epoch = 0
+_listener_task: Optional[asyncio.Task] = None
+
+
+def _invalidate_local(user_id: Optional[int]):
+    """Drop one user's entry, or every entry when user_id is None."""
+    global _invalidation_epoch
+
+    _invalidation_epoch += 1
+    if user_id is None:
+        DASHBOARD_CACHE_STATS['invalidations'] += len(DASHBOARD_CACHE)
+        DASHBOARD_CACHE.clear()
+    elif DASHBOARD_CACHE.pop(user_id, None) is not None:
+        DASHBOARD_CACHE_STATS['invalidations'] += 1
+
+
+def get_cached_dashboard(user_id: int) -> Tuple[Optional[Dict[str, Any]], int]:
+    """
+    Look up a user's dashboard.
+
+    Returns the cached payload (or None) and the epoch to pass to
+    cache_dashboard when storing a freshly computed one.
+    """
+    if not _listening:
+        DASHBOARD_CACHE_STATS['bypassed'] += 1
+        return None, _invalidation_epoch
+
+    cached = DASHBOARD_CACHE.get(user_id)
+    if cached and cached[1] > time.time():
+        DASHBOARD_CACHE.move_to_end(user_id)
+        DASHBOARD_CACHE_STATS['hits'] += 1
+        return cached[0], _invalidation_epoch
+
+    DASHBOARD_CACHE_STATS['misses'] += 1
+    return None, _invalidation_epoch
+
+
+def cache_dashboard(user_id: int, payload: Dict[str, Any], epoch: int):
+    """Store a dashboard computed since `epoch`, unless an invalidation arrived meanwhile."""
+    if not _listening or epoch != _invalidation_epoch:
+        return
+    DASHBOARD_CACHE[user_id] = (payload, time.time() + DASHBOARD_CACHE_TTL)
+    DASHBOARD_CACHE.move_to_end(user_id)
+    while len(DASHBOARD_CACHE) > DASHBOARD_CACHE_MAX_SIZE:
+        DASHBOARD_CACHE.popitem(last=False)
+
+
+def invalidate_dashboard(db: Session, user_id: int):
+    """Invalidate a user's dashboard on every worker once db's transaction commits."""
+    _invalidate_local(user_id)
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": DASHBOARD_CHANNEL, "payload": str(user_id)})
+
+
+async def invalidate_dashboard_async(db: AsyncSession, user_id: int):
+    """Async variant of invalidate_dashboard."""
+    _invalidate_local(user_id)
+    await db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": DASHBOARD_CHANNEL, "payload": str(user_id)})
+
+
+def _on_notification(connection, pid, channel, payload):
+    DASHBOARD_CACHE_STATS['notifications'] += 1
+    try:
+        _invalidate_local(None if payload == "*" else int(payload))
+    except ValueError:
+        logger.warning(f"Ignoring malformed dashboard invalidation: {payload!r}")
+
+
+async def dashboard_listener():
+    """Keep a LISTEN connection open, reconnecting with backoff when it fails."""
+    global _listening
+
+    # Dedicated unpooled engine: the listener holds its connection for good
+    listen_engine = create_async_engine(settings.async_database_url, poolclass=NullPool)
+    delay = 1.0
+    try:
+        while True:
+            try:
+                async with listen_engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.add_listener(DASHBOARD_CHANNEL, _on_notification)
+                    # Anything cached before now may have missed notifications
+                    _invalidate_local(None)
+                    _listening = True
+                    DASHBOARD_CACHE_STATS['listener_connects'] += 1
+                    delay = 1.0
+                    while True:
+                        await asyncio.sleep(LISTENER_CHECK_INTERVAL)
+                        await conn.execute(text("SELECT 1"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                DASHBOARD_CACHE_STATS['listener_errors'] += 1
+                logger.error(f"Dashboard invalidation listener failed, retrying in {delay:.0f}s: {e}")
+            finally:
+                _listening = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LISTENER_RETRY_MAX)
+    finally:
+        await listen_engine.dispose()
+
+
+def start_dashboard_listener():
+    """Start listening for dashboard invalidations from other workers."""
+    global _listener_task
+
+    if _listener_task is not None and not _listener_task.done():
+        return
+    _listener_task = asyncio.create_task(dashboard_listener())
+
+
+async def stop_dashboard_listener():
+    """Stop the invalidation listener; the cache is bypassed afterwards."""
+    global _listener_task
+
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+
+
+def get_dashboard_cache_stats() -> Dict[str, Any]:
+    """Get a snapshot of the dashboard cache for metrics."""
+    return dict(DASHBOARD_CACHE_STATS, size=len(DASHBOARD_CACHE), listening=_listening)
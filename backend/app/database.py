@@ -1,60 +1,326 @@
 from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import DBAPIError, OperationalError
+from fastapi import HTTPException, status
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import math
 import time
 
 from .config import settings
+from .pool_metrics import InstrumentedAsyncQueuePool, InstrumentedQueuePool, instrument_engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a new connection before giving up, so an unreachable
+# database is detected quickly instead of hanging on TCP timeouts
+DB_CONNECT_TIMEOUT = 5
+
+
+def _pool_options(pool_name: str, async_pool: bool = False) -> Dict[str, Any]:
+    """Connection pool options shared by all engines, sized from settings."""
+    return dict(
+        poolclass=InstrumentedAsyncQueuePool if async_pool else InstrumentedQueuePool,
+        pool_logging_name=pool_name,
+        pool_pre_ping=True,  # Check connection before using from pool
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        connect_args={"timeout" if async_pool else "connect_timeout": DB_CONNECT_TIMEOUT}
+    )
+
 
 # Create SQLAlchemy engine with connection pool settings for better resilience
-engine = create_engine(
-    settings.sqlalchemy_database_url,
-    pool_pre_ping=True,  # Check connection before using from pool
-    pool_recycle=300,    # Recycle connections after 5 minutes
-    pool_timeout=30,     # Wait up to 30 seconds for a connection
-    pool_size=5,         # Maintain up to 5 connections in the pool
-    max_overflow=10      # Allow up to 10 connections beyond pool_size
-)
+engine = create_engine(settings.sqlalchemy_database_url, **_pool_options("primary"))
 
 # Create SessionLocal class for database sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine (asyncpg) for routers that should not block the event loop
+# while waiting on the database. It has its own pool next to the sync one.
+async_engine = create_async_engine(settings.async_database_url, **_pool_options("primary_async", async_pool=True))
+
+# Objects stay usable after commit, since lazy refreshes cannot run
+# implicitly on an async session (e.g. during response serialization)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+instrument_engine(engine, "primary")
+instrument_engine(async_engine, "primary_async")
+
+# Optional read replica. Read-only endpoints use get_read_db/get_async_read_db,
+# which route to the replica while its replication lag is within
+# REPLICA_MAX_LAG_SECONDS and fall back to the primary otherwise.
+replica_engine = None
+async_replica_engine = None
+ReplicaSessionLocal = None
+AsyncReplicaSessionLocal = None
+
+if settings.DATABASE_REPLICA_URL:
+    replica_engine = create_engine(settings.DATABASE_REPLICA_URL, **_pool_options("replica"))
+    async_replica_engine = create_async_engine(
+        settings.async_replica_database_url,
+        **_pool_options("replica_async", async_pool=True)
+    )
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+    AsyncReplicaSessionLocal = async_sessionmaker(async_replica_engine, expire_on_commit=False, autoflush=False)
+    instrument_engine(replica_engine, "replica")
+    instrument_engine(async_replica_engine, "replica_async")
+
 # Create a Base class for models
 Base = declarative_base()
 
 
+# Seconds to answer 503 immediately after a connection failure, before
+# letting requests try the database again
+DB_FAIL_FAST_WINDOW = 5.0
+
+# Seconds between background health checks, and their timeout
+DB_HEALTH_CHECK_INTERVAL = 5.0
+DB_HEALTH_CHECK_TIMEOUT = 3.0
+
+# Connection health, updated by engine error hooks and the health monitor
+DB_HEALTH = {
+    'healthy': True,
+    'consecutive_failures': 0,
+    'last_failure': None,
+    'last_error': None,
+    'last_check': None,
+    'last_latency': None,
+    'fail_fast_until': 0.0,
+    'rejected_requests': 0,
+}
+
+# Read replica state, updated by the health monitor
+# The replica is not used until its lag has been measured once
+REPLICA_STATE = {
+    'configured': replica_engine is not None,
+    'healthy': False,
+    'lag_seconds': None,
+    'last_check': None,
+    'last_error': None,
+    'routed_reads': 0,
+    'fallback_reads': 0,
+}
+
+# Replication lag in seconds; 0 when the replica has replayed everything it received
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+_health_monitor_task: Optional[asyncio.Task] = None
+
+
+def mark_database_unhealthy(error: Any):
+    """Record a connection failure and start failing fast."""
+    if DB_HEALTH['healthy']:
+        logger.error(f"Database marked unavailable: {error}")
+    DB_HEALTH['healthy'] = False
+    DB_HEALTH['consecutive_failures'] += 1
+    DB_HEALTH['last_failure'] = time.time()
+    DB_HEALTH['last_error'] = str(error)[:200]
+    DB_HEALTH['fail_fast_until'] = time.time() + DB_FAIL_FAST_WINDOW
+
+
+def mark_database_healthy():
+    """Record a successful connection and stop failing fast."""
+    if not DB_HEALTH['healthy']:
+        logger.info("Database available again")
+    DB_HEALTH['healthy'] = True
+    DB_HEALTH['consecutive_failures'] = 0
+    DB_HEALTH['fail_fast_until'] = 0.0
+
+
+def _on_engine_error(context):
+    """Trip the breaker on failed connects and dropped connections."""
+    # A failed pre-ping just means a stale pooled connection; the pool
+    # reconnects, and a failure there is reported separately
+    if getattr(context, "is_pre_ping", False):
+        return
+    if context.is_disconnect or context.connection is None:
+        mark_database_unhealthy(context.original_exception)
+
+
+def _on_replica_error(context):
+    """Stop routing reads to the replica when its connections fail."""
+    if getattr(context, "is_pre_ping", False):
+        return
+    if context.is_disconnect or context.connection is None:
+        if REPLICA_STATE['healthy']:
+            logger.error(f"Read replica marked unavailable: {context.original_exception}")
+        REPLICA_STATE['healthy'] = False
+        REPLICA_STATE['last_error'] = str(context.original_exception)[:200]
+
+
+event.listen(engine, "handle_error", _on_engine_error)
+event.listen(async_engine.sync_engine, "handle_error", _on_engine_error)
+if replica_engine is not None:
+    event.listen(replica_engine, "handle_error", _on_replica_error)
+    event.listen(async_replica_engine.sync_engine, "handle_error", _on_replica_error)
+
+
+def check_database_available():
+    """Raise 503 without touching the database while it is known to be down."""
+    remaining = DB_HEALTH['fail_fast_until'] - time.time()
+    if remaining > 0:
+        DB_HEALTH['rejected_requests'] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database temporarily unavailable. Please try again later.",
+            headers={"Retry-After": str(math.ceil(remaining))}
+        )
+
+
 def get_db():
     """
     Dependency for getting a database session.
     
     This function creates a new database session and closes it when done.
-    It is used as a FastAPI dependency.
+    It is used as a FastAPI dependency. Stale pooled connections are handled
+    by pool_pre_ping; during an outage the request fails fast with 503.
     """
-    max_retries = 3
-    retry_delay = 1  # seconds
-    db = None
-    
-    for retry in range(max_retries):
-        db = SessionLocal()
-        try:
-            # Test connection is alive
-            db.execute(text("SELECT 1"))
-            break
-        except (DBAPIError, OperationalError) as e:
-            db.close()
-            if retry < max_retries - 1:
-                print(f"Database connection error, retrying ({retry+1}/{max_retries}): {str(e)}")
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                print(f"Failed to connect to database after {max_retries} attempts: {str(e)}")
-                raise
+    check_database_available()
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """
+    Dependency for getting an async database session.
     
-    # If we've exhausted retries and still don't have a valid db, raise an exception
-    if db is None:
-        raise RuntimeError("Failed to establish database connection")
+    A connection is only checked out from the pool once the session runs its
+    first statement, so handlers that are served from in-memory caches never
+    touch the pool.
+    """
+    check_database_available()
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def replica_usable() -> bool:
+    """Check whether reads may go to the replica under the staleness budget."""
+    lag = REPLICA_STATE['lag_seconds']
+    return (
+        REPLICA_STATE['healthy']
+        and lag is not None
+        and lag <= settings.REPLICA_MAX_LAG_SECONDS
+    )
+
+
+def get_read_db():
+    """
+    Dependency for a read-only database session.
     
+    Uses the read replica when one is configured and fresh enough, otherwise
+    the primary. Only use it for endpoints that never write and can tolerate
+    data up to REPLICA_MAX_LAG_SECONDS old.
+    """
+    if replica_usable():
+        REPLICA_STATE['routed_reads'] += 1
+        db = ReplicaSessionLocal()
+    else:
+        if REPLICA_STATE['configured']:
+            REPLICA_STATE['fallback_reads'] += 1
+        check_database_available()
+        db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_read_db():
+    """Async variant of get_read_db."""
+    if replica_usable():
+        REPLICA_STATE['routed_reads'] += 1
+        session_factory = AsyncReplicaSessionLocal
+    else:
+        if REPLICA_STATE['configured']:
+            REPLICA_STATE['fallback_reads'] += 1
+        check_database_available()
+        session_factory = AsyncSessionLocal
+    async with session_factory() as db:
+        yield db
+
+
+def get_read_engine():
+    """Get the engine for read-only work outside a session (e.g. admin browsing)."""
+    if replica_usable():
+        REPLICA_STATE['routed_reads'] += 1
+        return replica_engine
+    if REPLICA_STATE['configured']:
+        REPLICA_STATE['fallback_reads'] += 1
+    return engine
+
+
+async def _check_replica():
+    """Measure replication lag and mark the replica usable or not."""
+    try:
+        async with async_replica_engine.connect() as conn:
+            result = await asyncio.wait_for(conn.execute(REPLICA_LAG_QUERY), timeout=DB_HEALTH_CHECK_TIMEOUT)
+            lag = result.scalar()
+        REPLICA_STATE['lag_seconds'] = float(lag) if lag is not None else None
+        REPLICA_STATE['healthy'] = True
+    except Exception as e:
+        REPLICA_STATE['healthy'] = False
+        REPLICA_STATE['last_error'] = str(e)[:200]
+    REPLICA_STATE['last_check'] = time.time()
+
+
+async def database_health_monitor():
+    """Periodically check the database so recovery is noticed without traffic."""
+    while True:
+        try:
+            start = time.perf_counter()
+            async with async_engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout=DB_HEALTH_CHECK_TIMEOUT)
+            DB_HEALTH['last_latency'] = time.perf_counter() - start
+            mark_database_healthy()
+        except Exception as e:
+            # Connection failures are already recorded by the engine hook
+            if DB_HEALTH['healthy']:
+                mark_database_unhealthy(e)
+        DB_HEALTH['last_check'] = time.time()
+        if async_replica_engine is not None:
+            await _check_replica()
+        await asyncio.sleep(DB_HEALTH_CHECK_INTERVAL)
+
+
+def start_database_health_monitor():
+    """Start the background database health monitor."""
+    global _health_monitor_task
+    
+    if _health_monitor_task is not None and not _health_monitor_task.done():
+        return
+    _health_monitor_task = asyncio.create_task(database_health_monitor())
+
+
+async def stop_database_health_monitor():
+    """Stop the background database health monitor."""
+    global _health_monitor_task
+    
+    if _health_monitor_task is not None:
+        _health_monitor_task.cancel()
+        try:
+            await _health_monitor_task
+        except asyncio.CancelledError:
+            pass
+        _health_monitor_task = None
+
+
+def get_database_health() -> Dict[str, Any]:
+    """Get a snapshot of the database connection health for metrics."""
+    return dict(
+        DB_HEALTH,
+        failing_fast=DB_HEALTH['fail_fast_until'] > time.time(),
+        replica=dict(REPLICA_STATE, usable=replica_usable(), max_lag_seconds=settings.REPLICA_MAX_LAG_SECONDS)
+    )
@@ -0,0 +1,126 @@
+"""
+Cached liveness status.
+
+`/health` is polled by load balancers and orchestrators on every replica, so
+it must not touch the database. A background monitor measures event loop lag
+continuously and every HEALTH_SNAPSHOT_INTERVAL seconds builds a status
+snapshot from in-memory state only:
+
+- database reachability and latency from the database health monitor
+  (one SELECT 1 per worker every few seconds, regardless of probe traffic)
+- connection pool usage from the instrumented pools
+- the worst event loop lag seen since the previous snapshot
+
+`/health` returns the latest snapshot as is.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from .config import settings
+from .database import DB_HEALTH, replica_usable, REPLICA_STATE
+from .pool_metrics import get_pool_usage
+
+logger = logging.getLogger(__name__)
+
+# Seconds between event loop lag probes
+LOOP_LAG_PROBE_INTERVAL = 0.5
+
+# Seconds between snapshots
+HEALTH_SNAPSHOT_INTERVAL = 5.0
+
+# Thresholds above which the status is reported as degraded
+LOOP_LAG_DEGRADED = 0.5  # seconds
+POOL_USAGE_DEGRADED = 0.9  # fraction of pool_size + max_overflow in use
+
+HEALTH_SNAPSHOT: Dict[str, Any] = {
+    'status': 'starting',
+    'database': 'unknown',
+    'checked_at': None,
+}
+
+_loop_lag_max = 0.0
+_health_monitor_task: Optional[asyncio.Task] = None
+
+
+def build_health_snapshot(loop_lag: float) -> Dict[str, Any]:
+    """Build the status from in-memory state; loop_lag is the worst lag in seconds."""
+    capacity = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    pools = {
+        pool_name: round(usage['checked_out'] / capacity, 3) if capacity else 0.0
+        for pool_name, usage in get_pool_usage().items()
+    }
+    latency = DB_HEALTH['last_latency']
+
+    problems = []
+    if not DB_HEALTH['healthy']:
+        problems.append('database_unavailable')
+    if loop_lag > LOOP_LAG_DEGRADED:
+        problems.append('event_loop_lag')
+    if any(usage >= POOL_USAGE_DEGRADED for usage in pools.values()):
+        problems.append('pool_saturated')
+
+    return {
+        'status': 'degraded' if problems else 'healthy',
+        'database': 'connected' if DB_HEALTH['healthy'] else 'disconnected',
+        'problems': problems,
+        'checks': {
+            'database_latency_ms': round(latency * 1000, 1) if latency is not None else None,
+            'database_checked_at': DB_HEALTH['last_check'],
+            'replica': 'in_use' if replica_usable() else ('unavailable' if REPLICA_STATE['configured'] else 'not_configured'),
+            'event_loop_lag_ms': round(loop_lag * 1000, 1),
+            'pool_usage': pools,
+        },
+        'checked_at': time.time(),
+    }
+
+
+async def health_monitor():
+    """Measure event loop lag and refresh the cached snapshot periodically."""
+    global _loop_lag_max
+
+    loop = asyncio.get_running_loop()
+    next_snapshot = loop.time()
+    while True:
+        expected = loop.time() + LOOP_LAG_PROBE_INTERVAL
+        await asyncio.sleep(LOOP_LAG_PROBE_INTERVAL)
+        # How late the loop got around to resuming us
+        _loop_lag_max = max(_loop_lag_max, loop.time() - expected)
+
+        if loop.time() >= next_snapshot:
+            try:
+                HEALTH_SNAPSHOT.clear()
+                HEALTH_SNAPSHOT.update(build_health_snapshot(_loop_lag_max))
+            except Exception as e:
+                logger.error(f"Error building health snapshot: {e}")
+            _loop_lag_max = 0.0
+            next_snapshot = loop.time() + HEALTH_SNAPSHOT_INTERVAL
+
+
+def start_health_monitor():
+    """Start the background liveness monitor."""
+    global _health_monitor_task
+
+    if _health_monitor_task is not None and not _health_monitor_task.done():
+        return
+    _health_monitor_task = asyncio.create_task(health_monitor())
+
+
+async def stop_health_monitor():
+    """Stop the background liveness monitor."""
+    global _health_monitor_task
+
+    if _health_monitor_task is not None:
+        _health_monitor_task.cancel()
+        try:
+            await _health_monitor_task
+        except asyncio.CancelledError:
+            pass
+        _health_monitor_task = None
+
+
+def get_health_snapshot() -> Dict[str, Any]:
+    """Get the latest cached status."""
+    return HEALTH_SNAPSHOT
@@ -1,7 +1,8 @@
 import logging
+from typing import Optional
 from sqlalchemy.orm import Session
 
-from .database import get_db
+from .database import SessionLocal
 from .initialize_tiers import initialize_tiers_if_needed
 from .auth import initialize_default_users
 from .models import UserSubscription, SubscriptionTier, User
@@ -37,12 +38,17 @@ def assign_default_subscriptions(db: Session):
     
     return False
 
-def initialize_database():
-    """Run all database initialization functions."""
-    db = next(get_db())
+def initialize_database(db: Optional[Session] = None):
+    """Run all database initialization functions. Every step is idempotent."""
+    if db is None:
+        db = SessionLocal()
+        try:
+            return initialize_database(db)
+        finally:
+            db.close()
     
     # Initialize subscription tiers
-    tiers_initialized = initialize_tiers_if_needed()
+    tiers_initialized = initialize_tiers_if_needed(db)
     
     # Initialize default users
     users_initialized = initialize_default_users(db)
@@ -1,7 +1,8 @@
 from sqlalchemy.orm import Session
 import json
+from typing import Optional
 from .models import SubscriptionTier
-from .database import get_db
+from .database import SessionLocal
 from fastapi import Depends
 
 
@@ -176,9 +177,15 @@ def initialize_subscription_tiers(db: Session):
     return "Subscription tiers initialized successfully"
 
 
-def initialize_tiers_if_needed():
+def initialize_tiers_if_needed(db: Optional[Session] = None):
     """Initialize tiers if they don't exist."""
-    db = next(get_db())
+    if db is None:
+        db = SessionLocal()
+        try:
+            return initialize_tiers_if_needed(db)
+        finally:
+            db.close()
+    
     tier_count = db.query(SubscriptionTier).count()
     
     if tier_count == 0:
@@ -0,0 +1,156 @@
+"""
+Logging configuration.
+
+Log records are handed to a bounded in-memory queue and written to stdout by a
+QueueListener thread, so request handlers never block on stream I/O. When the
+queue is full, records are dropped and counted instead of stalling the caller.
+
+Events are structured: `log_event(logger, level, "event_name", key=value, ...)`
+attaches the fields to the record, and they are rendered either as JSON
+(LOG_FORMAT=json) or as `key=value` pairs after the message.
+
+Levels come from settings: LOG_LEVEL for the root logger and LOG_LEVELS for
+per-logger overrides, e.g. "app.auth=DEBUG,sqlalchemy.engine=WARNING".
+
+Debug events on hot paths go through `sampled_debug`, which emits at most
+LOG_SAMPLE_RATE events per second per event name and reports how many were
+suppressed in between.
+"""
+
+import json
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from .config import settings
+
+# Maximum number of records waiting to be written
+LOG_QUEUE_MAX_SIZE = 10000
+
+# Counters for metrics
+LOGGING_STATS = {'dropped': 0, 'suppressed': 0}
+
+# Per-event sampling state: {event: [window_start, emitted_in_window, suppressed]}
+_sample_windows: Dict[str, list] = {}
+
+_listener: Optional[QueueListener] = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records with their structured fields, as text or JSON."""
+
+    def __init__(self, json_output: bool = False):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+
+        if self.json_output:
+            entry = {
+                "time": self.formatTime(record),
+                "logger": record.name,
+                "level": record.levelname,
+                "message": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+
+        message = super().format(record)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking."""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOGGING_STATS['dropped'] += 1
+
+
+def parse_logger_levels(value: str) -> Dict[str, str]:
+    """Parse per-logger levels from "name=LEVEL,name=LEVEL"."""
+    levels = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Route all logging through the queue and apply levels from settings."""
+    global _listener
+
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_MAX_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter(json_output=settings.LOG_FORMAT.lower() == "json"))
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(settings.LOG_LEVEL.upper())
+
+    for name, level in parse_logger_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def stop_logging():
+    """Write out queued records and stop the listener thread."""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields: Any):
+    """Log a structured event. The event name is the message; fields are attached."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def sampled_debug(logger: logging.Logger, event: str, **fields: Any):
+    """
+    Log a debug event, limited to LOG_SAMPLE_RATE per second per event name.
+    Costs a single level check when debug logging is off.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+
+    now = time.monotonic()
+    window = _sample_windows.get(event)
+    if window is None or now - window[0] >= 1.0:
+        suppressed = window[2] if window else 0
+        window = _sample_windows[event] = [now, 0, 0]
+        if suppressed:
+            fields["suppressed"] = suppressed
+
+    if window[1] >= settings.LOG_SAMPLE_RATE:
+        window[2] += 1
+        LOGGING_STATS['suppressed'] += 1
+        return
+
+    window[1] += 1
+    logger.debug(event, extra={"fields": fields})
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    """Get a snapshot of the logging pipeline for metrics."""
+    queue_depth = _listener.queue.qsize() if _listener is not None else 0
+    return dict(LOGGING_STATS, queue_depth=queue_depth)
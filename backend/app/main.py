@@ -1,37 +1,37 @@
+import time
+_import_started = time.perf_counter()
+
 import logging
-from fastapi import FastAPI, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from app.routers import auth, diagnostics, api_keys, subscriptions, scheduled_probes, metrics, probe_nodes, ws_node, admin_database
-from app.database import engine, Base, get_db
+from app.database import (
+    async_engine, async_replica_engine, DB_HEALTH,
+    start_database_health_monitor, stop_database_health_monitor
+)
 from app.config import settings
-from app.initialize_db import initialize_database
-from app.middleware.rate_limit import rate_limit_dependency, start_background_tasks
-from sqlalchemy.orm import Session
+from app.bootstrap import is_ready, mark_import_started, mark_startup_event, start_bootstrap, stop_bootstrap, BOOTSTRAP_STATE
+from app.middleware.rate_limit import rate_limit_dependency, start_background_tasks, stop_background_tasks
+from app.middleware.request_accounting import RequestAccountingMiddleware
+from app.password_hashing import shutdown_password_hashing
+from app.health import get_health_snapshot, start_health_monitor, stop_health_monitor
+from app.partitions import stop_partition_maintenance
+from app.retention import stop_retention
+from app.rollups import stop_rollup_compactor
+from app.dashboard_cache import stop_dashboard_listener
+from app.logging_config import configure_logging, stop_logging, log_event
+from sqlalchemy.exc import OperationalError
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
+# Configure logging (queue-based; levels come from LOG_LEVEL / LOG_LEVELS)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Ensure all loggers have sufficient level
-logging.getLogger("app").setLevel(logging.DEBUG)
-logging.getLogger("app.auth").setLevel(logging.DEBUG)
-logging.getLogger("uvicorn").setLevel(logging.INFO)
-
-# Check database tables - only create if they don't exist
-from sqlalchemy import inspect
-inspector = inspect(engine)
-# Only create tables that don't exist yet
-if not inspector.has_table("probe_nodes"):
-    logger.info("Creating missing database tables...")
-    Base.metadata.create_all(bind=engine)
-else:
-    logger.info("Database tables already exist, skipping table creation...")
+# Table creation and other database setup run in the background bootstrap
+# (app.bootstrap) after startup, so importing the app never touches the database
+mark_import_started(_import_started)
 
 app = FastAPI(
     title="ProbeOps API",
@@ -41,12 +41,24 @@ app = FastAPI(
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    print("🔍 Validation error:", exc.errors())
+    log_event(logger, logging.INFO, "request_validation_failed", path=request.url.path, errors=len(exc.errors()))
     return JSONResponse(
         status_code=422,
         content=jsonable_encoder({"detail": exc.errors(), "body": exc.body}),
     )
 
+@app.exception_handler(OperationalError)
+async def database_error_handler(request: Request, exc: OperationalError):
+    # Lost connections during an outage are reported as 503 so clients retry
+    if exc.connection_invalidated or not DB_HEALTH['healthy']:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Database temporarily unavailable. Please try again later."},
+            headers={"Retry-After": "5"},
+        )
+    logger.error(f"Database error on {request.url.path}: {str(exc)}")
+    return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+
 # Configure CORS with values from settings
 app.add_middleware(
     CORSMiddleware,
@@ -56,6 +68,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Complete rate limiter accounting (slot release, usage logging) once each
+# response has been sent, with the real status code and latency
+app.add_middleware(RequestAccountingMiddleware)
+
 # Include routers with proper prefix
 # Note: In production, NGINX strips the /api prefix, so these routes need to match
 # what the frontend expects after the /api is stripped
@@ -78,39 +94,48 @@ async def root():
     return {"message": "Welcome to ProbeOps API"}
 
 @app.get("/health", tags=["Health"])
-async def health_check(db: Session = Depends(get_db)):
+async def health_check():
     """
-    Health check endpoint to verify API and database connection.
+    Liveness probe. Returns the status cached by the health monitor (database
+    reachability, pool usage, event loop lag) without touching the database.
     """
-    try:
-        # Check database connection by executing a simple query
-        from sqlalchemy import text
-        db.execute(text("SELECT 1")).fetchall()
-        return {
-            "status": "healthy",
-            "database": "connected"
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
-        return {
-            "status": "unhealthy",
-            "database": "disconnected",
-            "error": str(e)
-        }
+    return get_health_snapshot()
+
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """
+    Readiness probe: 200 once the bootstrap has finished and the database is
+    reachable, 503 otherwise. Use /health for liveness.
+    """
+    if is_ready() and DB_HEALTH['healthy']:
+        return {"status": "ready"}
+    return JSONResponse(
+        status_code=503,
+        content={
+            "status": "not_ready",
+            "bootstrap_phase": BOOTSTRAP_STATE['phase'],
+            "database": "connected" if DB_HEALTH['healthy'] else "unavailable",
+        },
+        headers={"Retry-After": "5"},
+    )
 
 @app.on_event("startup")
 async def startup_event():
     """
     Run initialization tasks when the application starts.
     """
+    started = time.perf_counter()
     logger.info("Starting ProbeOps API")
     
-    # Initialize database (tiers, users, etc.)
-    try:
-        init_result = initialize_database()
-        logger.info(f"Database initialization completed: {init_result}")
-    except Exception as e:
-        logger.error(f"Database initialization failed: {str(e)}")
+    # Schema, seed data, caches and partition/retention jobs; retried in the
+    # background until the database is reachable. /ready reports when done.
+    start_bootstrap()
+    
+    # Watch database connectivity so outages fail fast with 503
+    start_database_health_monitor()
+    
+    # Cache the liveness status served by /health
+    start_health_monitor()
     
     # Start background tasks for rate limiting
     try:
@@ -119,8 +144,41 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to start rate limiting tasks: {str(e)}")
     
+    mark_startup_event(started)
     logger.info("ProbeOps API started successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Run cleanup tasks when the application stops.
+    """
+    logger.info("Stopping ProbeOps API")
+    
+    await stop_bootstrap()
+    
+    # Flush buffered usage events before the process exits
+    try:
+        await stop_background_tasks()
+    except Exception as e:
+        logger.error(f"Failed to stop rate limiting tasks: {str(e)}")
+    
+    shutdown_password_hashing()
+    
+    await stop_dashboard_listener()
+    await stop_rollup_compactor()
+    await stop_retention()
+    await stop_partition_maintenance()
+    await stop_health_monitor()
+    await stop_database_health_monitor()
+    
+    # Close pooled async connections
+    await async_engine.dispose()
+    if async_replica_engine is not None:
+        await async_replica_engine.dispose()
+    
+    logger.info("ProbeOps API stopped")
+    stop_logging()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,349 @@
+"""
+Daily and monthly request quotas.
+
+Enforces `SubscriptionTier.rate_limit_day` and `rate_limit_month` without
+counting `usage_logs` rows. Each worker keeps an in-memory mirror of the
+per-user counters in the `usage_counters` rollup table, keyed by
+(user, period, period_start), and batches its own increments into periodic
+upserts. The upsert returns the combined total across workers, which refreshes
+the mirror; entries not refreshed that way are reloaded after
+QUOTA_MIRROR_TTL seconds.
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import UsageCounter, User
+
+logger = logging.getLogger(__name__)
+
+PERIOD_DAY = "day"
+PERIOD_MONTH = "month"
+
+# Seconds between counter flushes
+QUOTA_FLUSH_INTERVAL = 5.0
+
+# Seconds before a mirrored counter is reloaded from the database
+QUOTA_MIRROR_TTL = 60.0
+
+# In-memory mirror of usage_counters
+# Structure: {(user_id, period, period_start): (count, loaded_at)}
+QUOTA_COUNTERS: Dict[Tuple[int, str, date], Tuple[int, float]] = {}
+
+# Increments not yet written to usage_counters
+# Structure: {(user_id, period, period_start): increment}
+PENDING_INCREMENTS: Dict[Tuple[int, str, date], int] = defaultdict(int)
+
+# Increments taken by a flush whose upsert has not been applied yet
+FLUSHING_INCREMENTS: Dict[Tuple[int, str, date], int] = {}
+
+# Counters for metrics
+QUOTA_STATS = {'mirror_hits': 0, 'mirror_loads': 0, 'flushed_rows': 0, 'flush_errors': 0, 'rejections': 0}
+
+_flusher_task: Optional[asyncio.Task] = None
+
+
+def current_periods(now: Optional[datetime] = None) -> Dict[str, date]:
+    """Get the start date of the current day and month periods (UTC)."""
+    now = now or datetime.utcnow()
+    today = now.date()
+    return {
+        PERIOD_DAY: today,
+        PERIOD_MONTH: today.replace(day=1),
+    }
+
+
+def period_reset_time(period: str, period_start: date) -> datetime:
+    """Get the time at which a period's counter resets."""
+    if period == PERIOD_DAY:
+        return datetime.combine(period_start + timedelta(days=1), datetime.min.time())
+    next_month = (period_start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return datetime.combine(next_month, datetime.min.time())
+
+
+def _load_counters(user_id: int, periods: Dict[str, date], db: Optional[Session] = None):
+    """Load a user's counters for the given periods into the mirror."""
+    session = db or SessionLocal()
+    try:
+        rows = session.query(UsageCounter).filter(
+            UsageCounter.user_id == user_id,
+            UsageCounter.period_start.in_(list(periods.values()))
+        ).all()
+    finally:
+        if db is None:
+            session.close()
+
+    stored = {(row.period, row.period_start): row.count for row in rows}
+    loaded_at = time.time()
+    for period, period_start in periods.items():
+        key = (user_id, period, period_start)
+        # Local increments that have not been flushed yet are not in the table.
+        # Those of a flush in progress may already be, but then the flush
+        # replaces this entry with the stored total when it completes.
+        count = stored.get((period, period_start), 0) + PENDING_INCREMENTS.get(key, 0) + FLUSHING_INCREMENTS.get(key, 0)
+        QUOTA_COUNTERS[key] = (count, loaded_at)
+    QUOTA_STATS['mirror_loads'] += 1
+
+
+def _mirrored_counts(user_id: int, periods: Dict[str, date]) -> Optional[Dict[str, int]]:
+    """Get a user's counts from the mirror, or None if they need to be (re)loaded."""
+    now = time.time()
+    counts = {}
+    for period, period_start in periods.items():
+        entry = QUOTA_COUNTERS.get((user_id, period, period_start))
+        if entry is None or now - entry[1] > QUOTA_MIRROR_TTL:
+            return None
+        counts[period] = entry[0]
+    QUOTA_STATS['mirror_hits'] += 1
+    return counts
+
+
+def get_usage_counts(user_id: int, db: Optional[Session] = None) -> Dict[str, int]:
+    """
+    Get a user's request counts for the current day and month.
+    Served from memory; the database is only read when the mirror is stale.
+    """
+    periods = current_periods()
+    counts = _mirrored_counts(user_id, periods)
+    if counts is None:
+        _load_counters(user_id, periods, db)
+        counts = {period: QUOTA_COUNTERS[(user_id, period, start)][0] for period, start in periods.items()}
+    return counts
+
+
+async def get_usage_counts_async(user_id: int, db: AsyncSession) -> Dict[str, int]:
+    """Same as get_usage_counts, loading stale counters through an async session."""
+    periods = current_periods()
+    counts = _mirrored_counts(user_id, periods)
+    if counts is None:
+        await db.run_sync(lambda session: _load_counters(user_id, periods, session))
+        counts = {period: QUOTA_COUNTERS[(user_id, period, start)][0] for period, start in periods.items()}
+    return counts
+
+
+def _exhausted_period(limits: Dict, counts: Dict[str, int]) -> Optional[str]:
+    """Get the first period whose limit has been reached, if any."""
+    day_limit = limits.get('rate_limit_day')
+    month_limit = limits.get('rate_limit_month')
+    if day_limit and counts[PERIOD_DAY] >= day_limit:
+        QUOTA_STATS['rejections'] += 1
+        return PERIOD_DAY
+    if month_limit and counts[PERIOD_MONTH] >= month_limit:
+        QUOTA_STATS['rejections'] += 1
+        return PERIOD_MONTH
+    return None
+
+
+def check_quota(user_id: int, limits: Dict, db: Optional[Session] = None) -> Optional[str]:
+    """
+    Check a user's daily and monthly quotas.
+    Returns the name of the exhausted period, or None if the request is allowed.
+    """
+    if not limits.get('rate_limit_day') and not limits.get('rate_limit_month'):
+        return None
+    return _exhausted_period(limits, get_usage_counts(user_id, db))
+
+
+async def check_quota_async(user_id: int, limits: Dict, db: AsyncSession) -> Optional[str]:
+    """Same as check_quota, for callers holding an async session."""
+    if not limits.get('rate_limit_day') and not limits.get('rate_limit_month'):
+        return None
+    return _exhausted_period(limits, await get_usage_counts_async(user_id, db))
+
+
+def increment_usage(user_id: int, amount: int = 1):
+    """Count a request against the user's current day and month."""
+    for period, period_start in current_periods().items():
+        key = (user_id, period, period_start)
+        PENDING_INCREMENTS[key] += amount
+        count, loaded_at = QUOTA_COUNTERS.get(key, (0, 0.0))
+        # Keep the load time so unloaded entries are still fetched on next check
+        QUOTA_COUNTERS[key] = (count + amount, loaded_at)
+
+
+def flush_usage_counters() -> int:
+    """
+    Write pending increments to usage_counters with a single upsert.
+    Returns the number of counter rows written.
+
+    Runs every step in the calling thread; the background flusher uses
+    flush_usage_counters_async instead.
+    """
+    pending = _take_pending()
+    if not pending:
+        return 0
+    return _apply_flush(pending, _write_counters(pending))
+
+
+async def flush_usage_counters_async() -> int:
+    """
+    Same as flush_usage_counters, with the upsert in a worker thread.
+
+    The in-memory counters are only touched on the event loop, where requests
+    update them, so no increment can be lost to a concurrent update.
+    """
+    pending = _take_pending()
+    if not pending:
+        return 0
+    return _apply_flush(pending, await asyncio.to_thread(_write_counters, pending))
+
+
+def _take_pending() -> Dict[Tuple[int, str, date], int]:
+    """Swap in a fresh dict so increments made during the flush are kept."""
+    global PENDING_INCREMENTS, FLUSHING_INCREMENTS
+
+    pending, PENDING_INCREMENTS = PENDING_INCREMENTS, defaultdict(int)
+    # Still counted by mirror loads until the flush is applied
+    FLUSHING_INCREMENTS = pending
+    return pending
+
+
+def _write_counters(pending: Dict[Tuple[int, str, date], int]) -> Tuple[Optional[list], Optional[set]]:
+    """
+    Upsert a batch of increments without touching module state.
+
+    Returns the totals stored for each counter, or (None, user ids to retry)
+    when the write failed; the user ids are None when every user should be
+    retried.
+    """
+    rows: List[Dict[str, Any]] = [
+        {
+            'user_id': user_id,
+            'period': period,
+            'period_start': period_start,
+            'count': increment,
+            'updated_at': datetime.utcnow(),
+        }
+        for (user_id, period, period_start), increment in pending.items()
+    ]
+
+    statement = pg_insert(UsageCounter).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[UsageCounter.user_id, UsageCounter.period, UsageCounter.period_start],
+        set_={
+            'count': UsageCounter.count + statement.excluded.count,
+            'updated_at': statement.excluded.updated_at,
+        }
+    ).returning(UsageCounter.user_id, UsageCounter.period, UsageCounter.period_start, UsageCounter.count)
+
+    db = SessionLocal()
+    try:
+        totals = db.execute(statement).all()
+        db.commit()
+        return totals, None
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error flushing {len(rows)} usage counters: {e}")
+        # Users deleted in the meantime are not retried
+        existing = _existing_user_ids(db, {key[0] for key in pending}) if isinstance(e, IntegrityError) else None
+        return None, existing
+    finally:
+        db.close()
+
+
+def _apply_flush(pending: Dict[Tuple[int, str, date], int], result: Tuple[Optional[list], Optional[set]]) -> int:
+    """Refresh the mirror from a successful write, or merge a failed batch back for the next flush."""
+    global FLUSHING_INCREMENTS
+
+    FLUSHING_INCREMENTS = {}
+    totals, retry_users = result
+    if totals is None:
+        QUOTA_STATS['flush_errors'] += 1
+        for key, increment in pending.items():
+            if retry_users is None or key[0] in retry_users:
+                PENDING_INCREMENTS[key] += increment
+        return 0
+
+    # The returned totals include increments from every worker
+    loaded_at = time.time()
+    for user_id, period, period_start, count in totals:
+        key = (user_id, period, period_start)
+        QUOTA_COUNTERS[key] = (count + PENDING_INCREMENTS.get(key, 0), loaded_at)
+
+    QUOTA_STATS['flushed_rows'] += len(pending)
+    return len(pending)
+
+
+def _existing_user_ids(db: Session, user_ids: set) -> set:
+    """Get the subset of user ids that still exist."""
+    try:
+        return {row[0] for row in db.query(User.id).filter(User.id.in_(user_ids)).all()}
+    except Exception:
+        db.rollback()
+        return user_ids
+
+
+def prune_expired_counters():
+    """Drop mirrored counters for periods that have ended."""
+    periods = current_periods()
+    for key in list(QUOTA_COUNTERS.keys()):
+        if key[2] != periods[key[1]] and key not in PENDING_INCREMENTS:
+            del QUOTA_COUNTERS[key]
+
+
+async def quota_flush_task():
+    """Periodically write pending quota increments to the database."""
+    while True:
+        await asyncio.sleep(QUOTA_FLUSH_INTERVAL)
+        try:
+            await flush_usage_counters_async()
+            prune_expired_counters()
+        except Exception as e:
+            logger.error(f"Error in quota flush task: {e}")
+
+
+def start_quota_flusher():
+    """Start the background quota counter flusher."""
+    global _flusher_task
+
+    if _flusher_task is not None and not _flusher_task.done():
+        return
+    _flusher_task = asyncio.create_task(quota_flush_task())
+
+
+async def stop_quota_flusher():
+    """Stop the background flusher and write pending increments."""
+    global _flusher_task
+
+    if _flusher_task is not None:
+        _flusher_task.cancel()
+        try:
+            await _flusher_task
+        except asyncio.CancelledError:
+            pass
+        _flusher_task = None
+
+    await flush_usage_counters_async()
+
+
+def get_usage_summary(user_id: int, limits: Dict, db: Optional[Session] = None) -> Dict[str, Any]:
+    """Build the current day/month usage for a user, as returned by /usage."""
+    counts = get_usage_counts(user_id, db)
+    periods = current_periods()
+    summary = {}
+    for period, limit_key in ((PERIOD_DAY, 'rate_limit_day'), (PERIOD_MONTH, 'rate_limit_month')):
+        limit = limits.get(limit_key)
+        used = counts[period]
+        summary[period] = {
+            'used': used,
+            'limit': limit,
+            'remaining': max(0, limit - used) if limit else None,
+            'period_start': periods[period],
+            'resets_at': period_reset_time(period, periods[period]),
+        }
+    return summary
+
+
+def get_quota_stats() -> Dict[str, Any]:
+    """Get a snapshot of the quota counters for metrics."""
+    return dict(QUOTA_STATS, mirrored=len(QUOTA_COUNTERS), pending=len(PENDING_INCREMENTS))
@@ -5,8 +5,12 @@ This module provides a rate limiting dependency that enforces tier-based
 request limits for API endpoints. It supports:
 - Per-minute and per-hour rate limits based on subscription tier
 - Concurrent request limiting
+- Global adaptive concurrency limiting driven by observed latency
 - Request prioritization based on tier
-- Usage tracking for analytics
+- In-memory cache of subscription limits so checks avoid the database
+- Daily and monthly quotas backed by incrementally maintained counters
+- Usage tracking for analytics, completed by RequestAccountingMiddleware
+  once the response has been sent
 
 The implementation is cloud-friendly and works in containerized environments.
 """
@@ -15,14 +19,20 @@ import time
 from datetime import datetime, timedelta
 from typing import Dict, Optional, Tuple, Set, List, Union, Any, cast
 import asyncio
-from collections import defaultdict
+import heapq
+import itertools
+from collections import defaultdict, OrderedDict
 import logging
 from fastapi import Request, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 
-from ..database import get_db
+from ..database import get_async_db, SessionLocal
 from ..auth import get_current_user, validate_api_key
 from ..models import User, SubscriptionTier, UserSubscription, ApiKey, UsageLog
+from ..prometheus import RATE_LIMITER_QUEUE_WAIT
+from .usage_buffer import enqueue_usage, start_usage_flusher, stop_usage_flusher, get_usage_buffer_stats
+from .quota import check_quota_async, increment_usage, start_quota_flusher, stop_quota_flusher, get_quota_stats
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -36,8 +46,8 @@ RATE_LIMITS: Dict[int, Dict[str, Tuple[int, float]]] = {}
 ACTIVE_REQUESTS: Dict[int, Set[str]] = defaultdict(set)
 
 # Request queue for handling traffic when limits are reached
-# Structure: [(priority, timestamp, user_id, request_id, future)]
-REQUEST_QUEUE: List[Tuple[int, float, int, str, asyncio.Future]] = []
+# Structure: [(priority, timestamp, user_id, request_id, max_concurrent, future)]
+REQUEST_QUEUE: List[Tuple[int, float, int, str, int, asyncio.Future]] = []
 REQUEST_QUEUE_LOCK = asyncio.Lock()
 
 # Maximum size of the request queue
@@ -48,9 +58,228 @@ DEFAULT_LIMITS = {
     'rate_limit_minute': 10,
     'rate_limit_hour': 50,
     'max_concurrent_requests': 5,
-    'priority': 0
+    'priority': 0,
+    'rate_limit_day': None,  # No daily/monthly quota without a subscription
+    'rate_limit_month': None
 }
 
+# Keys used in request.state to hand the request context to the
+# RequestAccountingMiddleware, which completes accounting after the response
+RATE_LIMIT_STATE_KEY = "rate_limit_context"
+ACCOUNTING_STATE_KEY = "request_accounting_enabled"
+
+# Cache of subscription limits per user, in least-recently-used order
+# Structure: {user_id: (limits, expires_at)}
+LIMITS_CACHE: "OrderedDict[int, Tuple[Dict, float]]" = OrderedDict()
+
+# Maximum number of users kept in the limits cache
+LIMITS_CACHE_MAX_SIZE = 10000
+
+# Entries expire after this many seconds so changes made through other
+# workers are picked up even without an explicit invalidation
+LIMITS_CACHE_TTL = 300
+
+# Counters for metrics
+LIMITS_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+# Adaptive (global) concurrency limiter settings
+ADAPTIVE_INITIAL_LIMIT = 50      # Starting number of in-flight requests across all users
+ADAPTIVE_MIN_LIMIT = 5           # Never shrink below this many in-flight requests
+ADAPTIVE_MAX_LIMIT = 500         # Never grow beyond this many in-flight requests
+ADAPTIVE_LATENCY_TOLERANCE = 2.0 # Back off when latency exceeds its route's baseline by this factor
+ADAPTIVE_LATENCY_FLOOR = 0.001   # Seconds; baselines below this are treated as this
+ADAPTIVE_MAX_ROUTES = 1000       # Route templates tracked; samples for others are ignored
+ADAPTIVE_BACKOFF_RATIO = 0.9     # Multiplicative decrease applied on congestion
+ADAPTIVE_MAX_QUEUE = 200         # Requests allowed to wait for a global slot
+ADAPTIVE_MAX_WAIT = 5.0          # Seconds a request may wait before being shed
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Global AIMD concurrency limiter based on measured request latency.
+
+    The per-tier `max_concurrent_requests` only protects users from each other;
+    this limiter protects the backend itself. Routes have very different
+    normal latencies (a traceroute takes seconds, listing API keys takes
+    milliseconds), so each latency sample is compared with a baseline for its
+    own route template, and the limiter tracks a fast-moving average of that
+    ratio. A change in the mix of routes therefore does not look like
+    congestion. While the ratio stays close to 1 and the limit is being used,
+    the limit grows additively (about +1 per window of requests). Once it
+    climbs past `latency_tolerance` (DB pool exhausted, tool executor backed
+    up) the limit is cut multiplicatively.
+
+    Requests over the limit wait in a small priority queue and are shed once
+    the queue is full or they have waited `max_wait` seconds.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = ADAPTIVE_INITIAL_LIMIT,
+        min_limit: int = ADAPTIVE_MIN_LIMIT,
+        max_limit: int = ADAPTIVE_MAX_LIMIT,
+        latency_tolerance: float = ADAPTIVE_LATENCY_TOLERANCE,
+        backoff_ratio: float = ADAPTIVE_BACKOFF_RATIO,
+        max_queue: int = ADAPTIVE_MAX_QUEUE,
+        max_wait: float = ADAPTIVE_MAX_WAIT
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.in_flight = 0
+        # Typical latency per route template, in seconds
+        self.route_baselines: Dict[str, float] = {}
+        # Fast EWMA of latency relative to the route's baseline (1.0 = normal)
+        self.recent_ratio: Optional[float] = None
+        # Fast EWMA of raw latency, used as the window between decreases
+        self.recent_latency: Optional[float] = None
+        self.last_decrease = 0.0
+
+        # Waiters: [(-priority, sequence, future)]
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+        # Counters for metrics
+        self.accepted = 0
+        self.queued = 0
+        self.shed = 0
+        self.cancelled = 0
+        self.decreases = 0
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def _try_acquire(self) -> bool:
+        if self.in_flight < self.current_limit:
+            self.in_flight += 1
+            self.accepted += 1
+            return True
+        return False
+
+    def _remove_waiter(self, future: asyncio.Future):
+        for index, entry in enumerate(self._waiters):
+            if entry[2] is future:
+                self._waiters.pop(index)
+                heapq.heapify(self._waiters)
+                return
+
+    async def acquire(self, priority: int = 0) -> bool:
+        """
+        Acquire a global slot, waiting in the priority queue if necessary.
+        Returns False if the request should be shed.
+        """
+        if not self._waiters and self._try_acquire():
+            return True
+
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._sequence), future))
+        self.queued += 1
+
+        try:
+            # The slot is transferred to us by release() when the future resolves
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+            return True
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we timed out; keep it
+                return True
+            self._remove_waiter(future)
+            future.cancel()
+            self.shed += 1
+            return False
+        except BaseException:
+            # Cancelled while waiting (e.g. the client went away)
+            if future.done() and not future.cancelled():
+                # The slot was already handed over; pass it on
+                self.release()
+            else:
+                self._remove_waiter(future)
+                future.cancel()
+            self.cancelled += 1
+            raise
+
+    def release(self, latency: Optional[float] = None, route: Optional[str] = None):
+        """
+        Release a slot and feed the observed latency (in seconds) of a request
+        to `route` (its route template) back into the limit.
+        """
+        if latency is not None and latency >= 0:
+            self._observe(latency, route or "")
+
+        self.in_flight = max(0, self.in_flight - 1)
+
+        # Hand freed capacity to the highest priority waiters, if any
+        while self._waiters and self.in_flight < self.current_limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.in_flight += 1
+                self.accepted += 1
+                future.set_result(True)
+
+    def _observe(self, latency: float, route: str):
+        """Update latency averages and adjust the limit (AIMD)."""
+        baseline = self.route_baselines.get(route)
+        if baseline is None:
+            if len(self.route_baselines) >= ADAPTIVE_MAX_ROUTES:
+                return
+            self.route_baselines[route] = latency
+            baseline = latency
+        else:
+            # Follows improvements quickly and degradations slowly, so a
+            # sustained slowdown registers before it becomes the new normal
+            weight = 0.1 if latency < baseline else 0.01
+            self.route_baselines[route] = (1 - weight) * baseline + weight * latency
+
+        # A single outlier (slow target, cold cache) cannot trigger a decrease
+        ratio = min(latency / max(baseline, ADAPTIVE_LATENCY_FLOOR), self.latency_tolerance * 2)
+        if self.recent_ratio is None:
+            self.recent_ratio = ratio
+            self.recent_latency = latency
+            return
+        self.recent_ratio = 0.8 * self.recent_ratio + 0.2 * ratio
+        self.recent_latency = 0.8 * self.recent_latency + 0.2 * latency
+
+        now = time.time()
+        if self.recent_ratio > self.latency_tolerance:
+            # Decrease at most once per recent latency window to avoid collapse
+            if now - self.last_decrease >= max(self.recent_latency, 0.1):
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                self.last_decrease = now
+                self.decreases += 1
+        elif self.in_flight >= self.limit * 0.8:
+            # Only grow when we are actually using most of the limit
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def stats(self) -> Dict[str, Any]:
+        """Export the limiter state for metrics."""
+        return {
+            'limit': self.current_limit,
+            'in_flight': self.in_flight,
+            'queue_depth': len(self._waiters),
+            'recent_latency_ratio': self.recent_ratio,
+            'recent_latency': self.recent_latency,
+            'tracked_routes': len(self.route_baselines),
+            'accepted': self.accepted,
+            'queued': self.queued,
+            'shed': self.shed,
+            'cancelled': self.cancelled,
+            'decreases': self.decreases
+        }
+
+
+# Global limiter shared by all rate-limited endpoints in this worker
+ADAPTIVE_LIMITER = AdaptiveConcurrencyLimiter()
+
 
 async def process_queue():
     """Process the request queue, allowing requests as capacity becomes available."""
@@ -66,10 +295,10 @@ async def process_queue():
     async with REQUEST_QUEUE_LOCK:
         i = 0
         while i < len(REQUEST_QUEUE):
-            priority, _, user_id, request_id, future = REQUEST_QUEUE[i]
+            priority, _, user_id, request_id, max_concurrent, future = REQUEST_QUEUE[i]
             
             # Check if this user has capacity now
-            if can_process_request(user_id):
+            if can_process_request(user_id, max_concurrent):
                 # Remove from queue and fulfill the future
                 REQUEST_QUEUE.pop(i)
                 if not future.done():
@@ -78,44 +307,147 @@ async def process_queue():
                 i += 1
 
 
-def can_process_request(user_id: Union[int, Any]) -> bool:
+def can_process_request(user_id: Union[int, Any], max_concurrent: int) -> bool:
     """Check if a user has capacity for a new request based on concurrent limits."""
     # Ensure user_id is an integer
     user_id_int = int(user_id) if user_id is not None else 0
     
-    # Get user's subscription details
-    max_concurrent = get_user_limits(user_id_int).get('max_concurrent_requests', 
-                                               DEFAULT_LIMITS['max_concurrent_requests'])
-    
     # Check current active requests
     current_active = len(ACTIVE_REQUESTS.get(user_id_int, set()))
     return current_active < max_concurrent
 
 
 def get_user_limits(user_id: Union[int, Any], db: Optional[Session] = None) -> Dict:
-    """Get a user's subscription limits."""
+    """
+    Get a user's subscription limits.
+    
+    Limits are served from LIMITS_CACHE when possible. On a miss the
+    subscription is loaded (with its tier) using the given session, or a
+    short-lived session if none is given, and the result is cached.
+    """
+    user_id_int = int(user_id) if user_id is not None else 0
+    
+    limits = _cached_user_limits(user_id_int)
+    if limits is not None:
+        return limits
+    
     try:
         if db:
-            # Query the database for the user's subscription tier limits
-            subscription = db.query(UserSubscription).filter(
-                UserSubscription.user_id == user_id,
-                UserSubscription.is_active == True
-            ).first()
-            
-            if subscription and subscription.tier:
-                return {
-                    'rate_limit_minute': subscription.tier.rate_limit_minute,
-                    'rate_limit_hour': subscription.tier.rate_limit_hour,
-                    'max_concurrent_requests': subscription.tier.max_concurrent_requests,
-                    'priority': subscription.tier.priority,
-                    'tier_name': subscription.tier.name
-                }
-        
-        # Default limits if no subscription found or no DB connection
+            limits = _load_user_limits(user_id_int, db)
+        else:
+            session = SessionLocal()
+            try:
+                limits = _load_user_limits(user_id_int, session)
+            finally:
+                session.close()
+    except Exception as e:
+        logger.error(f"Error fetching user limits: {e}")
+        # Don't cache failures; the next request will retry the lookup
         return DEFAULT_LIMITS
+    
+    _cache_user_limits(user_id_int, limits)
+    return limits
+
+
+async def get_user_limits_async(user_id: Union[int, Any], db: AsyncSession) -> Dict:
+    """Same as get_user_limits, loading misses through an async session."""
+    user_id_int = int(user_id) if user_id is not None else 0
+    
+    limits = _cached_user_limits(user_id_int)
+    if limits is not None:
+        return limits
+    
+    try:
+        limits = await db.run_sync(lambda session: _load_user_limits(user_id_int, session))
     except Exception as e:
         logger.error(f"Error fetching user limits: {e}")
+        await db.rollback()
         return DEFAULT_LIMITS
+    
+    _cache_user_limits(user_id_int, limits)
+    return limits
+
+
+def _cached_user_limits(user_id: int) -> Optional[Dict]:
+    """Get a user's limits from LIMITS_CACHE, or None on a miss."""
+    cached = LIMITS_CACHE.get(user_id)
+    if cached and cached[1] > time.time():
+        LIMITS_CACHE.move_to_end(user_id)
+        LIMITS_CACHE_STATS['hits'] += 1
+        return cached[0]
+    
+    LIMITS_CACHE_STATS['misses'] += 1
+    return None
+
+
+def _load_user_limits(user_id: int, db: Session) -> Dict:
+    """Query the database for the user's subscription tier limits."""
+    subscription = db.query(UserSubscription).options(
+        joinedload(UserSubscription.tier)
+    ).filter(
+        UserSubscription.user_id == user_id,
+        UserSubscription.is_active == True
+    ).first()
+    
+    if subscription and subscription.tier:
+        return _limits_from_tier(subscription.tier)
+    
+    # Default limits if no subscription found
+    return DEFAULT_LIMITS
+
+
+def _limits_from_tier(tier: SubscriptionTier) -> Dict:
+    """Build a limits dictionary from a subscription tier."""
+    return {
+        'tier_id': tier.id,
+        'rate_limit_minute': tier.rate_limit_minute,
+        'rate_limit_hour': tier.rate_limit_hour,
+        'max_concurrent_requests': tier.max_concurrent_requests,
+        'priority': tier.priority,
+        'rate_limit_day': tier.rate_limit_day,
+        'rate_limit_month': tier.rate_limit_month,
+        'tier_name': tier.name
+    }
+
+
+def _cache_user_limits(user_id: int, limits: Dict):
+    """Store limits for a user, evicting the least recently used entries if full."""
+    LIMITS_CACHE[user_id] = (limits, time.time() + LIMITS_CACHE_TTL)
+    LIMITS_CACHE.move_to_end(user_id)
+    while len(LIMITS_CACHE) > LIMITS_CACHE_MAX_SIZE:
+        LIMITS_CACHE.popitem(last=False)
+        LIMITS_CACHE_STATS['evictions'] += 1
+
+
+def invalidate_user_limits(user_id: Union[int, Any]):
+    """Drop a user's cached limits after their subscription changes."""
+    user_id_int = int(user_id) if user_id is not None else 0
+    if LIMITS_CACHE.pop(user_id_int, None) is not None:
+        LIMITS_CACHE_STATS['invalidations'] += 1
+
+
+def invalidate_all_limits():
+    """Drop all cached limits, e.g. after a subscription tier is edited."""
+    LIMITS_CACHE_STATS['invalidations'] += len(LIMITS_CACHE)
+    LIMITS_CACHE.clear()
+
+
+def warm_limits_cache(db: Session) -> int:
+    """
+    Pre-load limits for users with active subscriptions.
+    Returns the number of users cached.
+    """
+    subscriptions = db.query(UserSubscription).options(
+        joinedload(UserSubscription.tier)
+    ).filter(
+        UserSubscription.is_active == True
+    ).limit(LIMITS_CACHE_MAX_SIZE).all()
+    
+    for subscription in subscriptions:
+        if subscription.tier:
+            _cache_user_limits(subscription.user_id, _limits_from_tier(subscription.tier))
+    
+    return len(subscriptions)
 
 
 def record_request_start(user_id: Union[int, Any], request_id: str):
@@ -142,26 +474,27 @@ def record_request_end(user_id: Union[int, Any], request_id: str):
     asyncio.create_task(process_queue())
 
 
-def record_usage(db: Session, user_id: Union[int, Any], endpoint: str, 
-                success: bool, response_time: float, ip_address: Optional[str] = None):
-    """Record API usage for analytics and billing."""
-    try:
-        # Ensure user_id is an integer
-        user_id_int = int(user_id) if user_id is not None else 0
-        
-        usage_log = UsageLog(
-            user_id=user_id_int,
-            endpoint=endpoint,
-            timestamp=datetime.utcnow(),
-            success=success,
-            response_time=response_time,
-            ip_address=ip_address
-        )
-        db.add(usage_log)
-        db.commit()
-    except Exception as e:
-        logger.error(f"Error recording usage: {e}")
-        db.rollback()
+def record_usage(user_id: Union[int, Any], endpoint: str, success: bool,
+                 response_time: float, ip_address: Optional[str] = None,
+                 tier_id: Optional[int] = None, was_queued: bool = False,
+                 queue_time: Optional[float] = None):
+    """
+    Record API usage for analytics and billing.
+    
+    The event is queued in memory and written in batches by the usage flusher.
+    Anonymous requests are recorded with a user_id of None.
+    """
+    enqueue_usage({
+        'user_id': int(user_id) if user_id is not None else None,
+        'endpoint': endpoint,
+        'timestamp': datetime.utcnow(),
+        'success': success,
+        'response_time': response_time,
+        'ip_address': ip_address,
+        'tier_id': tier_id,
+        'was_queued': was_queued,
+        'queue_time': queue_time
+    })
 
 
 def check_rate_limit(user_id: Union[int, Any], limits: Dict) -> bool:
@@ -207,10 +540,13 @@ def check_rate_limit(user_id: Union[int, Any], limits: Dict) -> bool:
     return True
 
 
-async def queue_request(user_id: Union[int, Any], request_id: str, priority: int) -> bool:
+async def queue_request(user_id: Union[int, Any], request_id: str, priority: int, max_concurrent: int) -> bool:
     """
     Queue a request for processing when capacity becomes available.
     Returns True if the request was queued, False if the queue is full.
+    
+    The user's concurrency limit is stored with the entry, so the queue can
+    be processed without looking up limits again.
     """
     # Ensure user_id is an integer
     user_id_int = int(user_id) if user_id is not None else 0
@@ -223,7 +559,7 @@ async def queue_request(user_id: Union[int, Any], request_id: str, priority: int
     
     # Add the request to the queue
     async with REQUEST_QUEUE_LOCK:
-        REQUEST_QUEUE.append((priority, time.time(), user_id_int, request_id, future))
+        REQUEST_QUEUE.append((priority, time.time(), user_id_int, request_id, max_concurrent, future))
     
     # Process the queue in case there's capacity now
     await process_queue()
@@ -235,7 +571,7 @@ async def queue_request(user_id: Union[int, Any], request_id: str, priority: int
     except asyncio.TimeoutError:
         # Remove from queue if timed out
         async with REQUEST_QUEUE_LOCK:
-            for i, (_, _, u_id, r_id, _) in enumerate(REQUEST_QUEUE):
+            for i, (_, _, u_id, r_id, _, _) in enumerate(REQUEST_QUEUE):
                 if u_id == user_id_int and r_id == request_id:
                     REQUEST_QUEUE.pop(i)
                     break
@@ -244,15 +580,20 @@ async def queue_request(user_id: Union[int, Any], request_id: str, priority: int
 
 async def rate_limit_dependency(
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> int:
     """
     FastAPI dependency for rate limiting.
     Returns the user_id if the request is allowed.
     Raises HTTPException if rate limits are exceeded.
     """
+    if not request.scope.get("state", {}).get(ACCOUNTING_STATE_KEY):
+        # Without the middleware, concurrency slots would never be released
+        raise RuntimeError("RequestAccountingMiddleware must be installed to use rate_limit_dependency")
+    
     start_time = time.time()
     request_id = f"{id(request)}-{start_time}"
+    queue_time = 0.0
     
     # Extract authentication (from header or query param)
     api_key = None
@@ -277,7 +618,7 @@ async def rate_limit_dependency(
     try:
         if api_key:
             # Validate API key
-            user = validate_api_key(api_key, db)
+            user = await validate_api_key(api_key, db)
             if not user:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -288,7 +629,7 @@ async def rate_limit_dependency(
             token = request.headers.get("Authorization", "").replace("Bearer ", "")
             if token:
                 try:
-                    user = await get_current_user(token, db)
+                    user = await get_current_user(request, token, db)
                 except Exception:
                     # Not authenticated via JWT, but might be public endpoint
                     pass
@@ -306,13 +647,18 @@ async def rate_limit_dependency(
     # Ensure user_id is an integer
     user_id_int = int(user_id) if user_id is not None else 0
     
-    # Get user's subscription limits
-    limits = get_user_limits(user_id_int, db)
+    # Get user's subscription limits; anonymous callers have no subscription,
+    # and caching their IP-derived ids would only churn the limits cache
+    limits = await get_user_limits_async(user_id_int, db) if user else DEFAULT_LIMITS
+    max_concurrent = limits.get('max_concurrent_requests', DEFAULT_LIMITS['max_concurrent_requests'])
     
     # Check if user has exceeded concurrent request limit
-    if not can_process_request(user_id_int):
+    if not can_process_request(user_id_int, max_concurrent):
         # If at capacity, try to queue the request
-        if await queue_request(user_id_int, request_id, limits.get('priority', 0)):
+        queued_at = time.time()
+        queued = await queue_request(user_id_int, request_id, limits.get('priority', 0), max_concurrent)
+        queue_time += time.time() - queued_at
+        if queued:
             # Request was queued and is now ready to be processed
             pass
         else:
@@ -331,44 +677,94 @@ async def rate_limit_dependency(
             detail="Rate limit exceeded. Please try again later."
         )
     
-    # Record the start of this request
-    record_request_start(user_id_int, request_id)
-    
-    # Instead of on_close (which might not be supported in all FastAPI versions),
-    # we'll use response callbacks or middleware properly in the main.py file
+    # Check daily/monthly quotas for authenticated users
+    if user:
+        exhausted_period = await check_quota_async(user_id_int, limits, db)
+        if exhausted_period:
+            logger.warning(f"Quota exceeded for user {user_id_int}: {exhausted_period}ly limit reached")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"{'Daily' if exhausted_period == 'day' else 'Monthly'} request quota exceeded for your subscription tier."
+            )
     
-    # For now, we'll simulate cleanup by scheduling a task to run after the request
-    async def cleanup_after_request():
-        # Wait a tiny bit to ensure the request is done
-        await asyncio.sleep(0.01)
-        
-        end_time = time.time()
-        duration = end_time - start_time
-        success = True  # Default success status
-        
-        # Record usage statistics
-        if db:
-            try:
-                record_usage(
-                    db, 
-                    user_id_int, 
-                    str(request.url.path), 
-                    success, 
-                    duration, 
-                    client_ip
-                )
-            except Exception as e:
-                logger.error(f"Error recording usage: {e}")
-        
-        # Record the end of this request
-        record_request_end(user_id_int, request_id)
+    # Acquire a slot from the global adaptive limiter before doing any work
+    waiting_since = time.time()
+    acquired = await ADAPTIVE_LIMITER.acquire(limits.get('priority', 0))
+    queue_time += time.time() - waiting_since
+    if not acquired:
+        logger.warning(f"Request shed for user {user_id_int}: backend concurrency limit reached")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy. Please try again later.",
+            headers={"Retry-After": "1"}
+        )
     
-    # Schedule the cleanup
-    asyncio.create_task(cleanup_after_request())
+    # Record the start of this request
+    record_request_start(user_id_int, request_id)
+    if user:
+        increment_usage(user_id_int)
+    
+    # Hand the context to RequestAccountingMiddleware, which releases the
+    # slots and records usage once the response has actually been sent
+    setattr(request.state, RATE_LIMIT_STATE_KEY, {
+        'user_id': user_id_int,
+        'request_id': request_id,
+        'authenticated': user is not None,
+        'tier_id': limits.get('tier_id'),
+        'client_ip': client_ip,
+        'endpoint': str(request.url.path),
+        # Route template, so latency is compared per route rather than per path
+        'route': getattr(request.scope.get("route"), "path", str(request.url.path)),
+        'queue_time': queue_time,
+        # Only waits long enough to matter count as queued
+        'was_queued': queue_time >= 0.001
+    })
     
     return user_id_int
 
 
+def complete_request(context: Dict[str, Any], status_code: int, duration: float):
+    """
+    Finish accounting for a request that passed rate_limit_dependency.
+    
+    Called by RequestAccountingMiddleware after the response has been sent,
+    with the real status code and total duration in seconds.
+    """
+    user_id_int = context['user_id']
+    queue_time = context['queue_time']
+    
+    # Release the concurrency slots held by this request
+    record_request_end(user_id_int, context['request_id'])
+    # Feed back service time only; queue wait says nothing about backend latency
+    ADAPTIVE_LIMITER.release(max(0.0, duration - queue_time), route=context.get('route'))
+    RATE_LIMITER_QUEUE_WAIT.observe(queue_time)
+    
+    record_usage(
+        user_id_int if context['authenticated'] else None,
+        context.get('endpoint', ''),
+        status_code < 400,
+        duration,
+        context['client_ip'],
+        tier_id=context['tier_id'],
+        was_queued=context['was_queued'],
+        queue_time=queue_time if context['was_queued'] else None
+    )
+
+
+def get_rate_limiter_stats() -> Dict[str, Any]:
+    """Get a snapshot of the rate limiter state for metrics."""
+    return {
+        'adaptive': ADAPTIVE_LIMITER.stats(),
+        'active_users': len(ACTIVE_REQUESTS),
+        'active_requests': sum(len(requests) for requests in ACTIVE_REQUESTS.values()),
+        'queue_depth': len(REQUEST_QUEUE),
+        'tracked_users': len(RATE_LIMITS),
+        'limits_cache': dict(LIMITS_CACHE_STATS, size=len(LIMITS_CACHE)),
+        'usage_buffer': get_usage_buffer_stats(),
+        'quota': get_quota_stats()
+    }
+
+
 # Periodic task to clean up expired rate limit entries
 async def cleanup_task():
     """Periodically clean up expired rate limit entries and process the queue."""
@@ -412,4 +808,12 @@ async def cleanup_task():
 # Function to start background tasks
 def start_background_tasks():
     """Start background tasks for the rate limiter."""
-    asyncio.create_task(cleanup_task())
\ No newline at end of file
+    asyncio.create_task(cleanup_task())
+    start_usage_flusher()
+    start_quota_flusher()
+
+
+async def stop_background_tasks():
+    """Stop background tasks, flushing any buffered usage events and quota counters."""
+    await stop_usage_flusher()
+    await stop_quota_flusher()
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""
+Request accounting middleware.
+
+A pure ASGI middleware that wraps the full request lifecycle. It measures the
+real duration of every HTTP request and captures the response status code.
+When a request passed through `rate_limit_dependency`, the middleware finishes
+the accounting once the response has been sent: it releases the per-user and
+adaptive concurrency slots and records usage with the true status and latency.
+
+It also records the scope of each HTTP and WebSocket request so connection pool
+checkouts can be attributed to the route being served, and observes the
+duration of every HTTP request per route template for the /metrics exposition.
+"""
+
+import time
+import logging
+
+from ..pool_metrics import set_request_scope
+from ..prometheus import HTTP_REQUEST_DURATION
+from .rate_limit import RATE_LIMIT_STATE_KEY, ACCOUNTING_STATE_KEY, complete_request
+
+logger = logging.getLogger(__name__)
+
+
+class RequestAccountingMiddleware:
+    """ASGI middleware that completes rate limiter accounting for each request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            set_request_scope(scope)
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        # Request.state is backed by scope["state"], so the rate limit
+        # dependency can leave its context here for us to pick up
+        state = scope.setdefault("state", {})
+        state[ACCOUNTING_STATE_KEY] = True
+        status_code = 500  # Assume failure if no response is started
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start_time
+            # Label by route template, not raw path, to bound the number of series
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.observe(
+                duration,
+                route=getattr(route, "path", "unmatched"),
+                method=scope["method"],
+                status=status_code
+            )
+            context = state.pop(RATE_LIMIT_STATE_KEY, None)
+            if context is not None:
+                try:
+                    complete_request(context, status_code, duration)
+                except Exception as e:
+                    logger.error(f"Error completing request accounting: {e}")
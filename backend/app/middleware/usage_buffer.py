@@ -0,0 +1,223 @@
+"""
+Buffered usage logging.
+
+Usage events are appended to a bounded in-memory queue on the request path and
+written to the `usage_logs` table in batches by a background flusher, so a
+request never waits on (or holds a connection for) its own usage row.
+
+Backpressure is handled in two steps:
+- Once the queue is more than USAGE_SAMPLE_THRESHOLD full, only one in every
+  USAGE_SAMPLE_RATE events is kept.
+- Once the queue is full, new events are dropped.
+
+Both cases are counted in USAGE_STATS. Remaining events are flushed on shutdown.
+
+A batch that fails because a referenced user, tier or API key was deleted is
+retried with those references cleared. If it still fails with an integrity
+error USAGE_MAX_FLUSH_ATTEMPTS times in a row, it is dropped rather than
+blocking the queue.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from ..database import SessionLocal
+from ..models import ApiKey, SubscriptionTier, UsageLog, User
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of events held in memory
+USAGE_QUEUE_MAX_SIZE = 20000
+
+# Number of rows written per INSERT
+USAGE_FLUSH_BATCH_SIZE = 500
+
+# Seconds between flushes when the queue is not filling up quickly
+USAGE_FLUSH_INTERVAL = 2.0
+
+# Fraction of the queue at which sampling starts, and the rate used
+USAGE_SAMPLE_THRESHOLD = 0.75
+USAGE_SAMPLE_RATE = 10
+
+# Consecutive integrity failures after which the batch at the head is dropped
+USAGE_MAX_FLUSH_ATTEMPTS = 3
+
+# Nullable foreign keys of usage_logs and the models they reference
+USAGE_REFERENCES = (('user_id', User), ('tier_id', SubscriptionTier), ('api_key_id', ApiKey))
+
+# Pending usage events, oldest first
+USAGE_QUEUE: Deque[Dict[str, Any]] = deque()
+
+# Counters for metrics
+USAGE_STATS = {
+    'enqueued': 0,
+    'sampled_out': 0,
+    'dropped': 0,
+    'flushed': 0,
+    'batches': 0,
+    'flush_errors': 0,
+    'abandoned_batches': 0,
+}
+
+# Serializes flushes between the background task and shutdown
+_flush_lock = threading.Lock()
+_sample_counter = 0
+_failed_attempts = 0
+_batch_ready: Optional[asyncio.Event] = None
+_flusher_task: Optional[asyncio.Task] = None
+
+
+def enqueue_usage(event: Dict[str, Any]) -> bool:
+    """
+    Queue a usage event for the next batch.
+    Returns True if the event was kept, False if it was sampled out or dropped.
+    """
+    global _sample_counter
+
+    queue_length = len(USAGE_QUEUE)
+    if queue_length >= USAGE_QUEUE_MAX_SIZE:
+        USAGE_STATS['dropped'] += 1
+        return False
+
+    if queue_length >= USAGE_QUEUE_MAX_SIZE * USAGE_SAMPLE_THRESHOLD:
+        _sample_counter += 1
+        if _sample_counter % USAGE_SAMPLE_RATE != 0:
+            USAGE_STATS['sampled_out'] += 1
+            return False
+
+    USAGE_QUEUE.append(event)
+    USAGE_STATS['enqueued'] += 1
+
+    # Wake the flusher early once a full batch is waiting
+    if _batch_ready is not None and queue_length + 1 >= USAGE_FLUSH_BATCH_SIZE:
+        _batch_ready.set()
+
+    return True
+
+
+def flush_usage(max_batches: Optional[int] = None) -> int:
+    """
+    Write queued events to the database in batches.
+    Returns the number of rows written.
+    """
+    global _failed_attempts
+
+    written = 0
+    batches = 0
+
+    with _flush_lock:
+        while USAGE_QUEUE and (max_batches is None or batches < max_batches):
+            batch: List[Dict[str, Any]] = []
+            while USAGE_QUEUE and len(batch) < USAGE_FLUSH_BATCH_SIZE:
+                batch.append(USAGE_QUEUE.popleft())
+
+            db = SessionLocal()
+            try:
+                # A single executemany INSERT; psycopg2 sends it as multi-row VALUES
+                try:
+                    db.execute(insert(UsageLog), batch)
+                    db.commit()
+                except IntegrityError:
+                    # A user, tier or API key was deleted after the request;
+                    # keep the rows without the reference
+                    db.rollback()
+                    _detach_missing_references(db, batch)
+                    db.execute(insert(UsageLog), batch)
+                    db.commit()
+            except Exception as e:
+                db.rollback()
+                USAGE_STATS['flush_errors'] += 1
+                logger.error(f"Error flushing {len(batch)} usage events: {e}")
+                if isinstance(e, IntegrityError):
+                    # Retrying cannot fix bad data; stop it from stalling the queue
+                    _failed_attempts += 1
+                    if _failed_attempts >= USAGE_MAX_FLUSH_ATTEMPTS:
+                        _failed_attempts = 0
+                        USAGE_STATS['abandoned_batches'] += 1
+                        USAGE_STATS['dropped'] += len(batch)
+                        logger.error(f"Dropping {len(batch)} usage events after {USAGE_MAX_FLUSH_ATTEMPTS} failed attempts")
+                        continue
+                # Put the batch back for the next attempt if there is room
+                room = USAGE_QUEUE_MAX_SIZE - len(USAGE_QUEUE)
+                if room > 0:
+                    USAGE_QUEUE.extendleft(reversed(batch[:room]))
+                USAGE_STATS['dropped'] += max(0, len(batch) - room)
+                break
+            finally:
+                db.close()
+
+            _failed_attempts = 0
+            written += len(batch)
+            batches += 1
+            USAGE_STATS['flushed'] += len(batch)
+            USAGE_STATS['batches'] += 1
+
+    return written
+
+
+def _detach_missing_references(db, batch: List[Dict[str, Any]]):
+    """Clear user, tier and API key ids in a batch that no longer exist."""
+    for field, model in USAGE_REFERENCES:
+        ids = {event[field] for event in batch if event.get(field) is not None}
+        if not ids:
+            continue
+        existing = {row[0] for row in db.query(model.id).filter(model.id.in_(ids)).all()}
+        for event in batch:
+            if event.get(field) is not None and event[field] not in existing:
+                event[field] = None
+
+
+async def usage_flush_task():
+    """Periodically flush queued usage events, or sooner when a batch is ready."""
+    while True:
+        try:
+            await asyncio.wait_for(_batch_ready.wait(), timeout=USAGE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _batch_ready.clear()
+
+        try:
+            if USAGE_QUEUE:
+                # Database I/O runs in a worker thread to keep the event loop free
+                await asyncio.to_thread(flush_usage)
+        except Exception as e:
+            logger.error(f"Error in usage flush task: {e}")
+
+
+def start_usage_flusher():
+    """Start the background usage flusher."""
+    global _batch_ready, _flusher_task
+
+    if _flusher_task is not None and not _flusher_task.done():
+        return
+    _batch_ready = asyncio.Event()
+    _flusher_task = asyncio.create_task(usage_flush_task())
+
+
+async def stop_usage_flusher():
+    """Stop the background flusher and write everything still queued."""
+    global _flusher_task
+
+    if _flusher_task is not None:
+        _flusher_task.cancel()
+        try:
+            await _flusher_task
+        except asyncio.CancelledError:
+            pass
+        _flusher_task = None
+
+    start = time.time()
+    written = await asyncio.to_thread(flush_usage)
+    logger.info(f"Flushed {written} usage events on shutdown in {time.time() - start:.2f}s")
+
+
+def get_usage_buffer_stats() -> Dict[str, Any]:
+    """Get a snapshot of the usage buffer for metrics."""
+    return dict(USAGE_STATS, queue_depth=len(USAGE_QUEUE))
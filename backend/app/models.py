@@ -1,5 +1,6 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Text, JSON, Float
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, BigInteger, String, Date, DateTime, Text, JSON, Float, text
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
 import uuid
 
@@ -28,9 +29,14 @@ class User(Base):
 
 class ApiKey(Base):
     __tablename__ = "api_keys"
+    __table_args__ = (
+        Index("ix_api_keys_user_id_active", "user_id", postgresql_where=text("is_active")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    key = Column(String, unique=True, index=True)
+    key = Column(String, unique=True, index=True, nullable=True)  # Legacy plaintext key, no longer stored
+    prefix = Column(String(16), index=True)  # Public prefix used to find the key
+    key_hash = Column(String(64), unique=True)  # SHA-256 of the full key
     name = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"))
     is_active = Column(Boolean, default=True)
@@ -42,14 +48,19 @@ class ApiKey(Base):
 
 class Diagnostic(Base):
     __tablename__ = "diagnostics"
+    # Monthly range partitions, maintained by app.partitions
+    __table_args__ = (
+        Index("ix_diagnostics_user_id_created_at", "user_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     tool = Column(String)  # ping, traceroute, dns_lookup, etc.
     target = Column(String)  # hostname, IP address, etc.
     result = Column(Text)
     status = Column(String)  # success, failure
     user_id = Column(Integer, ForeignKey("users.id"))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)  # Partition key
     execution_time = Column(Integer)  # in milliseconds
     
     user = relationship("User", back_populates="diagnostics")
@@ -126,6 +137,9 @@ class UserSubscription(Base):
 
 class ScheduledProbe(Base):
     __tablename__ = "scheduled_probes"
+    __table_args__ = (
+        Index("ix_scheduled_probes_user_id_active", "user_id", postgresql_where=text("is_active")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
@@ -157,14 +171,19 @@ class ScheduledProbe(Base):
 
 class ProbeResult(Base):
     __tablename__ = "probe_results"
+    # Monthly range partitions, maintained by app.partitions
+    __table_args__ = (
+        Index("ix_probe_results_scheduled_probe_id_created_at", "scheduled_probe_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     scheduled_probe_id = Column(Integer, ForeignKey("scheduled_probes.id"))
     result = Column(Text)
     status = Column(String)  # success, failure
     execution_time = Column(Integer)  # in milliseconds
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)  # Partition key
     
     # Relationships
     scheduled_probe = relationship("ScheduledProbe", back_populates="probe_results")
@@ -204,11 +223,16 @@ class UsageLog(Base):
     This expands on ApiUsageLog with additional fields for rate limiting and analytics.
     """
     __tablename__ = "usage_logs"
+    # Monthly range partitions, maintained by app.partitions
+    __table_args__ = (
+        Index("ix_usage_logs_user_id_timestamp", "user_id", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     endpoint = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)  # Partition key
     success = Column(Boolean, default=True)
     response_time = Column(Float)  # in seconds (float for higher precision)
     ip_address = Column(String, nullable=True)
@@ -222,6 +246,99 @@ class UsageLog(Base):
     # Relationships could be added if needed
 
 
+class UsageCounter(Base):
+    """
+    Incrementally maintained request counts per user and period.
+    Used to enforce daily/monthly quotas without scanning usage_logs.
+    """
+    __tablename__ = "usage_counters"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    period = Column(String, primary_key=True)  # day, month
+    period_start = Column(Date, primary_key=True)  # first day of the period (UTC)
+    count = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class RetentionCheckpoint(Base):
+    """
+    Progress of the history retention engine per table, so an interrupted
+    pass resumes after the last user it finished.
+    """
+    __tablename__ = "retention_checkpoints"
+    
+    table_name = Column(String, primary_key=True)
+    last_user_id = Column(Integer, default=0, nullable=False)  # 0 = start of a new pass
+    passes_completed = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DiagnosticRollup(Base):
+    """
+    Hourly or daily diagnostic aggregates per user, tool and status,
+    maintained by app.rollups. user_id 0 holds diagnostics without a user.
+    """
+    __tablename__ = "diagnostic_rollups"
+    __table_args__ = (
+        Index("ix_diagnostic_rollups_user_id", "user_id", "granularity", "bucket_start"),
+    )
+
+    granularity = Column(String, primary_key=True)  # hour, day
+    bucket_start = Column(DateTime, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    tool = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    count = Column(BigInteger, default=0, nullable=False)
+    time_count = Column(BigInteger, default=0, nullable=False)  # rows with an execution time
+    time_sum = Column(Float, default=0, nullable=False)  # in milliseconds
+    time_min = Column(Float, nullable=True)
+    time_max = Column(Float, nullable=True)
+    latency_sketch = Column(JSONB, default=dict, nullable=False)  # log histogram, see app.rollups
+
+
+class ProbeResultRollup(Base):
+    """
+    Hourly or daily probe result aggregates per scheduled probe and status,
+    maintained by app.rollups.
+    """
+    __tablename__ = "probe_result_rollups"
+    __table_args__ = (
+        Index("ix_probe_result_rollups_scheduled_probe_id", "scheduled_probe_id", "granularity", "bucket_start"),
+    )
+
+    granularity = Column(String, primary_key=True)  # hour, day
+    bucket_start = Column(DateTime, primary_key=True)
+    scheduled_probe_id = Column(Integer, primary_key=True)
+    status = Column(String, primary_key=True)
+    count = Column(BigInteger, default=0, nullable=False)
+    time_count = Column(BigInteger, default=0, nullable=False)
+    time_sum = Column(Float, default=0, nullable=False)
+    time_min = Column(Float, nullable=True)
+    time_max = Column(Float, nullable=True)
+    latency_sketch = Column(JSONB, default=dict, nullable=False)
+
+
+class NodeDiagnosticRollup(Base):
+    """
+    Hourly or daily execution time aggregates per probe node, maintained by
+    app.rollups from node_diagnostics.
+    """
+    __tablename__ = "node_diagnostic_rollups"
+    __table_args__ = (
+        Index("ix_node_diagnostic_rollups_node_id", "node_id", "granularity", "bucket_start"),
+    )
+
+    granularity = Column(String, primary_key=True)  # hour, day
+    bucket_start = Column(DateTime, primary_key=True)
+    node_id = Column(Integer, primary_key=True)
+    count = Column(BigInteger, default=0, nullable=False)
+    time_count = Column(BigInteger, default=0, nullable=False)
+    time_sum = Column(Float, default=0, nullable=False)
+    time_min = Column(Float, nullable=True)
+    time_max = Column(Float, nullable=True)
+    latency_sketch = Column(JSONB, default=dict, nullable=False)
+
+
 class ProbeNode(Base):
     """
     Represents a probe node in the system, responsible for executing network diagnostics.
@@ -273,7 +390,15 @@ class ProbeNode(Base):
     config = Column(JSON, default=dict)  # Flexible configuration object
     
     # Relationship to diagnostics executed by this node
-    diagnostics = relationship("Diagnostic", secondary="node_diagnostics", backref="executed_by_nodes")
+    # Joins are explicit because node_diagnostics cannot have a foreign key to
+    # the partitioned diagnostics table (its primary key includes created_at)
+    diagnostics = relationship(
+        "Diagnostic",
+        secondary="node_diagnostics",
+        primaryjoin="ProbeNode.id == NodeDiagnostic.node_id",
+        secondaryjoin="Diagnostic.id == foreign(NodeDiagnostic.diagnostic_id)",
+        backref="executed_by_nodes"
+    )
 
 
 # Association table for many-to-many relationship between diagnostics and nodes
@@ -282,8 +407,8 @@ class NodeDiagnostic(Base):
     __tablename__ = "node_diagnostics"
     
     node_id = Column(Integer, ForeignKey("probe_nodes.id"), primary_key=True)
-    diagnostic_id = Column(Integer, ForeignKey("diagnostics.id"), primary_key=True)
-    executed_at = Column(DateTime, default=datetime.utcnow)
+    diagnostic_id = Column(Integer, primary_key=True)  # diagnostics.id, not enforced (partitioned)
+    executed_at = Column(DateTime, default=datetime.utcnow, index=True)
     execution_time = Column(Float)  # Time taken to execute in ms
 
 
@@ -0,0 +1,239 @@
+"""
+Monthly range partitions for append-only tables.
+
+`diagnostics`, `probe_results` and `usage_logs` are partitioned by month on
+their timestamp column (see the 20261019_partition_time_series migration).
+Each table has one partition per month, named `<table>_pYYYYMM`, plus a
+`<table>_default` partition that catches rows outside the premade range.
+
+A background task keeps partitions created PARTITION_PREMAKE_MONTHS ahead of
+the current month, so inserts never land in the default partition under
+normal operation. Retention removes old data with `drop_partitions_before`,
+which drops whole partitions instead of deleting rows.
+
+Maintenance runs under a Postgres advisory lock, so only one worker does it
+at a time. Bootstrap also creates the current and next month's partitions
+before the worker reports ready (`ensure_startup_partitions`): on a database
+created with `create_all` there are none yet, and rows written to the default
+partition in the meantime would block creating that month's partition later.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+# Partitioned tables and their partition key column
+PARTITIONED_TABLES = {
+    'diagnostics': 'created_at',
+    'probe_results': 'created_at',
+    'usage_logs': 'timestamp',
+}
+
+# Months of partitions kept ready after the current one
+PARTITION_PREMAKE_MONTHS = 3
+
+# Months of partitions created after the current one during bootstrap
+PARTITION_STARTUP_MONTHS = 1
+
+# Seconds between maintenance runs
+PARTITION_MAINTENANCE_INTERVAL = 6 * 3600
+
+# Advisory lock key serializing maintenance across workers
+PARTITION_LOCK_KEY = 4004
+
+# Counters for metrics
+PARTITION_STATS = {
+    'runs': 0,
+    'created': 0,
+    'dropped': 0,
+    'errors': 0,
+    'skipped_locked': 0,
+    'last_run': None,
+    'partitions': {},
+}
+
+_PARTITION_NAME = re.compile(r"_p(\d{4})(\d{2})$")
+
+_maintenance_task: Optional[asyncio.Task] = None
+
+
+def month_start(value: date) -> date:
+    """Get the first day of the month containing value."""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    """Shift a first-of-month date by a number of months."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    """Get the name of a table's partition for a month."""
+    return f"{table}_p{month:%Y%m}"
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    """Check whether a table has been converted to a partitioned table."""
+    return bool(conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :table AND pg_table_is_visible(c.oid)
+        )
+    """), {"table": table}).scalar())
+
+
+def list_partitions(conn: Connection, table: str) -> List[Tuple[str, Optional[date]]]:
+    """List a table's partitions as (name, month); month is None for the default partition."""
+    rows = conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = :table AND pg_table_is_visible(parent.oid)
+        ORDER BY child.relname
+    """), {"table": table}).all()
+
+    partitions = []
+    for (name,) in rows:
+        match = _PARTITION_NAME.search(name)
+        month = date(int(match.group(1)), int(match.group(2)), 1) if match else None
+        partitions.append((name, month))
+    return partitions
+
+
+def create_partition(conn: Connection, table: str, month: date):
+    """Create the partition of a table for one month."""
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+
+
+def ensure_partitions(conn: Connection, months_ahead: int = PARTITION_PREMAKE_MONTHS,
+                      today: Optional[date] = None) -> int:
+    """
+    Create missing partitions from the current month through months_ahead
+    months later, plus the default partition. Returns the number created.
+    """
+    current = month_start(today or datetime.utcnow().date())
+    created = 0
+
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(conn, table):
+            continue
+
+        existing = {name for name, _ in list_partitions(conn, table)}
+        if f"{table}_default" not in existing:
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+            created += 1
+
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if partition_name(table, month) not in existing:
+                create_partition(conn, table, month)
+                logger.info(f"Created partition {partition_name(table, month)}")
+                created += 1
+
+    return created
+
+
+def drop_partitions_before(conn: Connection, table: str, cutoff: datetime) -> List[str]:
+    """
+    Drop a table's monthly partitions that only hold rows older than cutoff.
+    Returns the names of the dropped partitions.
+    """
+    dropped = []
+    for name, month in list_partitions(conn, table):
+        if month is not None and datetime.combine(add_months(month, 1), datetime.min.time()) <= cutoff:
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            logger.info(f"Dropped partition {name}")
+            dropped.append(name)
+
+    PARTITION_STATS['dropped'] += len(dropped)
+    return dropped
+
+
+def _try_lock(conn: Connection) -> bool:
+    return bool(conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY}).scalar())
+
+
+def run_partition_maintenance() -> int:
+    """Create upcoming partitions if no other worker is doing so. Returns the number created."""
+    with engine.begin() as conn:
+        if not _try_lock(conn):
+            PARTITION_STATS['skipped_locked'] += 1
+            return 0
+
+        created = ensure_partitions(conn)
+        PARTITION_STATS['partitions'] = {
+            table: len(list_partitions(conn, table)) for table in PARTITIONED_TABLES
+        }
+
+    PARTITION_STATS['runs'] += 1
+    PARTITION_STATS['created'] += created
+    PARTITION_STATS['last_run'] = time.time()
+    return created
+
+
+def ensure_startup_partitions() -> int:
+    """
+    Create the current and next month's partitions, waiting for the lock if
+    another worker holds it. Returns the number created.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        created = ensure_partitions(conn, months_ahead=PARTITION_STARTUP_MONTHS)
+
+    PARTITION_STATS['created'] += created
+    return created
+
+
+async def partition_maintenance_task():
+    """Run partition maintenance now and then every PARTITION_MAINTENANCE_INTERVAL."""
+    while True:
+        try:
+            # DDL runs in a worker thread to keep the event loop free
+            await asyncio.to_thread(run_partition_maintenance)
+        except Exception as e:
+            PARTITION_STATS['errors'] += 1
+            logger.error(f"Error in partition maintenance: {e}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+
+def start_partition_maintenance():
+    """Start the background partition maintenance task."""
+    global _maintenance_task
+
+    if _maintenance_task is not None and not _maintenance_task.done():
+        return
+    _maintenance_task = asyncio.create_task(partition_maintenance_task())
+
+
+async def stop_partition_maintenance():
+    """Stop the background partition maintenance task."""
+    global _maintenance_task
+
+    if _maintenance_task is not None:
+        _maintenance_task.cancel()
+        try:
+            await _maintenance_task
+        except asyncio.CancelledError:
+            pass
+        _maintenance_task = None
+
+
+def get_partition_stats() -> Dict[str, Any]:
+    """Get a snapshot of partition maintenance for metrics."""
+    return dict(PARTITION_STATS)
@@ -0,0 +1,138 @@
+"""
+Password hashing off the event loop.
+
+bcrypt takes tens of milliseconds per hash by design, so hashing and
+verification run in a dedicated, bounded thread pool (bcrypt releases the GIL
+while it works). At most PASSWORD_HASH_QUEUE_LIMIT jobs may be running or
+waiting at once; beyond that, callers get PasswordHashQueueFull and login
+requests are shed with 503 instead of piling up behind each other.
+
+Hashes are created with settings.BCRYPT_ROUNDS. When a user logs in with a
+hash made with a different cost, verification returns a replacement hash so
+the stored one can be upgraded transparently.
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from .config import settings
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+)
+
+# Number of login latencies kept for percentiles
+LOGIN_LATENCY_WINDOW = 1000
+
+# Counters for metrics
+PASSWORD_HASH_STATS = {
+    'verifications': 0,
+    'hashes': 0,
+    'rehashed': 0,
+    'rejected': 0,
+    'logins_succeeded': 0,
+    'logins_failed': 0,
+}
+
+# Most recent login latencies in seconds, oldest first
+LOGIN_LATENCIES: Deque[float] = deque(maxlen=LOGIN_LATENCY_WINDOW)
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+_in_flight = 0
+_hash_time_total = 0.0
+
+
+class PasswordHashQueueFull(Exception):
+    """Raised when too many password hashing jobs are already queued."""
+
+
+def _timed(func, *args):
+    """Call func in a pool worker and measure the time spent hashing."""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+async def _run_in_pool(stat: str, func, *args):
+    """Run a hashing function in the pool, enforcing the queue limit."""
+    global _in_flight, _hash_time_total
+
+    if _in_flight >= settings.PASSWORD_HASH_QUEUE_LIMIT:
+        PASSWORD_HASH_STATS['rejected'] += 1
+        raise PasswordHashQueueFull()
+
+    _in_flight += 1
+    try:
+        result, elapsed = await asyncio.get_running_loop().run_in_executor(_executor, _timed, func, *args)
+    finally:
+        _in_flight -= 1
+
+    PASSWORD_HASH_STATS[stat] += 1
+    _hash_time_total += elapsed
+    return result
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password in the hashing pool.
+    Returns (valid, new_hash); new_hash is set when the stored hash should be
+    replaced because it was made with outdated parameters.
+    """
+    valid, new_hash = await _run_in_pool('verifications', pwd_context.verify_and_update, plain_password, hashed_password)
+    if valid and new_hash:
+        PASSWORD_HASH_STATS['rehashed'] += 1
+    return valid, new_hash
+
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password in the hashing pool."""
+    return await _run_in_pool('hashes', pwd_context.hash, password)
+
+
+def record_login(success: bool, duration: float):
+    """Record the outcome and latency of a login attempt."""
+    PASSWORD_HASH_STATS['logins_succeeded' if success else 'logins_failed'] += 1
+    LOGIN_LATENCIES.append(duration)
+
+
+def _percentile(values, fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def get_password_hash_stats() -> Dict[str, Any]:
+    """Get a snapshot of the hashing pool and login latencies for metrics."""
+    latencies = list(LOGIN_LATENCIES)
+    hash_jobs = PASSWORD_HASH_STATS['verifications'] + PASSWORD_HASH_STATS['hashes']
+    return dict(
+        PASSWORD_HASH_STATS,
+        in_flight=_in_flight,
+        workers=settings.PASSWORD_HASH_WORKERS,
+        queue_limit=settings.PASSWORD_HASH_QUEUE_LIMIT,
+        bcrypt_rounds=settings.BCRYPT_ROUNDS,
+        avg_hash_time=_hash_time_total / hash_jobs if hash_jobs else None,
+        login_latency={
+            'samples': len(latencies),
+            'avg': sum(latencies) / len(latencies) if latencies else None,
+            'p50': _percentile(latencies, 0.50),
+            'p95': _percentile(latencies, 0.95),
+            'max': max(latencies) if latencies else None,
+        }
+    )
+
+
+def shutdown_password_hashing():
+    """Stop the hashing pool, letting running jobs finish."""
+    _executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,179 @@
+"""
+Connection pool instrumentation.
+
+The engines in database.py use the instrumented pool classes below, which
+time every checkout (including waits for a free connection) and count
+`pool_timeout` failures. Pool `checkout`/`checkin` event hooks track how many
+connections each route holds and for how long.
+
+Stats are kept per pool (by its logging name, e.g. "primary_async") and per
+route. The route is taken from the ASGI scope of the request being served,
+which RequestAccountingMiddleware records with `set_request_scope`; work
+outside a request (background tasks) is reported as "background".
+"""
+
+import contextvars
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Label for connections checked out outside any request
+BACKGROUND_ROUTE = "background"
+
+# Counters per pool: {pool_name: {...}}
+POOL_STATS: Dict[str, Dict[str, Any]] = {}
+
+# Counters per pool and route: {pool_name: {route: {...}}}
+ROUTE_POOL_STATS: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+# Engines whose pools are reported, by pool name
+_engines: Dict[str, Any] = {}
+
+_request_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("pool_request_scope", default=None)
+
+
+def set_request_scope(scope: dict):
+    """Remember the ASGI scope of the current request for route attribution."""
+    _request_scope.set(scope)
+
+
+def current_route() -> str:
+    """Get the route template (e.g. "/probes/{probe_id}") being served."""
+    scope = _request_scope.get()
+    if scope is None:
+        return BACKGROUND_ROUTE
+    # FastAPI stores the matched route in the scope once routing is done
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path", "unknown")
+
+
+def _pool_stats(pool_name: str) -> Dict[str, Any]:
+    stats = POOL_STATS.get(pool_name)
+    if stats is None:
+        stats = POOL_STATS[pool_name] = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }
+    return stats
+
+
+def _route_stats(pool_name: str, route: str) -> Dict[str, Any]:
+    routes = ROUTE_POOL_STATS.setdefault(pool_name, {})
+    stats = routes.get(route)
+    if stats is None:
+        stats = routes[route] = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'in_use': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'hold_total': 0.0,
+            'hold_max': 0.0,
+        }
+    return stats
+
+
+def _record_wait(stats: Dict[str, Any], waited: float, timed_out: bool):
+    if timed_out:
+        stats['timeouts'] += 1
+    else:
+        stats['checkouts'] += 1
+    stats['wait_total'] += waited
+    stats['wait_max'] = max(stats['wait_max'], waited)
+
+
+class _InstrumentedPoolMixin:
+    """Times checkouts, including the wait for a free connection and pre-ping."""
+
+    def connect(self):
+        pool_name = self.logging_name or "default"
+        route = current_route()
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            waited = time.perf_counter() - start
+            _record_wait(_pool_stats(pool_name), waited, timed_out=True)
+            _record_wait(_route_stats(pool_name, route), waited, timed_out=True)
+            raise
+        waited = time.perf_counter() - start
+        _record_wait(_pool_stats(pool_name), waited, timed_out=False)
+        _record_wait(_route_stats(pool_name, route), waited, timed_out=False)
+        return connection
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    """QueuePool with checkout timing, for sync engines."""
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool with checkout timing, for async engines."""
+
+
+def instrument_engine(engine, pool_name: str):
+    """
+    Register an engine's pool for reporting and attach checkout/checkin hooks.
+    pool_name must match the engine's pool_logging_name.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    _engines[pool_name] = sync_engine
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        route = current_route()
+        connection_record.info['pool_checkout'] = (route, time.perf_counter())
+        _route_stats(pool_name, route)['in_use'] += 1
+
+    @event.listens_for(sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checkout = connection_record.info.pop('pool_checkout', None)
+        if checkout is None:
+            return
+        route, checked_out_at = checkout
+        held = time.perf_counter() - checked_out_at
+        stats = _route_stats(pool_name, route)
+        stats['in_use'] -= 1
+        stats['hold_total'] += held
+        stats['hold_max'] = max(stats['hold_max'], held)
+
+
+def get_pool_usage() -> Dict[str, Dict[str, int]]:
+    """Get connections checked out per pool, without touching the database."""
+    return {
+        pool_name: {'checked_out': engine.pool.checkedout(), 'size': engine.pool.size()}
+        for pool_name, engine in _engines.items()
+    }
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Get a snapshot of every instrumented pool and its per-route usage for metrics."""
+    snapshot = {}
+    for pool_name, engine in _engines.items():
+        pool = engine.pool
+        stats = _pool_stats(pool_name)
+        attempts = stats['checkouts'] + stats['timeouts']
+        routes = {}
+        for route, route_stats in ROUTE_POOL_STATS.get(pool_name, {}).items():
+            route_attempts = route_stats['checkouts'] + route_stats['timeouts']
+            routes[route] = dict(
+                route_stats,
+                avg_wait=route_stats['wait_total'] / route_attempts if route_attempts else None,
+                avg_hold=route_stats['hold_total'] / route_stats['checkouts'] if route_stats['checkouts'] else None
+            )
+        snapshot[pool_name] = dict(
+            stats,
+            size=pool.size(),
+            timeout=pool.timeout(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            # Connections open beyond pool_size (the pool reports a negative
+            # count while it is not yet full)
+            overflow=max(0, pool.overflow()),
+            avg_wait=stats['wait_total'] / attempts if attempts else None,
+            routes=routes
+        )
+    return snapshot
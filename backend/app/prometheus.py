@@ -0,0 +1,158 @@
+"""
+In-process metrics registry with Prometheus text exposition.
+
+Counters and histograms are updated on the hot path (every request, every
+diagnostic, every WebSocket message), so an update is a dict lookup and a
+few additions with no lock and no allocation once a label combination has
+been seen. Updates happen on the event loop thread; an update racing with
+one from a worker thread may be lost, which is acceptable for metrics.
+
+State that already lives elsewhere (rate limiter, pools, caches, connected
+nodes) is not duplicated here: scrape-time samples are passed to
+`render_metrics` by the caller and rendered as gauges or counters.
+"""
+
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; covers sub-millisecond cache hits up to slow traceroutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# name -> metric, in registration order
+REGISTRY: Dict[str, "_Metric"] = {}
+
+# (name, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally labelled."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Histogram with fixed upper bounds, optionally labelled."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> per-bucket counts (not cumulative; last slot is +Inf), then sum
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, series in list(self._series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+def render_samples(name: str, kind: str, documentation: str, samples: Iterable[Sample]) -> List[str]:
+    """Render scrape-time samples of one metric family."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for sample_name, labels, value in samples:
+        if value is None:
+            continue
+        lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+def render_metrics(extra: Optional[Iterable[List[str]]] = None) -> str:
+    """Render every registered metric, plus pre-rendered families, in the text format."""
+    lines: List[str] = []
+    for metric in list(REGISTRY.values()):
+        lines.extend(metric.render())
+    for family in extra or ():
+        lines.extend(family)
+    return "\n".join(lines) + "\n"
+
+
+# Hot-path metrics
+
+HTTP_REQUEST_DURATION = Histogram(
+    "probeops_http_request_duration_seconds",
+    "HTTP request duration by route template, method and status code.",
+    ("route", "method", "status"),
+)
+
+RATE_LIMITER_QUEUE_WAIT = Histogram(
+    "probeops_rate_limiter_queue_wait_seconds",
+    "Time requests spent queued by the rate limiter before running.",
+)
+
+TOOL_EXECUTION_DURATION = Histogram(
+    "probeops_tool_execution_seconds",
+    "Diagnostic tool execution time by tool and outcome.",
+    ("tool", "status"),
+)
+
+WEBSOCKET_MESSAGES = Counter(
+    "probeops_websocket_messages_total",
+    "Probe node WebSocket messages by direction and message type.",
+    ("direction", "type"),
+)
@@ -0,0 +1,317 @@
+"""
+History retention by subscription tier.
+
+Diagnostics, probe results and usage logs older than the owner's
+`SubscriptionTier.max_history_days` are removed by a background task. Users
+without an active subscription get the FREE tier's retention.
+
+Removal works in two steps:
+- Monthly partitions older than the longest retention of any tier are dropped
+  whole (see app.partitions), which also covers rows without an owner.
+- Within the remaining partitions, expired rows are deleted per user. Users are
+  walked in id order, RETENTION_USER_CHUNK at a time, and each DELETE removes
+  at most RETENTION_BATCH_SIZE rows in its own short transaction, with a pause
+  of RETENTION_BATCH_DELAY seconds in between. Every batch runs with a short
+  lock_timeout so retention gives way to application traffic instead of
+  queueing behind it.
+
+Progress is checkpointed per table in `retention_checkpoints` (the last user id
+finished), so a pass interrupted by a restart resumes where it stopped. Only
+one worker runs retention at a time, guarded by an advisory lock.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+
+from .config import settings
+from .database import engine
+from .partitions import drop_partitions_before, is_partitioned
+
+logger = logging.getLogger(__name__)
+
+# Seconds between retention passes
+RETENTION_INTERVAL = 3600
+
+# Users whose expired rows are deleted together
+RETENTION_USER_CHUNK = 500
+
+# Maximum time a batch waits for a row lock before giving way
+RETENTION_LOCK_TIMEOUT = "2s"
+
+# Advisory lock key serializing retention across workers
+RETENTION_LOCK_KEY = 4005
+
+# Tier used for users without an active subscription
+DEFAULT_RETENTION_TIER = "FREE"
+
+# DELETE statements removing up to :batch_size expired rows for a chunk of
+# users; :user_ids and :cutoffs are parallel arrays
+_DELETE_EXPIRED = {
+    'diagnostics': """
+        WITH policy AS (
+            SELECT * FROM unnest(CAST(:user_ids AS integer[]), CAST(:cutoffs AS timestamp[])) AS p(user_id, cutoff)
+        ), expired AS (
+            SELECT d.id, d.created_at
+            FROM diagnostics d JOIN policy p ON d.user_id = p.user_id
+            WHERE d.created_at < p.cutoff
+            LIMIT :batch_size
+        )
+        DELETE FROM diagnostics d USING expired e
+        WHERE d.id = e.id AND d.created_at = e.created_at
+    """,
+    'probe_results': """
+        WITH policy AS (
+            SELECT * FROM unnest(CAST(:user_ids AS integer[]), CAST(:cutoffs AS timestamp[])) AS p(user_id, cutoff)
+        ), expired AS (
+            SELECT r.id, r.created_at
+            FROM probe_results r
+            JOIN scheduled_probes s ON s.id = r.scheduled_probe_id
+            JOIN policy p ON s.user_id = p.user_id
+            WHERE r.created_at < p.cutoff
+            LIMIT :batch_size
+        )
+        DELETE FROM probe_results r USING expired e
+        WHERE r.id = e.id AND r.created_at = e.created_at
+    """,
+    'usage_logs': """
+        WITH policy AS (
+            SELECT * FROM unnest(CAST(:user_ids AS integer[]), CAST(:cutoffs AS timestamp[])) AS p(user_id, cutoff)
+        ), expired AS (
+            SELECT u.id, u.timestamp
+            FROM usage_logs u JOIN policy p ON u.user_id = p.user_id
+            WHERE u.timestamp < p.cutoff
+            LIMIT :batch_size
+        )
+        DELETE FROM usage_logs u USING expired e
+        WHERE u.id = e.id AND u.timestamp = e.timestamp
+    """,
+}
+
+# Counters for metrics
+RETENTION_STATS = {
+    'runs': 0,
+    'passes_completed': 0,
+    'batches': 0,
+    'rows_deleted': {table: 0 for table in _DELETE_EXPIRED},
+    'partitions_dropped': 0,
+    'lock_timeouts': 0,
+    'errors': 0,
+    'skipped_locked': 0,
+    'time_spent': 0.0,
+    'last_run': None,
+    'last_run_duration': None,
+}
+
+_stop_requested = threading.Event()
+_retention_task: Optional[asyncio.Task] = None
+
+
+def _load_user_chunk(conn: Connection, after_user_id: int, default_days: Optional[int]) -> List[Tuple[int, Optional[int]]]:
+    """
+    Get (user_id, max_history_days) for the next chunk of users after
+    after_user_id. Days are None for tiers without a history limit.
+    """
+    rows = conn.execute(text("""
+        SELECT u.id, s.id IS NOT NULL, t.max_history_days
+        FROM users u
+        LEFT JOIN user_subscriptions s ON s.user_id = u.id AND s.is_active
+        LEFT JOIN subscription_tiers t ON t.id = s.tier_id
+        WHERE u.id > :after
+        ORDER BY u.id
+        LIMIT :limit
+    """), {"after": after_user_id, "limit": RETENTION_USER_CHUNK}).all()
+    return [(user_id, days if subscribed else default_days) for user_id, subscribed, days in rows]
+
+
+def _get_checkpoint(conn: Connection, table: str) -> int:
+    last_user_id = conn.execute(
+        text("SELECT last_user_id FROM retention_checkpoints WHERE table_name = :table"),
+        {"table": table}
+    ).scalar()
+    return last_user_id or 0
+
+
+def _save_checkpoint(conn: Connection, table: str, last_user_id: int, pass_completed: bool = False):
+    conn.execute(text("""
+        INSERT INTO retention_checkpoints (table_name, last_user_id, passes_completed, updated_at)
+        VALUES (:table, :last_user_id, :completed, now() AT TIME ZONE 'utc')
+        ON CONFLICT (table_name) DO UPDATE
+        SET last_user_id = EXCLUDED.last_user_id,
+            passes_completed = retention_checkpoints.passes_completed + EXCLUDED.passes_completed,
+            updated_at = EXCLUDED.updated_at
+    """), {"table": table, "last_user_id": last_user_id, "completed": 1 if pass_completed else 0})
+
+
+def _delete_expired_batch(table: str, user_ids: List[int], cutoffs: List[datetime]) -> int:
+    """Delete one batch of expired rows in its own short transaction."""
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{RETENTION_LOCK_TIMEOUT}'"))
+        result = conn.execute(text(_DELETE_EXPIRED[table]), {
+            "user_ids": user_ids,
+            "cutoffs": cutoffs,
+            "batch_size": settings.RETENTION_BATCH_SIZE,
+        })
+    RETENTION_STATS['batches'] += 1
+    RETENTION_STATS['rows_deleted'][table] += result.rowcount
+    return result.rowcount
+
+
+def _purge_table(table: str, default_days: Optional[int]) -> bool:
+    """
+    Delete expired rows from one table, resuming from its checkpoint.
+    Returns True when the pass over all users finished.
+    """
+    with engine.connect() as conn:
+        after_user_id = _get_checkpoint(conn, table)
+
+    while not _stop_requested.is_set():
+        now = datetime.utcnow()
+        with engine.connect() as conn:
+            chunk = _load_user_chunk(conn, after_user_id, default_days)
+        if not chunk:
+            with engine.begin() as conn:
+                _save_checkpoint(conn, table, 0, pass_completed=True)
+            return True
+
+        policy = [(user_id, now - timedelta(days=days)) for user_id, days in chunk if days is not None]
+        if policy:
+            user_ids = [user_id for user_id, _ in policy]
+            cutoffs = [cutoff for _, cutoff in policy]
+            while not _stop_requested.is_set():
+                deleted = _delete_expired_batch(table, user_ids, cutoffs)
+                if deleted < settings.RETENTION_BATCH_SIZE:
+                    break
+                time.sleep(settings.RETENTION_BATCH_DELAY)
+            else:
+                return False
+
+        after_user_id = chunk[-1][0]
+        with engine.begin() as conn:
+            _save_checkpoint(conn, table, after_user_id)
+        time.sleep(settings.RETENTION_BATCH_DELAY)
+
+    return False
+
+
+def _drop_expired_partitions(conn: Connection, longest_days: int):
+    """Drop partitions that only hold rows past every tier's retention (longest_days)."""
+    cutoff = datetime.utcnow() - timedelta(days=longest_days)
+    for table in _DELETE_EXPIRED:
+        if is_partitioned(conn, table):
+            dropped = drop_partitions_before(conn, table, cutoff)
+            RETENTION_STATS['partitions_dropped'] += len(dropped)
+
+
+def run_retention() -> Dict[str, int]:
+    """
+    Run one retention pass if no other worker is running one.
+    Returns the rows deleted per table during this run.
+    """
+    start = time.perf_counter()
+    deleted_before = dict(RETENTION_STATS['rows_deleted'])
+
+    with engine.connect() as lock_conn:
+        locked = lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": RETENTION_LOCK_KEY}).scalar()
+        # The lock is session-level; do not keep a transaction (and snapshot) open for the pass
+        lock_conn.commit()
+        if not locked:
+            RETENTION_STATS['skipped_locked'] += 1
+            return {}
+        try:
+            with engine.connect() as conn:
+                default_days = conn.execute(
+                    text("SELECT max_history_days FROM subscription_tiers WHERE name = :name"),
+                    {"name": DEFAULT_RETENTION_TIER}
+                ).scalar()
+                unlimited, longest_days = conn.execute(text(
+                    "SELECT bool_or(max_history_days IS NULL), max(max_history_days) FROM subscription_tiers"
+                )).one()
+
+            # Whole partitions can only go when every tier has a history limit
+            if longest_days is not None and not unlimited:
+                with engine.begin() as conn:
+                    conn.execute(text(f"SET LOCAL lock_timeout = '{RETENTION_LOCK_TIMEOUT}'"))
+                    _drop_expired_partitions(conn, longest_days)
+
+            for table in _DELETE_EXPIRED:
+                if _stop_requested.is_set():
+                    break
+                if _purge_table(table, default_days):
+                    RETENTION_STATS['passes_completed'] += 1
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RETENTION_LOCK_KEY})
+            lock_conn.commit()
+            elapsed = time.perf_counter() - start
+            RETENTION_STATS['runs'] += 1
+            RETENTION_STATS['time_spent'] += elapsed
+            RETENTION_STATS['last_run'] = time.time()
+            RETENTION_STATS['last_run_duration'] = elapsed
+
+    deleted = {
+        table: RETENTION_STATS['rows_deleted'][table] - deleted_before[table]
+        for table in _DELETE_EXPIRED
+    }
+    logger.info(f"Retention run removed {deleted} rows in {time.perf_counter() - start:.1f}s")
+    return deleted
+
+
+async def retention_task():
+    """Run retention every RETENTION_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL)
+        try:
+            # Database I/O runs in a worker thread to keep the event loop free
+            await asyncio.to_thread(run_retention)
+        except OperationalError as e:
+            if "lock timeout" in str(e):
+                # Gave way to application traffic; the checkpoint resumes next run
+                RETENTION_STATS['lock_timeouts'] += 1
+            else:
+                RETENTION_STATS['errors'] += 1
+                logger.error(f"Error in retention task: {e}")
+        except Exception as e:
+            RETENTION_STATS['errors'] += 1
+            logger.error(f"Error in retention task: {e}")
+
+
+def start_retention():
+    """Start the background retention task, if enabled."""
+    global _retention_task
+
+    if not settings.RETENTION_ENABLED:
+        return
+    if _retention_task is not None and not _retention_task.done():
+        return
+    _stop_requested.clear()
+    _retention_task = asyncio.create_task(retention_task())
+
+
+async def stop_retention():
+    """Stop the background retention task; a running pass stops after its current batch."""
+    global _retention_task
+
+    _stop_requested.set()
+    if _retention_task is not None:
+        _retention_task.cancel()
+        try:
+            await _retention_task
+        except asyncio.CancelledError:
+            pass
+        _retention_task = None
+
+
+def get_retention_stats() -> Dict[str, Any]:
+    """Get a snapshot of the retention engine for metrics."""
+    return dict(
+        RETENTION_STATS,
+        rows_deleted=dict(RETENTION_STATS['rows_deleted']),
+        enabled=settings.RETENTION_ENABLED
+    )
@@ -0,0 +1,370 @@
+"""
+Hourly and daily metrics rollups.
+
+Dashboards and reports read pre-aggregated rollups instead of raw rows:
+
+- `diagnostic_rollups`: per (user, tool, status)
+- `probe_result_rollups`: per (scheduled probe, status)
+- `node_diagnostic_rollups`: per probe node
+
+Each row covers one hour or one day (`granularity`) and holds the row count
+and, over rows with an execution time, their count, sum, min, max and a
+latency sketch: a log-scale histogram {bucket index: count}, where bucket i
+holds times in [SKETCH_GAMMA^i, SKETCH_GAMMA^(i+1)) ms. Sketches merge by
+adding counts, so any range of rollups can be combined; `sketch_entries`
+merges them in SQL and `sketch_percentiles` reads quantiles from the result.
+
+A background compactor refreshes the rollups every ROLLUP_INTERVAL seconds.
+Hourly rows are recomputed from raw rows for the last ROLLUP_RECOMPUTE_HOURS
+hours (so rows committed late are picked up), and daily rows are recomputed
+from the hourly ones for the days touched. Every refresh replaces whole
+buckets, so it is idempotent. On an empty rollup table the compactor backfills
+from the oldest raw row, one day per transaction.
+
+Rollups outside the recompute window are never rewritten, so they outlive the
+raw rows removed by history retention. Missing dimensions are stored as 0
+(ids) or '' (tool, status), since they are part of the primary key.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import BigInteger, Integer, and_, cast, func, or_, select, text, true
+from sqlalchemy.engine import Connection
+
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds between compactor runs
+ROLLUP_INTERVAL = 60
+
+# Hours recomputed from raw rows on every run
+ROLLUP_RECOMPUTE_HOURS = 2
+
+# Log histogram base for latency sketches (about 5% relative error)
+SKETCH_GAMMA = 1.1
+
+# Advisory lock key serializing compaction across workers
+ROLLUP_LOCK_KEY = 4006
+
+# How each rollup table is derived from its raw table
+ROLLUP_SOURCES = {
+    'diagnostic_rollups': {
+        'source': 'diagnostics',
+        'time_column': 'created_at',
+        'value': 'execution_time',
+        'dimensions': {
+            'user_id': 'COALESCE(user_id, 0)',
+            'tool': "COALESCE(tool, '')",
+            'status': "COALESCE(status, '')",
+        },
+    },
+    'probe_result_rollups': {
+        'source': 'probe_results',
+        'time_column': 'created_at',
+        'value': 'execution_time',
+        'dimensions': {
+            'scheduled_probe_id': 'COALESCE(scheduled_probe_id, 0)',
+            'status': "COALESCE(status, '')",
+        },
+    },
+    'node_diagnostic_rollups': {
+        'source': 'node_diagnostics',
+        'time_column': 'executed_at',
+        'value': 'execution_time',
+        'dimensions': {
+            'node_id': 'node_id',
+        },
+    },
+}
+
+# Percentiles reported from latency sketches
+SKETCH_PERCENTILES = (50, 95, 99)
+
+# Counters for metrics
+ROLLUP_STATS = {
+    'runs': 0,
+    'hourly_rows_written': 0,
+    'daily_rows_written': 0,
+    'errors': 0,
+    'skipped_locked': 0,
+    'last_run': None,
+    'last_run_duration': None,
+}
+
+_compactor_task: Optional[asyncio.Task] = None
+
+
+def _compact_hours(conn: Connection, rollup: str, start: datetime, end: datetime) -> int:
+    """Recompute hourly rollups for [start, end) from raw rows."""
+    config = ROLLUP_SOURCES[rollup]
+    dimensions = list(config['dimensions'])
+    dimension_exprs = ", ".join(f"{expr} AS {name}" for name, expr in config['dimensions'].items())
+    dimension_list = ", ".join(dimensions)
+    value = config['value']
+    time_column = config['time_column']
+
+    result = conn.execute(text(f"""
+        WITH buckets AS (
+            SELECT date_trunc('hour', {time_column}) AS bucket_start, {dimension_exprs},
+                   floor(ln(GREATEST({value}, 1)) / ln(:gamma))::int AS sketch_bucket,
+                   count(*) AS row_count,
+                   count({value}) AS time_count,
+                   sum({value}) AS time_sum,
+                   min({value}) AS time_min,
+                   max({value}) AS time_max
+            FROM {config['source']}
+            WHERE {time_column} >= :start AND {time_column} < :end
+            GROUP BY bucket_start, {dimension_list}, sketch_bucket
+        )
+        INSERT INTO {rollup} (granularity, bucket_start, {dimension_list},
+                              count, time_count, time_sum, time_min, time_max, latency_sketch)
+        SELECT 'hour', bucket_start, {dimension_list},
+               sum(row_count), sum(time_count), COALESCE(sum(time_sum), 0), min(time_min), max(time_max),
+               COALESCE(jsonb_object_agg(sketch_bucket, time_count) FILTER (WHERE time_count > 0), '{{}}'::jsonb)
+        FROM buckets
+        GROUP BY bucket_start, {dimension_list}
+        ON CONFLICT (granularity, bucket_start, {dimension_list}) DO UPDATE
+        SET count = EXCLUDED.count,
+            time_count = EXCLUDED.time_count,
+            time_sum = EXCLUDED.time_sum,
+            time_min = EXCLUDED.time_min,
+            time_max = EXCLUDED.time_max,
+            latency_sketch = EXCLUDED.latency_sketch
+    """), {"gamma": SKETCH_GAMMA, "start": start, "end": end})
+    return result.rowcount
+
+
+def _compact_days(conn: Connection, rollup: str, start: datetime, end: datetime) -> int:
+    """Recompute daily rollups for the days in [start, end) from hourly rollups."""
+    dimensions = list(ROLLUP_SOURCES[rollup]['dimensions'])
+    dimension_list = ", ".join(dimensions)
+    join_on = " AND ".join(f"s.{name} = t.{name}" for name in dimensions)
+
+    result = conn.execute(text(f"""
+        WITH hours AS (
+            SELECT * FROM {rollup}
+            WHERE granularity = 'hour' AND bucket_start >= :start AND bucket_start < :end
+        ), totals AS (
+            SELECT date_trunc('day', bucket_start) AS bucket_start, {dimension_list},
+                   sum(count) AS count, sum(time_count) AS time_count, sum(time_sum) AS time_sum,
+                   min(time_min) AS time_min, max(time_max) AS time_max
+            FROM hours
+            GROUP BY 1, {dimension_list}
+        ), sketch_entries AS (
+            SELECT date_trunc('day', h.bucket_start) AS bucket_start, {", ".join(f"h.{name}" for name in dimensions)},
+                   e.key, sum(e.value::bigint) AS n
+            FROM hours h CROSS JOIN LATERAL jsonb_each_text(h.latency_sketch) e
+            GROUP BY 1, {", ".join(f"h.{name}" for name in dimensions)}, e.key
+        ), sketches AS (
+            SELECT bucket_start, {dimension_list}, jsonb_object_agg(key, n) AS latency_sketch
+            FROM sketch_entries
+            GROUP BY bucket_start, {dimension_list}
+        )
+        INSERT INTO {rollup} (granularity, bucket_start, {dimension_list},
+                              count, time_count, time_sum, time_min, time_max, latency_sketch)
+        SELECT 'day', t.bucket_start, {", ".join(f"t.{name}" for name in dimensions)},
+               t.count, t.time_count, t.time_sum, t.time_min, t.time_max,
+               COALESCE(s.latency_sketch, '{{}}'::jsonb)
+        FROM totals t LEFT JOIN sketches s ON s.bucket_start = t.bucket_start AND {join_on}
+        ON CONFLICT (granularity, bucket_start, {dimension_list}) DO UPDATE
+        SET count = EXCLUDED.count,
+            time_count = EXCLUDED.time_count,
+            time_sum = EXCLUDED.time_sum,
+            time_min = EXCLUDED.time_min,
+            time_max = EXCLUDED.time_max,
+            latency_sketch = EXCLUDED.latency_sketch
+    """), {"start": start, "end": end})
+    return result.rowcount
+
+
+def _compaction_start(conn: Connection, rollup: str, now: datetime) -> Optional[datetime]:
+    """Get the first hour to recompute: recent hours, or the oldest raw row when backfilling."""
+    config = ROLLUP_SOURCES[rollup]
+    latest = conn.execute(text(
+        f"SELECT max(bucket_start) FROM {rollup} WHERE granularity = 'hour'"
+    )).scalar()
+    recent = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=ROLLUP_RECOMPUTE_HOURS - 1)
+    if latest is not None:
+        return min(latest, recent)
+
+    oldest = conn.execute(text(
+        f"SELECT min({config['time_column']}) FROM {config['source']}"
+    )).scalar()
+    if oldest is None:
+        return None
+    return oldest.replace(minute=0, second=0, microsecond=0)
+
+
+def compact_rollup(rollup: str, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Bring one rollup table up to date, one day per transaction."""
+    now = now or datetime.utcnow()
+    end = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    written = {'hourly': 0, 'daily': 0}
+
+    with engine.connect() as conn:
+        start = _compaction_start(conn, rollup, now)
+    if start is None:
+        return written
+
+    while start < end:
+        day_start = start.replace(hour=0)
+        day_end = day_start + timedelta(days=1)
+        with engine.begin() as conn:
+            written['hourly'] += _compact_hours(conn, rollup, start, min(day_end, end))
+            written['daily'] += _compact_days(conn, rollup, day_start, day_end)
+        start = day_end
+
+    return written
+
+
+def run_compaction() -> Dict[str, Dict[str, int]]:
+    """Refresh all rollup tables if no other worker is doing so."""
+    start = time.perf_counter()
+    with engine.connect() as lock_conn:
+        locked = lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ROLLUP_LOCK_KEY}).scalar()
+        # The lock is session-level; do not keep a transaction open while compacting
+        lock_conn.commit()
+        if not locked:
+            ROLLUP_STATS['skipped_locked'] += 1
+            return {}
+        try:
+            results = {rollup: compact_rollup(rollup) for rollup in ROLLUP_SOURCES}
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ROLLUP_LOCK_KEY})
+            lock_conn.commit()
+
+    for written in results.values():
+        ROLLUP_STATS['hourly_rows_written'] += written['hourly']
+        ROLLUP_STATS['daily_rows_written'] += written['daily']
+    ROLLUP_STATS['runs'] += 1
+    ROLLUP_STATS['last_run'] = time.time()
+    ROLLUP_STATS['last_run_duration'] = time.perf_counter() - start
+    return results
+
+
+async def rollup_compactor():
+    """Refresh the rollups every ROLLUP_INTERVAL seconds."""
+    while True:
+        try:
+            # Database I/O runs in a worker thread to keep the event loop free
+            await asyncio.to_thread(run_compaction)
+        except Exception as e:
+            ROLLUP_STATS['errors'] += 1
+            logger.error(f"Error compacting rollups: {e}")
+        await asyncio.sleep(ROLLUP_INTERVAL)
+
+
+def start_rollup_compactor():
+    """Start the background rollup compactor."""
+    global _compactor_task
+
+    if _compactor_task is not None and not _compactor_task.done():
+        return
+    _compactor_task = asyncio.create_task(rollup_compactor())
+
+
+async def stop_rollup_compactor():
+    """Stop the background rollup compactor."""
+    global _compactor_task
+
+    if _compactor_task is not None:
+        _compactor_task.cancel()
+        try:
+            await _compactor_task
+        except asyncio.CancelledError:
+            pass
+        _compactor_task = None
+
+
+def rollup_window(model, since: Optional[datetime] = None, now: Optional[datetime] = None):
+    """
+    Build a filter selecting the rollup rows covering [since, now], without double counting.
+    
+    Whole days use daily rows and the partial days at either end use hourly
+    rows. `since` is rounded down to the hour; None means all history.
+    """
+    now = now or datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if since is None:
+        return or_(
+            and_(model.granularity == 'day', model.bucket_start < today),
+            and_(model.granularity == 'hour', model.bucket_start >= today)
+        )
+
+    since_hour = since.replace(minute=0, second=0, microsecond=0)
+    first_day = since_hour.replace(hour=0)
+    if first_day < since_hour:
+        first_day += timedelta(days=1)
+    first_day = min(first_day, today)
+    return or_(
+        and_(model.granularity == 'day', model.bucket_start >= first_day, model.bucket_start < today),
+        and_(
+            model.granularity == 'hour',
+            model.bucket_start >= since_hour,
+            or_(model.bucket_start < first_day, model.bucket_start >= today)
+        )
+    )
+
+
+def sketch_entries(model, *group_by):
+    """
+    Build a query merging the latency sketches of `model` rows.
+    
+    Returns one row per group and sketch bucket: the group_by columns, then
+    `bucket` and `n`. Add a WHERE clause (for example rollup_window) before
+    executing it.
+    """
+    entries = func.jsonb_each_text(model.latency_sketch).table_valued("key", "value").lateral()
+    bucket = cast(entries.c.key, Integer).label("bucket")
+    return (
+        select(*group_by, bucket, func.sum(cast(entries.c.value, BigInteger)).label("n"))
+        .select_from(model)
+        .join(entries, true())
+        .group_by(*group_by, bucket)
+    )
+
+
+def merge_sketches(*sketches: Dict[Any, int]) -> Dict[int, int]:
+    """Merge latency sketches by adding their bucket counts."""
+    merged: Dict[int, int] = {}
+    for sketch in sketches:
+        for bucket, n in sketch.items():
+            merged[int(bucket)] = merged.get(int(bucket), 0) + int(n)
+    return merged
+
+
+def sketch_quantile(sketch: Dict[int, int], q: float) -> Optional[float]:
+    """Estimate the q-quantile (0..1) in milliseconds; None for an empty sketch."""
+    total = sum(sketch.values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for bucket in sorted(sketch):
+        seen += sketch[bucket]
+        if seen > rank:
+            break
+    if bucket <= 0:
+        # Bucket 0 also holds every time below 1ms
+        return 1.0
+    # Midpoint of [gamma^i, gamma^(i+1)) with equal relative error to both ends
+    return 2 * SKETCH_GAMMA ** (bucket + 1) / (SKETCH_GAMMA + 1)
+
+
+def sketch_percentiles(sketch: Dict[int, int]) -> Dict[str, Optional[int]]:
+    """Get SKETCH_PERCENTILES from a sketch as {"p50": ms, ...}."""
+    percentiles = {}
+    for percentile in SKETCH_PERCENTILES:
+        value = sketch_quantile(sketch, percentile / 100)
+        percentiles[f"p{percentile}"] = round(value) if value is not None else None
+    return percentiles
+
+
+def get_rollup_stats() -> Dict[str, Any]:
+    """Get a snapshot of the rollup compactor for metrics."""
+    return dict(ROLLUP_STATS)
@@ -4,6 +4,7 @@ Admin Database Management API
 
 This module provides routes for administrators to view and query database tables.
 All operations are carefully limited and protected to prevent performance issues.
+Reads go to the read replica when one is configured and within its staleness budget.
 """
 
 import time
@@ -18,7 +19,7 @@ from sqlalchemy.engine import CursorResult
 from pydantic import BaseModel, Field
 
 from app.auth import get_current_active_user, get_admin_user as get_current_admin_user
-from app.database import get_db, engine
+from app.database import get_db, get_read_engine
 from app.models import User
 from app.config import settings
 import logging
@@ -88,7 +89,7 @@ async def get_table_list(
     logger.info(f"Admin {current_user.username} requested table list")
     
     try:
-        inspector = inspect(engine)
+        inspector = inspect(get_read_engine())
         all_tables = inspector.get_table_names()
         # Only return allowed tables
         return [table for table in all_tables if table in ALLOWED_TABLES]
@@ -126,13 +127,13 @@ async def get_table_data(
     
     try:
         # Begin transaction
-        with engine.begin() as connection:
+        with get_read_engine().begin() as connection:
             # Get sensitive columns if any
             sensitive_columns = SENSITIVE_TABLES.get(table_name, [])
             
             # Build query with proper column selection
             metadata = MetaData()
-            table = Table(table_name, metadata, autoload_with=engine)
+            table = Table(table_name, metadata, autoload_with=connection)
             
             # Exclude sensitive columns
             columns = [c for c in table.columns if c.name not in sensitive_columns]
@@ -206,7 +207,7 @@ async def get_table_info(
         return table_metadata_cache[table_name]
     
     try:
-        inspector = inspect(engine)
+        inspector = inspect(get_read_engine())
         
         # Get column information
         columns = []
@@ -303,7 +304,7 @@ async def execute_read_query(
     try:
         start_time = time.time()
         
-        with engine.begin() as connection:
+        with get_read_engine().begin() as connection:
             # Set query timeout
             connection.execute(text(f"SET statement_timeout = {timeout * 1000}"))
             try:
@@ -365,13 +366,13 @@ async def download_table_data(
     
     try:
         # Get table data similar to get_table_data but without pagination
-        with engine.begin() as connection:
+        with get_read_engine().begin() as connection:
             # Get sensitive columns if any
             sensitive_columns = SENSITIVE_TABLES.get(table_name, [])
             
             # Build query with proper column selection
             metadata = MetaData()
-            table = Table(table_name, metadata, autoload_with=engine)
+            table = Table(table_name, metadata, autoload_with=connection)
             
             # Exclude sensitive columns
             columns = [c for c in table.columns if c.name not in sensitive_columns]
@@ -2,10 +2,12 @@ from datetime import datetime, timedelta
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
 from app import models, schemas, auth
 from app.database import get_db
+from app.credential_filter import API_KEY_FILTER
+from app.dashboard_cache import invalidate_dashboard
 
 router = APIRouter()
 
@@ -22,9 +24,11 @@ async def create_api_key(
     print(f"API key name: {key_data.name}, expires in {expires_days} days")
     
     try:
-        # Check if user has a subscription
-        if hasattr(current_user, 'user_subscription') and current_user.user_subscription:
-            user_subscription = current_user.user_subscription
+        # Check if user has a subscription (current_user is detached, so query it)
+        user_subscription = db.query(models.UserSubscription).options(
+            joinedload(models.UserSubscription.tier)
+        ).filter(models.UserSubscription.user_id == current_user.id).first()
+        if user_subscription and user_subscription.tier:
             
             # For debugging - print subscription info
             print(f"User subscription: {user_subscription.tier.name}")
@@ -45,28 +49,25 @@ async def create_api_key(
             #        detail=f"Maximum number of API keys ({user_subscription.tier.max_api_keys}) reached for your subscription tier."
             #    )
         
-        # Generate a new API key
-        api_key = auth.generate_api_key()
-        
         # Set expiration date if provided
         expires_at = None
         if expires_days:
             expires_at = datetime.utcnow() + timedelta(days=expires_days)
         
-        # Create API key record
-        db_api_key = models.ApiKey(
-            key=api_key,
+        # Create API key record (only the prefix and hash are stored)
+        db_api_key, api_key = auth.create_api_key(
+            db,
             name=key_data.name,
             user_id=current_user.id,
             expires_at=expires_at
         )
-        
-        db.add(db_api_key)
+        # The key is already committed; notify other workers in a transaction of its own
+        invalidate_dashboard(db, current_user.id)
         db.commit()
-        db.refresh(db_api_key)
         
         print(f"Successfully created API key with ID {db_api_key.id}")
-        return db_api_key
+        # The plaintext key is returned once and cannot be retrieved again
+        return schemas.ApiKeyResponse.model_validate(db_api_key).model_copy(update={"key": api_key})
         
     except Exception as e:
         print(f"Error creating API key: {str(e)}")
@@ -98,8 +99,13 @@ async def delete_api_key(
     if not api_key:
         raise HTTPException(status_code=404, detail="API key not found")
     
+    prefix = api_key.prefix
     db.delete(api_key)
+    invalidate_dashboard(db, current_user.id)
     db.commit()
+    auth.invalidate_cached_api_key(api_key_id)
+    if prefix:
+        API_KEY_FILTER.remove(prefix)
     
     return api_key
 
@@ -119,8 +125,10 @@ async def deactivate_api_key(
         raise HTTPException(status_code=404, detail="API key not found")
     
     api_key.is_active = False
+    invalidate_dashboard(db, current_user.id)
     db.commit()
     db.refresh(api_key)
+    auth.invalidate_cached_api_key(api_key_id)
     
     return api_key
 
@@ -140,7 +148,11 @@ async def activate_api_key(
         raise HTTPException(status_code=404, detail="API key not found")
     
     api_key.is_active = True
+    invalidate_dashboard(db, current_user.id)
     db.commit()
     db.refresh(api_key)
+    auth.invalidate_cached_api_key(api_key_id)
+    if api_key.key_hash:
+        API_KEY_FILTER.forget_invalid(api_key.key_hash)
     
     return api_key
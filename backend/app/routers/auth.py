@@ -1,26 +1,32 @@
+import logging
 from datetime import timedelta
 from typing import List, Dict, Any, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
 from pydantic import ValidationError
 
 from app import models, schemas, auth
-from app.database import get_db
+from app.database import get_async_db, get_db
 from app.config import settings
 from app.models import UserSubscription
 from app.middleware.rate_limit import rate_limit_dependency
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
 @router.post("/register", response_model=schemas.UserResponse)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if user already exists
-    db_user = db.query(models.User).filter(
+    result = await db.execute(select(models.User).where(
         (models.User.username == user.username) | (models.User.email == user.email)
-    ).first()
+    ))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(
             status_code=400,
@@ -28,17 +34,18 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         )
     
     # Create new user using auth helper function
-    db_user = auth.create_user(db, user, is_admin=False, email_verified=False)
+    db_user = await auth.create_user_async(db, user, is_admin=False, email_verified=False)
     
     # Assign free tier subscription to the new user
-    free_tier = db.query(models.SubscriptionTier).filter(models.SubscriptionTier.name == "FREE").first()
+    result = await db.execute(select(models.SubscriptionTier).where(models.SubscriptionTier.name == "FREE"))
+    free_tier = result.scalars().first()
     if free_tier:
         user_subscription = UserSubscription(
             user_id=db_user.id,
             tier_id=free_tier.id
         )
         db.add(user_subscription)
-        db.commit()
+        await db.commit()
     
     return db_user
 
@@ -46,24 +53,17 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
 @router.post("/login", response_model=schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(rate_limit_dependency)
 ):
-    # Print debug information about login attempt
-    print(f"Login attempt for username: {form_data.username}")
-
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
-        print(f"Authentication failed for username: {form_data.username}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Print successful login message
-    print(f"Authentication successful for user: {user.username} (email: {user.email})")
-    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
@@ -74,23 +74,16 @@ async def login_for_access_token(
 @router.post("/login/json", response_model=schemas.Token)
 async def login_json(
     user_login: schemas.UserLogin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Print debug information about login attempt
-    print(f"JSON login attempt for username: {user_login.username}")
-
-    user = auth.authenticate_user(db, user_login.username, user_login.password)
+    user = await auth.authenticate_user(db, user_login.username, user_login.password)
     if not user:
-        print(f"Authentication failed for username: {user_login.username}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Print successful login message
-    print(f"Authentication successful for user: {user.username} (email: {user.email})")
-    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
@@ -105,22 +98,14 @@ def read_me(current_user: models.User = Depends(auth.get_current_active_user), d
         joinedload(models.User.user_subscription).joinedload(models.UserSubscription.tier)
     ).filter(models.User.id == current_user.id).first()
     
-    # Debug logs to understand the object structure
-    print("👤 User to be returned:", user_with_subscription.__dict__)
-    if hasattr(user_with_subscription, "user_subscription") and user_with_subscription.user_subscription:
-        print("📊 User subscription:", user_with_subscription.user_subscription.__dict__)
-        if hasattr(user_with_subscription.user_subscription, "tier") and user_with_subscription.user_subscription.tier:
-            print("🏆 Subscription tier:", user_with_subscription.user_subscription.tier.__dict__)
-    
     try:
         response = schemas.UserDetailResponse.model_validate(user_with_subscription)
-        print("✅ Final Pydantic object:", response)
         return response
     except ValidationError as e:
-        print("❌ ValidationError in /me route:\n", e.json())
+        logger.error(f"Response validation failed in /me: {e}")
         raise HTTPException(status_code=500, detail="Response model validation failed")
     except Exception as e:
-        print(f"❌ Unexpected error in /me route: {str(e)}")
+        logger.error(f"Unexpected error in /me: {str(e)}")
         # If validation fails, try with dictionary conversion
         try:
             user_dict = {
@@ -135,7 +120,7 @@ def read_me(current_user: models.User = Depends(auth.get_current_active_user), d
             }
             return schemas.UserDetailResponse.model_validate(user_dict)
         except ValidationError as e:
-            print("❌ ValidationError with dict conversion:\n", e.json())
+            logger.error(f"Response validation failed in /me with dict conversion: {e}")
             raise HTTPException(status_code=500, detail="Response model validation failed even with dict conversion")
 
 
@@ -152,16 +137,17 @@ def list_users(
 
 
 @router.post("/users", response_model=schemas.UserResponse)
-def create_new_user(
+async def create_new_user(
     user_data: schemas.UserCreate,
     current_user: models.User = Depends(auth.get_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Admin endpoint to create a new user."""
     # Check if user already exists
-    db_user = db.query(models.User).filter(
+    result = await db.execute(select(models.User).where(
         (models.User.username == user_data.username) | (models.User.email == user_data.email)
-    ).first()
+    ))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(
             status_code=400,
@@ -172,17 +158,18 @@ def create_new_user(
     is_admin = user_data.dict().pop("is_admin", False) if hasattr(user_data, "is_admin") else False
     email_verified = user_data.dict().pop("email_verified", True) if hasattr(user_data, "email_verified") else True
     
-    db_user = auth.create_user(db, user_data, is_admin=is_admin, email_verified=email_verified)
+    db_user = await auth.create_user_async(db, user_data, is_admin=is_admin, email_verified=email_verified)
     
     # Assign free tier subscription by default
-    free_tier = db.query(models.SubscriptionTier).filter(models.SubscriptionTier.name == "FREE").first()
+    result = await db.execute(select(models.SubscriptionTier).where(models.SubscriptionTier.name == "FREE"))
+    free_tier = result.scalars().first()
     if free_tier:
         user_subscription = UserSubscription(
             user_id=db_user.id,
             tier_id=free_tier.id
         )
         db.add(user_subscription)
-        db.commit()
+        await db.commit()
     
     return db_user
 
@@ -195,22 +182,14 @@ def read_users_me(current_user: models.User = Depends(auth.get_current_active_us
         joinedload(models.User.user_subscription).joinedload(models.UserSubscription.tier)
     ).filter(models.User.id == current_user.id).first()
     
-    # Debug logs to understand the object structure
-    print("👤 User in /users/me route to be returned:", user_with_subscription.__dict__)
-    if hasattr(user_with_subscription, "user_subscription") and user_with_subscription.user_subscription:
-        print("📊 User subscription:", user_with_subscription.user_subscription.__dict__)
-        if hasattr(user_with_subscription.user_subscription, "tier") and user_with_subscription.user_subscription.tier:
-            print("🏆 Subscription tier:", user_with_subscription.user_subscription.tier.__dict__)
-    
     try:
         response = schemas.UserDetailResponse.model_validate(user_with_subscription)
-        print("✅ Final Pydantic object:", response)
         return response
     except ValidationError as e:
-        print("❌ ValidationError in /users/me route:\n", e.json())
+        logger.error(f"Response validation failed in /users/me: {e}")
         raise HTTPException(status_code=500, detail="Response model validation failed")
     except Exception as e:
-        print(f"❌ Unexpected error in /users/me route: {str(e)}")
+        logger.error(f"Unexpected error in /users/me: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing user data: {str(e)}")
 
 
@@ -263,6 +242,7 @@ def update_user_details(
     
     db.commit()
     db.refresh(user)
+    auth.invalidate_cached_user(user_id)
     return user
 
 
@@ -283,24 +263,26 @@ def delete_user(
     
     db.delete(user)
     db.commit()
+    auth.invalidate_cached_user(user_id)
     
     return {"success": True, "message": "User deleted successfully"}
 
 
 @router.post("/users/{user_id}/reset-password", response_model=Dict[str, Any])
-def admin_reset_password(
+async def admin_reset_password(
     user_id: int,
     password_data: schemas.PasswordReset,
     current_user: models.User = Depends(auth.get_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Admin endpoint to reset a user's password."""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user.hashed_password = auth.get_password_hash(password_data.password)
-    db.commit()
+    user.hashed_password = await auth.get_password_hash_async(password_data.password)
+    await db.commit()
+    auth.invalidate_cached_user(user_id)
     
     return {"success": True, "message": "Password reset successfully"}
 
@@ -318,6 +300,7 @@ def admin_verify_email(
     
     user.email_verified = True
     db.commit()
+    auth.invalidate_cached_user(user_id)
     
     return {"success": True, "message": "Email verified successfully"}
 
@@ -340,6 +323,7 @@ def change_user_status(
     
     user.is_active = status_data.is_active
     db.commit()
+    auth.invalidate_cached_user(user_id)
     
     status_message = "activated" if status_data.is_active else "deactivated"
     return {"success": True, "message": f"User {status_message} successfully"}
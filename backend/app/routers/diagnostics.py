@@ -4,11 +4,13 @@ from typing import List, Optional, Dict
 import json
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Body
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import models, schemas, auth
-from app.database import get_db
+from app.database import get_async_db, get_async_read_db
 from app.middleware.rate_limit import rate_limit_dependency
+from app.prometheus import TOOL_EXECUTION_DURATION
 from app.diagnostics.tools import (
     run_ping, run_traceroute, run_dns_lookup, run_reverse_dns_lookup,
     run_whois_lookup, run_port_check, run_http_request
@@ -22,7 +24,7 @@ async def ping_target(
     target: str = Query(..., description="Hostname or IP address to ping"),
     count: int = Query(4, description="Number of packets to send"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(rate_limit_dependency)
 ):
     start_time = time.time()
@@ -39,9 +41,10 @@ async def ping_target(
         execution_time=execution_time
     )
     
+    TOOL_EXECUTION_DURATION.observe(execution_time / 1000, tool=diagnostic.tool, status=diagnostic.status)
     db.add(diagnostic)
-    db.commit()
-    db.refresh(diagnostic)
+    await db.commit()
+    await db.refresh(diagnostic)
     
     return diagnostic
 
@@ -52,7 +55,7 @@ async def traceroute_target(
     max_hops: int = Query(30, description="Maximum number of hops"),
     user_id: int = Depends(rate_limit_dependency),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     start_time = time.time()
     success, result = run_traceroute(target, max_hops)
@@ -68,9 +71,10 @@ async def traceroute_target(
         execution_time=execution_time
     )
     
+    TOOL_EXECUTION_DURATION.observe(execution_time / 1000, tool=diagnostic.tool, status=diagnostic.status)
     db.add(diagnostic)
-    db.commit()
-    db.refresh(diagnostic)
+    await db.commit()
+    await db.refresh(diagnostic)
     
     return diagnostic
 
@@ -80,7 +84,7 @@ async def dns_lookup(
     target: str = Query(..., description="Hostname to look up"),
     record_type: str = Query("A", description="DNS record type (A, AAAA, MX, etc.)"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     start_time = time.time()
     success, result = run_dns_lookup(target, record_type)
@@ -96,9 +100,10 @@ async def dns_lookup(
         execution_time=execution_time
     )
     
+    TOOL_EXECUTION_DURATION.observe(execution_time / 1000, tool=diagnostic.tool, status=diagnostic.status)
     db.add(diagnostic)
-    db.commit()
-    db.refresh(diagnostic)
+    await db.commit()
+    await db.refresh(diagnostic)
     
     return diagnostic
 
@@ -107,7 +112,7 @@ async def dns_lookup(
 async def whois_lookup(
     target: str = Query(..., description="Domain to look up WHOIS information for"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     start_time = time.time()
     success, result = run_whois_lookup(target)
@@ -123,9 +128,10 @@ async def whois_lookup(
         execution_time=execution_time
     )
     
+    TOOL_EXECUTION_DURATION.observe(execution_time / 1000, tool=diagnostic.tool, status=diagnostic.status)
     db.add(diagnostic)
-    db.commit()
-    db.refresh(diagnostic)
+    await db.commit()
+    await db.refresh(diagnostic)
     
     return diagnostic
 
@@ -134,7 +140,7 @@ async def whois_lookup(
 async def reverse_dns_lookup(
     ip_address: str = Query(..., description="IP address to lookup (IPv4 or IPv6)"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     start_time = time.time()
     success, result = run_reverse_dns_lookup(ip_address)
@@ -150,9 +156,10 @@ async def reverse_dns_lookup(
         execution_time=execution_time
     )
     
+    TOOL_EXECUTION_DURATION.observe(execution_time / 1000, tool=diagnostic.tool, status=diagnostic.status)
     db.add(diagnostic)
-    db.commit()
-    db.refresh(diagnostic)
+    await db.commit()
+    await db.refresh(diagnostic)
     
     return diagnostic
 
@@ -164,7 +171,7 @@ async def nmap_scan(
     protocol: str = Query("tcp", description="Protocol (tcp or udp)"),
     timeout: int = Query(5, description="Timeout in seconds (1-60)"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     start_time = time.time()
     success, result = run_port_check(target, ports, protocol, timeout)
@@ -180,9 +187,10 @@ async def nmap_scan(
         execution_time=execution_time
     )
     
+    TOOL_EXECUTION_DURATION.observe(execution_time / 1000, tool=diagnostic.tool, status=diagnostic.status)
     db.add(diagnostic)
-    db.commit()
-    db.refresh(diagnostic)
+    await db.commit()
+    await db.refresh(diagnostic)
     
     return diagnostic
 
@@ -196,7 +204,7 @@ async def curl_request(
     headers: Optional[Dict[str, str]] = Body({}, description="Request headers"),
     body: Optional[str] = Body(None, description="Request body (for POST/PUT)"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     start_time = time.time()
     success, result = run_http_request(
@@ -214,9 +222,10 @@ async def curl_request(
         execution_time=execution_time
     )
     
+    TOOL_EXECUTION_DURATION.observe(execution_time / 1000, tool=diagnostic.tool, status=diagnostic.status)
     db.add(diagnostic)
-    db.commit()
-    db.refresh(diagnostic)
+    await db.commit()
+    await db.refresh(diagnostic)
     
     return diagnostic
 
@@ -227,13 +236,14 @@ async def get_diagnostic_history(
     limit: int = Query(10, description="Maximum number of results to return"),
     skip: int = Query(0, description="Number of results to skip"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    query = db.query(models.Diagnostic).filter(models.Diagnostic.user_id == current_user.id)
+    query = select(models.Diagnostic).where(models.Diagnostic.user_id == current_user.id)
     
     if tool:
-        query = query.filter(models.Diagnostic.tool == tool)
+        query = query.where(models.Diagnostic.tool == tool)
     
-    diagnostics = query.order_by(models.Diagnostic.created_at.desc()).offset(skip).limit(limit).all()
+    result = await db.execute(query.order_by(models.Diagnostic.created_at.desc()).offset(skip).limit(limit))
+    diagnostics = result.scalars().all()
     
     return diagnostics
@@ -1,19 +1,100 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+import secrets
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, desc, select
 from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
 
-from app.database import get_db
-from app.models import Diagnostic, ApiKey, ScheduledProbe, ProbeResult, User
+from app.database import get_async_read_db, get_database_health
+from app.models import DiagnosticRollup, ApiKey, ScheduledProbe, ProbeResult, User
 from app import auth
+from app.middleware.rate_limit import get_rate_limiter_stats
+from app.credential_filter import get_credential_filter_stats
+from app.password_hashing import get_password_hash_stats
+from app.logging_config import get_logging_stats
+from app.pool_metrics import get_pool_stats
+from app.partitions import get_partition_stats
+from app.retention import get_retention_stats
+from app.bootstrap import get_startup_stats
+from app.config import settings
+from app.dashboard_cache import cache_dashboard, get_cached_dashboard, get_dashboard_cache_stats
+from app.prometheus import render_metrics, render_samples
+from app.routers.ws_node import get_connected_nodes_by_region
+from app.rollups import get_rollup_stats, merge_sketches, rollup_window, sketch_entries, sketch_percentiles
 
 router = APIRouter()
 
 
+async def _diagnostic_summary(db: AsyncSession, since: datetime, user_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Aggregate diagnostics since a point in time, overall and per tool.
+    
+    Reads the diagnostic rollups (see app.rollups), so the cost depends on
+    the number of tools and days, not on the number of diagnostics. `since`
+    is rounded down to the hour. Percentiles come from the merged latency
+    sketches and are accurate to within about 5%.
+    """
+    query = select(
+        DiagnosticRollup.tool,
+        func.sum(DiagnosticRollup.count).label("total"),
+        func.sum(DiagnosticRollup.count).filter(DiagnosticRollup.status == 'success').label("successful"),
+        func.sum(DiagnosticRollup.time_count).label("timed"),
+        func.sum(DiagnosticRollup.time_sum).label("time_sum")
+    ).where(rollup_window(DiagnosticRollup, since))
+    if user_id is not None:
+        query = query.where(DiagnosticRollup.user_id == user_id)
+    rows = (await db.execute(query.group_by(DiagnosticRollup.tool).order_by(desc("total")))).all()
+    
+    # Latency sketches merged per tool in SQL
+    sketch_query = sketch_entries(DiagnosticRollup, DiagnosticRollup.tool).where(rollup_window(DiagnosticRollup, since))
+    if user_id is not None:
+        sketch_query = sketch_query.where(DiagnosticRollup.user_id == user_id)
+    sketches: Dict[str, Dict[int, int]] = {}
+    for entry in (await db.execute(sketch_query)).all():
+        sketches.setdefault(entry.tool, {})[entry.bucket] = int(entry.n)
+    
+    by_tool = {}
+    total = successful = timed = 0
+    time_sum = 0.0
+    for row in rows:
+        row_total = int(row.total or 0)
+        row_successful = int(row.successful or 0)
+        row_timed = int(row.timed or 0)
+        row_time_sum = float(row.time_sum or 0)
+        by_tool[row.tool or "unknown"] = {
+            "count": row_total,
+            "success_rate": int(row_successful / row_total * 100) if row_total else 0,
+            "avg_response_time": int(row_time_sum / row_timed) if row_timed else 0,
+            "response_time_percentiles": sketch_percentiles(sketches.get(row.tool, {})),
+        }
+        total += row_total
+        successful += row_successful
+        timed += row_timed
+        time_sum += row_time_sum
+    
+    return {
+        "count": total,
+        "success_rate": int(successful / total * 100) if total else 0,
+        "avg_response_time": int(time_sum / timed) if timed else 0,
+        "response_time_percentiles": sketch_percentiles(merge_sketches(*sketches.values())),
+        "by_tool": by_tool,
+    }
+
+
+async def _diagnostic_total(db: AsyncSession, user_id: Optional[int] = None) -> int:
+    """Count all diagnostics from the rollups, optionally for one user."""
+    query = select(func.sum(DiagnosticRollup.count)).where(rollup_window(DiagnosticRollup))
+    if user_id is not None:
+        query = query.where(DiagnosticRollup.user_id == user_id)
+    return int((await db.execute(query)).scalar() or 0)
+
+
 @router.get("/metrics/dashboard")
 async def get_dashboard_metrics(
     current_user: User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Get dashboard metrics for the current user.
@@ -24,60 +105,58 @@ async def get_dashboard_metrics(
     - Number of scheduled probes the user has
     - Success rate of diagnostics
     - Average response time of diagnostics
+    - Response time percentiles (p50, p95, p99)
+    - Count, success rate, average response time and percentiles per tool
+    
+    Rates and averages cover the last 30 days. Figures come from the
+    diagnostic rollups, so they can lag by up to a minute. Results are
+    cached per user (see app.dashboard_cache).
     """
+    cached, epoch = get_cached_dashboard(current_user.id)
+    if cached is not None:
+        return cached
+    
     # Get count of user's diagnostics
-    diagnostic_count = db.query(func.count(Diagnostic.id)).filter(
-        Diagnostic.user_id == current_user.id
-    ).scalar() or 0
+    diagnostic_count = await _diagnostic_total(db, user_id=current_user.id)
     
     # Get count of user's API keys
-    api_key_count = db.query(func.count(ApiKey.id)).filter(
-        ApiKey.user_id == current_user.id,
-        ApiKey.is_active == True
-    ).scalar() or 0
+    api_key_count = (await db.execute(
+        select(func.count(ApiKey.id)).where(
+            ApiKey.user_id == current_user.id,
+            ApiKey.is_active == True
+        )
+    )).scalar() or 0
     
     # Get count of user's active scheduled probes
-    scheduled_probe_count = db.query(func.count(ScheduledProbe.id)).filter(
-        ScheduledProbe.user_id == current_user.id,
-        ScheduledProbe.is_active == True
-    ).scalar() or 0
+    scheduled_probe_count = (await db.execute(
+        select(func.count(ScheduledProbe.id)).where(
+            ScheduledProbe.user_id == current_user.id,
+            ScheduledProbe.is_active == True
+        )
+    )).scalar() or 0
     
-    # Calculate success rate and average response time
-    # Get all diagnostics for the last 30 days
+    # Success rate and average response time over the last 30 days, computed in SQL
     thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    recent_diagnostics = db.query(Diagnostic).filter(
-        Diagnostic.user_id == current_user.id,
-        Diagnostic.created_at >= thirty_days_ago
-    ).all()
-    
-    # Calculate success rate
-    if recent_diagnostics:
-        successful_diagnostics = [d for d in recent_diagnostics if d.status == 'success']
-        success_rate = int((len(successful_diagnostics) / len(recent_diagnostics)) * 100)
-    else:
-        success_rate = 0
-    
-    # Calculate average response time
-    if recent_diagnostics:
-        execution_times = [d.execution_time for d in recent_diagnostics if d.execution_time is not None]
-        avg_response_time = int(sum(execution_times) / len(execution_times)) if execution_times else 0
-    else:
-        avg_response_time = 0
+    recent = await _diagnostic_summary(db, thirty_days_ago, user_id=current_user.id)
     
     # Return the combined metrics
-    return {
+    dashboard = {
         "diagnostic_count": diagnostic_count,
         "api_key_count": api_key_count,
         "scheduled_probe_count": scheduled_probe_count,
-        "success_rate": success_rate,
-        "avg_response_time": avg_response_time
+        "success_rate": recent["success_rate"],
+        "avg_response_time": recent["avg_response_time"],
+        "response_time_percentiles": recent["response_time_percentiles"],
+        "by_tool": recent["by_tool"]
     }
+    cache_dashboard(current_user.id, dashboard, epoch)
+    return dashboard
 
 
 @router.get("/metrics/system")
 async def get_system_metrics(
     current_user: User = Depends(auth.get_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Get system-wide metrics (admin only).
@@ -86,31 +165,29 @@ async def get_system_metrics(
     - Total users
     - Total diagnostics
     - Total scheduled probes
-    - Overall success rate
+    - Overall success rate and response time percentiles
+    - Count, success rate, average response time and percentiles per tool (last 30 days)
     - System health indicators
+    
+    Diagnostic figures come from the rollups, so they can lag by up to a minute.
     """
     # Get total counts
-    user_count = db.query(func.count(User.id)).scalar() or 0
-    diagnostic_count = db.query(func.count(Diagnostic.id)).scalar() or 0
-    scheduled_probe_count = db.query(func.count(ScheduledProbe.id)).scalar() or 0
+    user_count = (await db.execute(select(func.count(User.id)))).scalar() or 0
+    diagnostic_count = await _diagnostic_total(db)
+    scheduled_probe_count = (await db.execute(select(func.count(ScheduledProbe.id)))).scalar() or 0
     
-    # Calculate overall success rate
+    # Calculate overall success rate over the last 30 days, computed in SQL
     thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    recent_diagnostics = db.query(Diagnostic).filter(
-        Diagnostic.created_at >= thirty_days_ago
-    ).all()
-    
-    if recent_diagnostics:
-        successful_diagnostics = [d for d in recent_diagnostics if d.status == 'success']
-        success_rate = int((len(successful_diagnostics) / len(recent_diagnostics)) * 100)
-    else:
-        success_rate = 0
+    recent = await _diagnostic_summary(db, thirty_days_ago)
     
     # Get active users in the last 7 days
     seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    active_users = db.query(func.count(func.distinct(Diagnostic.user_id))).filter(
-        Diagnostic.created_at >= seven_days_ago
-    ).scalar() or 0
+    active_users = (await db.execute(
+        select(func.count(func.distinct(DiagnosticRollup.user_id))).where(
+            rollup_window(DiagnosticRollup, seven_days_ago),
+            DiagnosticRollup.user_id != 0
+        )
+    )).scalar() or 0
     
     # Return the combined metrics
     return {
@@ -118,6 +195,135 @@ async def get_system_metrics(
         "active_users": active_users,
         "total_diagnostics": diagnostic_count,
         "total_scheduled_probes": scheduled_probe_count,
-        "overall_success_rate": success_rate,
+        "overall_success_rate": recent["success_rate"],
+        "response_time_percentiles": recent["response_time_percentiles"],
+        "by_tool": recent["by_tool"],
         "system_health": "good"  # Placeholder for real system health monitoring
-    }
\ No newline at end of file
+    }
+
+
+@router.get("/metrics/internals")
+async def get_internal_metrics(
+    current_user: User = Depends(auth.get_admin_user)
+):
+    """
+    Get backend internals for this worker (admin only).
+    
+    Returns in-process state that is not stored in the database:
+    - Rate limiter state, including the current adaptive concurrency limit
+      and subscription limits cache hit ratio
+    - Principal (authenticated user), API key and dashboard cache hit ratios
+    - Credential filter rejection rates for API keys and node keys
+    - Password hashing pool usage and login latency
+    - Logging queue depth and dropped/suppressed record counts
+    - Database connection health, fail-fast state and read replica lag
+    - Connection pool usage, plus checkout waits, hold times and timeouts
+      per pool and per route
+    - Partition maintenance runs and partition counts per table
+    - History retention: rows removed per table, partitions dropped and time spent
+    - Startup timings (import, startup event, bootstrap steps, time to ready)
+    - Rollup compactor runs and rows written
+    """
+    return {
+        "rate_limiter": get_rate_limiter_stats(),
+        "principal_cache": auth.get_principal_cache_stats(),
+        "api_key_cache": auth.get_api_key_cache_stats(),
+        "dashboard_cache": get_dashboard_cache_stats(),
+        "credential_filter": get_credential_filter_stats(),
+        "password_hashing": get_password_hash_stats(),
+        "logging": get_logging_stats(),
+        "database": get_database_health(),
+        "database_pools": get_pool_stats(),
+        "partitions": get_partition_stats(),
+        "retention": get_retention_stats(),
+        "startup": get_startup_stats(),
+        "rollups": get_rollup_stats()
+    }
+
+
+def _scrape_families() -> List[List[str]]:
+    """Render scrape-time samples from state kept by other modules."""
+    limiter = get_rate_limiter_stats()
+    adaptive = limiter['adaptive']
+    pools = get_pool_stats()
+    caches = {
+        'subscription_limits': limiter['limits_cache'],
+        'principal': auth.get_principal_cache_stats(),
+        'api_key': auth.get_api_key_cache_stats(),
+        'dashboard': get_dashboard_cache_stats(),
+    }
+    
+    families = [
+        render_samples("probeops_rate_limiter_queue_depth", "gauge", "Requests waiting in the rate limiter queues.", [
+            ("probeops_rate_limiter_queue_depth", {"queue": "user"}, limiter['queue_depth']),
+            ("probeops_rate_limiter_queue_depth", {"queue": "adaptive"}, adaptive['queue_depth']),
+        ]),
+        render_samples("probeops_rate_limiter_in_flight", "gauge", "Requests holding an adaptive concurrency slot.", [
+            ("probeops_rate_limiter_in_flight", {}, adaptive['in_flight']),
+        ]),
+        render_samples("probeops_rate_limiter_concurrency_limit", "gauge", "Current adaptive concurrency limit.", [
+            ("probeops_rate_limiter_concurrency_limit", {}, adaptive['limit']),
+        ]),
+        render_samples("probeops_rate_limiter_shed_total", "counter", "Requests shed by the adaptive limiter.", [
+            ("probeops_rate_limiter_shed_total", {}, adaptive['shed']),
+        ]),
+        render_samples("probeops_db_pool_connections", "gauge", "Database pool connections by state.", [
+            ("probeops_db_pool_connections", {"pool": pool_name, "state": state}, stats[state])
+            for pool_name, stats in pools.items()
+            for state in ('checked_out', 'checked_in', 'overflow')
+        ]),
+        render_samples("probeops_db_pool_size", "gauge", "Configured database pool size.", [
+            ("probeops_db_pool_size", {"pool": pool_name}, stats['size']) for pool_name, stats in pools.items()
+        ]),
+        render_samples("probeops_db_pool_checkouts_total", "counter", "Database pool checkouts.", [
+            ("probeops_db_pool_checkouts_total", {"pool": pool_name}, stats['checkouts'])
+            for pool_name, stats in pools.items()
+        ]),
+        render_samples("probeops_db_pool_timeouts_total", "counter", "Database pool checkouts that timed out.", [
+            ("probeops_db_pool_timeouts_total", {"pool": pool_name}, stats['timeouts'])
+            for pool_name, stats in pools.items()
+        ]),
+        render_samples("probeops_db_pool_wait_seconds_total", "counter", "Time spent waiting for pool checkouts.", [
+            ("probeops_db_pool_wait_seconds_total", {"pool": pool_name}, stats['wait_total'])
+            for pool_name, stats in pools.items()
+        ]),
+        render_samples("probeops_cache_requests_total", "counter", "In-process cache lookups by result.", [
+            ("probeops_cache_requests_total", {"cache": cache, "result": result}, stats[counter])
+            for cache, stats in caches.items()
+            for result, counter in (('hit', 'hits'), ('miss', 'misses'))
+        ]),
+        render_samples("probeops_cache_hit_ratio", "gauge", "In-process cache hit ratio since the worker started.", [
+            ("probeops_cache_hit_ratio", {"cache": cache},
+             stats['hits'] / (stats['hits'] + stats['misses']) if stats['hits'] + stats['misses'] else None)
+            for cache, stats in caches.items()
+        ]),
+        render_samples("probeops_connected_nodes", "gauge", "Probe nodes connected to this worker by region.", [
+            ("probeops_connected_nodes", {"region": region}, count)
+            for region, count in get_connected_nodes_by_region().items()
+        ]),
+    ]
+    return families
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_prometheus_metrics(request: Request):
+    """
+    Backend internals for this worker in the Prometheus text format.
+    
+    Includes request latency per route, rate limiter queue depth and wait
+    time, connection pool usage, tool execution time per tool, connected
+    nodes per region, WebSocket message counts and cache hit ratios.
+    Scrapers must send METRICS_TOKEN as a bearer token; without a token the
+    endpoint is disabled unless METRICS_PUBLIC is set.
+    """
+    if settings.METRICS_TOKEN:
+        authorization = request.headers.get("authorization", "")
+        if not secrets.compare_digest(authorization, f"Bearer {settings.METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    elif not settings.METRICS_PUBLIC:
+        raise HTTPException(status_code=403, detail="Metrics scraping is disabled; set METRICS_TOKEN or METRICS_PUBLIC")
+    
+    return PlainTextResponse(
+        render_metrics(_scrape_families()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -3,6 +3,7 @@ Router for probe node management endpoints.
 These endpoints allow for probe node registration, heartbeats, and management.
 """
 from fastapi import APIRouter, Depends, HTTPException, Body, Query, status
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from typing import List, Optional, Dict, Any
@@ -12,8 +13,10 @@ import logging
 import uuid
 
 from .. import models, schemas, auth
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..config import settings
+from ..credential_filter import NODE_KEY_FILTER, hash_credential
+from ..rollups import rollup_window, sketch_entries, sketch_percentiles
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -171,6 +174,7 @@ async def register_node(
         db.add(new_node)
         db.commit()
         db.refresh(new_node)
+        NODE_KEY_FILTER.add(api_key)
         
         logger.info(f"New probe node registered: {new_node.name} ({node_uuid}) in region {new_node.region}")
         
@@ -239,6 +243,7 @@ async def register_node_root(
         db.add(new_node)
         db.commit()
         db.refresh(new_node)
+        NODE_KEY_FILTER.add(api_key)
         
         logger.info(f"New probe node registered via root endpoint: {new_node.name} ({node_uuid}) in region {new_node.region}")
         
@@ -288,6 +293,7 @@ async def register_node_root(
         db.add(new_node)
         db.commit()
         db.refresh(new_node)
+        NODE_KEY_FILTER.add(api_key)
         
         # Update token with node ID now that we have it
         token_record.node_id = new_node.id
@@ -321,10 +327,22 @@ async def node_heartbeat(
     Update node status with a heartbeat.
     This endpoint is called periodically by active probe nodes.
     """
+    # Reject unknown API keys before touching the database
+    key_hash = hash_credential(api_key)
+    if not NODE_KEY_FILTER.might_be_valid(api_key, key_hash, db):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid node identifier or API key"
+        )
+    
     # Find the node by UUID and validate API key
     node = db.query(models.ProbeNode).filter(models.ProbeNode.node_uuid == heartbeat.node_uuid).first()
     
     if not node or node.api_key != api_key:
+        # Only cache keys that belong to no node; a valid key sent with the
+        # wrong UUID must keep working once the UUID is fixed
+        if not db.query(models.ProbeNode.id).filter(models.ProbeNode.api_key == api_key).first():
+            NODE_KEY_FILTER.remember_invalid(key_hash)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid node identifier or API key"
@@ -406,6 +424,54 @@ async def get_node(
     return node
 
 
+@router.get("/{node_uuid}/latency", response_model=Dict[str, Any])
+async def get_node_latency(
+    node_uuid: str,
+    days: int = Query(7, ge=1, le=365, description="Number of days to summarize"),
+    current_user: models.User = Depends(auth.get_admin_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get execution time percentiles for a probe node (admin only).
+    Reads the node rollups, so figures are aligned to the hour and can lag
+    by up to a minute.
+    """
+    node = db.query(models.ProbeNode).filter(models.ProbeNode.node_uuid == node_uuid).first()
+    
+    if not node:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Node not found"
+        )
+    
+    rollup = models.NodeDiagnosticRollup
+    window = rollup_window(rollup, datetime.utcnow() - timedelta(days=days))
+    row = db.execute(
+        select(
+            func.sum(rollup.count).label("total"),
+            func.sum(rollup.time_count).label("timed"),
+            func.sum(rollup.time_sum).label("time_sum"),
+            func.min(rollup.time_min).label("time_min"),
+            func.max(rollup.time_max).label("time_max")
+        ).where(rollup.node_id == node.id, window)
+    ).one()
+    sketch = {
+        entry.bucket: int(entry.n)
+        for entry in db.execute(sketch_entries(rollup).where(rollup.node_id == node.id, window)).all()
+    }
+    
+    timed = int(row.timed or 0)
+    return {
+        "node_uuid": node_uuid,
+        "days": days,
+        "diagnostic_count": int(row.total or 0),
+        "avg_execution_time": round(float(row.time_sum or 0) / timed, 1) if timed else 0,
+        "min_execution_time": row.time_min,
+        "max_execution_time": row.time_max,
+        "execution_time_percentiles": sketch_percentiles(sketch)
+    }
+
+
 @router.put("/{node_uuid}", response_model=schemas.ProbeNodeResponse)
 async def update_node(
     node_uuid: str,
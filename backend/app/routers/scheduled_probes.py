@@ -1,20 +1,45 @@
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import models, schemas, auth
-from app.database import get_db
+from app.database import get_async_db, get_async_read_db
+from app.dashboard_cache import invalidate_dashboard_async
 from app.middleware.rate_limit import rate_limit_dependency
+from app.rollups import rollup_window, sketch_entries, sketch_percentiles
 
 router = APIRouter()
 
+# Limits for /probes/{probe_id}/timeseries
+TIMESERIES_MAX_POINTS = 2000
+TIMESERIES_MAX_DAYS = 366
+
+
+async def _get_user_probe(db: AsyncSession, probe_id: int, user_id: int) -> Optional[models.ScheduledProbe]:
+    """Get a scheduled probe by ID if it belongs to the user."""
+    result = await db.execute(
+        select(models.ScheduledProbe).where(
+            models.ScheduledProbe.id == probe_id,
+            models.ScheduledProbe.user_id == user_id
+        )
+    )
+    return result.scalar_one_or_none()
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Convert an aware datetime to naive UTC, as timestamps are stored."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 
 @router.post("/probes", response_model=schemas.ScheduledProbeResponse)
 async def create_scheduled_probe(
     probe: schemas.ScheduledProbeCreate,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(rate_limit_dependency)
 ):
     """
@@ -31,9 +56,11 @@ async def create_scheduled_probe(
         )
     
     # We'll keep track of the probe count but not enforce a limit for now
-    probe_count = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.user_id == current_user.id
-    ).count()
+    probe_count = (await db.execute(
+        select(func.count(models.ScheduledProbe.id)).where(
+            models.ScheduledProbe.user_id == current_user.id
+        )
+    )).scalar()
     
     # Create the scheduled probe
     db_probe = models.ScheduledProbe(
@@ -50,8 +77,9 @@ async def create_scheduled_probe(
     )
     
     db.add(db_probe)
-    db.commit()
-    db.refresh(db_probe)
+    await invalidate_dashboard_async(db, current_user.id)
+    await db.commit()
+    await db.refresh(db_probe)
     
     return db_probe
 
@@ -62,20 +90,21 @@ async def get_scheduled_probes(
     skip: int = Query(0, description="Number of items to skip"),
     limit: int = Query(100, description="Maximum number of items to return"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     user_id: int = Depends(rate_limit_dependency)
 ):
     """
     Get all scheduled probes for the current user.
     """
-    query = db.query(models.ScheduledProbe).filter(
+    query = select(models.ScheduledProbe).where(
         models.ScheduledProbe.user_id == current_user.id
     )
     
     if active_only:
-        query = query.filter(models.ScheduledProbe.is_active == True)
+        query = query.where(models.ScheduledProbe.is_active == True)
     
-    probes = query.order_by(models.ScheduledProbe.created_at.desc()).offset(skip).limit(limit).all()
+    result = await db.execute(query.order_by(models.ScheduledProbe.created_at.desc()).offset(skip).limit(limit))
+    probes = result.scalars().all()
     
     return probes
 
@@ -84,16 +113,13 @@ async def get_scheduled_probes(
 async def get_scheduled_probe(
     probe_id: int,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(rate_limit_dependency)
 ):
     """
     Get a specific scheduled probe by ID.
     """
-    probe = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id == probe_id,
-        models.ScheduledProbe.user_id == current_user.id
-    ).first()
+    probe = await _get_user_probe(db, probe_id, current_user.id)
     
     if not probe:
         raise HTTPException(
@@ -109,7 +135,7 @@ async def update_scheduled_probe(
     probe_id: int,
     probe_update: schemas.ScheduledProbeCreate,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Update a specific scheduled probe.
@@ -124,10 +150,7 @@ async def update_scheduled_probe(
         )
     
     # Get the existing probe
-    probe = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id == probe_id,
-        models.ScheduledProbe.user_id == current_user.id
-    ).first()
+    probe = await _get_user_probe(db, probe_id, current_user.id)
     
     if not probe:
         raise HTTPException(
@@ -147,8 +170,9 @@ async def update_scheduled_probe(
     probe.threshold_value = probe_update.threshold_value
     probe.updated_at = datetime.utcnow()
     
-    db.commit()
-    db.refresh(probe)
+    await invalidate_dashboard_async(db, current_user.id)
+    await db.commit()
+    await db.refresh(probe)
     
     return probe
 
@@ -157,15 +181,12 @@ async def update_scheduled_probe(
 async def delete_scheduled_probe(
     probe_id: int,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete a specific scheduled probe.
     """
-    probe = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id == probe_id,
-        models.ScheduledProbe.user_id == current_user.id
-    ).first()
+    probe = await _get_user_probe(db, probe_id, current_user.id)
     
     if not probe:
         raise HTTPException(
@@ -173,8 +194,9 @@ async def delete_scheduled_probe(
             detail="Scheduled probe not found"
         )
     
-    db.delete(probe)
-    db.commit()
+    await db.delete(probe)
+    await invalidate_dashboard_async(db, current_user.id)
+    await db.commit()
     
     return None
 
@@ -183,15 +205,12 @@ async def delete_scheduled_probe(
 async def pause_scheduled_probe(
     probe_id: int,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Pause a specific scheduled probe.
     """
-    probe = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id == probe_id,
-        models.ScheduledProbe.user_id == current_user.id
-    ).first()
+    probe = await _get_user_probe(db, probe_id, current_user.id)
     
     if not probe:
         raise HTTPException(
@@ -202,8 +221,9 @@ async def pause_scheduled_probe(
     probe.is_active = False
     probe.updated_at = datetime.utcnow()
     
-    db.commit()
-    db.refresh(probe)
+    await invalidate_dashboard_async(db, current_user.id)
+    await db.commit()
+    await db.refresh(probe)
     
     return probe
 
@@ -212,15 +232,12 @@ async def pause_scheduled_probe(
 async def resume_scheduled_probe(
     probe_id: int,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Resume a specific scheduled probe.
     """
-    probe = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id == probe_id,
-        models.ScheduledProbe.user_id == current_user.id
-    ).first()
+    probe = await _get_user_probe(db, probe_id, current_user.id)
     
     if not probe:
         raise HTTPException(
@@ -231,8 +248,9 @@ async def resume_scheduled_probe(
     probe.is_active = True
     probe.updated_at = datetime.utcnow()
     
-    db.commit()
-    db.refresh(probe)
+    await invalidate_dashboard_async(db, current_user.id)
+    await db.commit()
+    await db.refresh(probe)
     
     return probe
 
@@ -243,16 +261,13 @@ async def get_probe_results(
     skip: int = Query(0, description="Number of items to skip"),
     limit: int = Query(50, description="Maximum number of items to return"),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Get results for a specific scheduled probe.
     """
     # Verify the probe exists and belongs to the user
-    probe = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id == probe_id,
-        models.ScheduledProbe.user_id == current_user.id
-    ).first()
+    probe = await _get_user_probe(db, probe_id, current_user.id)
     
     if not probe:
         raise HTTPException(
@@ -261,18 +276,150 @@ async def get_probe_results(
         )
     
     # Get the results
-    results = db.query(models.ProbeResult).filter(
-        models.ProbeResult.scheduled_probe_id == probe_id
-    ).order_by(models.ProbeResult.created_at.desc()).offset(skip).limit(limit).all()
+    result = await db.execute(
+        select(models.ProbeResult).where(
+            models.ProbeResult.scheduled_probe_id == probe_id
+        ).order_by(models.ProbeResult.created_at.desc()).offset(skip).limit(limit)
+    )
+    results = result.scalars().all()
     
     return results
 
 
+@router.get("/probes/{probe_id}/summary", response_model=dict)
+async def get_probe_summary(
+    probe_id: int,
+    days: int = Query(7, ge=1, le=365, description="Number of days to summarize"),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Get result counts, success rate and response times (including p50, p95
+    and p99) for a scheduled probe.
+    
+    Reads the probe result rollups, so figures are aligned to the hour and
+    can lag by up to a minute.
+    """
+    probe = await _get_user_probe(db, probe_id, current_user.id)
+    
+    if not probe:
+        raise HTTPException(
+            status_code=404,
+            detail="Scheduled probe not found"
+        )
+    
+    rollup = models.ProbeResultRollup
+    window = rollup_window(rollup, datetime.utcnow() - timedelta(days=days))
+    row = (await db.execute(
+        select(
+            func.sum(rollup.count).label("total"),
+            func.sum(rollup.count).filter(rollup.status == 'success').label("successful"),
+            func.sum(rollup.time_count).label("timed"),
+            func.sum(rollup.time_sum).label("time_sum"),
+            func.min(rollup.time_min).label("time_min"),
+            func.max(rollup.time_max).label("time_max")
+        ).where(
+            rollup.scheduled_probe_id == probe_id,
+            window
+        )
+    )).one()
+    
+    sketch = {
+        entry.bucket: int(entry.n)
+        for entry in (await db.execute(
+            sketch_entries(rollup).where(rollup.scheduled_probe_id == probe_id, window)
+        )).all()
+    }
+    
+    total = int(row.total or 0)
+    timed = int(row.timed or 0)
+    return {
+        "probe_id": probe_id,
+        "days": days,
+        "count": total,
+        "success_rate": int(int(row.successful or 0) / total * 100) if total else 0,
+        "avg_response_time": int(float(row.time_sum or 0) / timed) if timed else 0,
+        "min_response_time": row.time_min,
+        "max_response_time": row.time_max,
+        "response_time_percentiles": sketch_percentiles(sketch)
+    }
+
+
+@router.get("/probes/{probe_id}/timeseries", response_model=dict)
+async def get_probe_timeseries(
+    probe_id: int,
+    start: Optional[datetime] = Query(None, description="Start of the range (UTC); defaults to 24 hours before end"),
+    end: Optional[datetime] = Query(None, description="End of the range (UTC); defaults to now"),
+    points: int = Query(300, ge=10, le=TIMESERIES_MAX_POINTS, description="Maximum number of points to return"),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Get a downsampled time series of results for a scheduled probe.
+    
+    The range is split into `points` equal buckets and each bucket reports
+    its result count, min/avg/max response time and failure rate, computed
+    in a single GROUP BY in the database. Series are returned as parallel
+    arrays; buckets without results are omitted.
+    """
+    probe = await _get_user_probe(db, probe_id, current_user.id)
+    
+    if not probe:
+        raise HTTPException(
+            status_code=404,
+            detail="Scheduled probe not found"
+        )
+    
+    end = _naive_utc(end) or datetime.utcnow()
+    start = _naive_utc(start) or end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if end - start > timedelta(days=TIMESERIES_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"Range cannot exceed {TIMESERIES_MAX_DAYS} days")
+    
+    bucket_seconds = (end - start).total_seconds() / points
+    result = models.ProbeResult
+    bucket = func.floor(
+        func.extract("epoch", result.created_at - start) / bucket_seconds
+    ).label("bucket")
+    rows = (await db.execute(
+        select(
+            bucket,
+            func.count().label("total"),
+            func.min(result.execution_time).label("latency_min"),
+            func.avg(result.execution_time).label("latency_avg"),
+            func.max(result.execution_time).label("latency_max"),
+            func.count().filter(result.status != 'success').label("failures")
+        ).where(
+            result.scheduled_probe_id == probe_id,
+            result.created_at >= start,
+            result.created_at < end
+        ).group_by(bucket).order_by(bucket)
+    )).all()
+    
+    series = {"t": [], "count": [], "latency_min": [], "latency_avg": [], "latency_max": [], "failure_rate": []}
+    for row in rows:
+        series["t"].append((start + timedelta(seconds=int(row.bucket) * bucket_seconds)).isoformat())
+        series["count"].append(row.total)
+        series["latency_min"].append(row.latency_min)
+        series["latency_avg"].append(round(float(row.latency_avg), 1) if row.latency_avg is not None else None)
+        series["latency_max"].append(row.latency_max)
+        series["failure_rate"].append(round(row.failures / row.total, 4))
+    
+    return {
+        "probe_id": probe_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "bucket_seconds": bucket_seconds,
+        "series": series
+    }
+
+
 @router.post("/probes/bulk-pause", response_model=dict)
 async def bulk_pause_probes(
     probe_ids: List[int],
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Pause multiple scheduled probes at once.
@@ -281,12 +428,16 @@ async def bulk_pause_probes(
     # For MVP, we'll allow bulk operations for all users
     
     # Update the probes
-    updated_count = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id.in_(probe_ids),
-        models.ScheduledProbe.user_id == current_user.id
-    ).update({"is_active": False, "updated_at": datetime.utcnow()})
+    result = await db.execute(
+        update(models.ScheduledProbe).where(
+            models.ScheduledProbe.id.in_(probe_ids),
+            models.ScheduledProbe.user_id == current_user.id
+        ).values(is_active=False, updated_at=datetime.utcnow())
+    )
+    updated_count = result.rowcount
     
-    db.commit()
+    await invalidate_dashboard_async(db, current_user.id)
+    await db.commit()
     
     return {"paused_count": updated_count}
 
@@ -295,7 +446,7 @@ async def bulk_pause_probes(
 async def bulk_resume_probes(
     probe_ids: List[int],
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Resume multiple scheduled probes at once.
@@ -304,12 +455,16 @@ async def bulk_resume_probes(
     # For MVP, we'll allow bulk operations for all users
     
     # Update the probes
-    updated_count = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id.in_(probe_ids),
-        models.ScheduledProbe.user_id == current_user.id
-    ).update({"is_active": True, "updated_at": datetime.utcnow()})
+    result = await db.execute(
+        update(models.ScheduledProbe).where(
+            models.ScheduledProbe.id.in_(probe_ids),
+            models.ScheduledProbe.user_id == current_user.id
+        ).values(is_active=True, updated_at=datetime.utcnow())
+    )
+    updated_count = result.rowcount
     
-    db.commit()
+    await invalidate_dashboard_async(db, current_user.id)
+    await db.commit()
     
     return {"resumed_count": updated_count}
 
@@ -318,7 +473,7 @@ async def bulk_resume_probes(
 async def bulk_delete_probes(
     probe_ids: List[int],
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete multiple scheduled probes at once.
@@ -327,16 +482,20 @@ async def bulk_delete_probes(
     # For MVP, we'll allow bulk operations for all users
     
     # Delete the probes
-    probes_to_delete = db.query(models.ScheduledProbe).filter(
-        models.ScheduledProbe.id.in_(probe_ids),
-        models.ScheduledProbe.user_id == current_user.id
-    ).all()
+    result = await db.execute(
+        select(models.ScheduledProbe).where(
+            models.ScheduledProbe.id.in_(probe_ids),
+            models.ScheduledProbe.user_id == current_user.id
+        )
+    )
+    probes_to_delete = result.scalars().all()
     
     deleted_count = len(probes_to_delete)
     
     for probe in probes_to_delete:
-        db.delete(probe)
+        await db.delete(probe)
     
-    db.commit()
+    await invalidate_dashboard_async(db, current_user.id)
+    await db.commit()
     
     return {"deleted_count": deleted_count}
\ No newline at end of file
@@ -6,6 +6,8 @@ from sqlalchemy.orm import Session
 
 from app import models, schemas, auth
 from app.database import get_db
+from app.middleware.rate_limit import invalidate_user_limits, invalidate_all_limits, get_user_limits
+from app.middleware.quota import get_usage_summary
 
 router = APIRouter()
 
@@ -40,6 +42,7 @@ def create_subscription(
             setattr(existing_subscription, key, value)
         db.commit()
         db.refresh(existing_subscription)
+        invalidate_user_limits(existing_subscription.user_id)
         return existing_subscription
     
     # Create new subscription
@@ -47,6 +50,7 @@ def create_subscription(
     db.add(db_subscription)
     db.commit()
     db.refresh(db_subscription)
+    invalidate_user_limits(db_subscription.user_id)
     return db_subscription
 
 
@@ -99,11 +103,14 @@ def update_subscription(
     if not subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
     
+    previous_user_id = subscription.user_id
     for key, value in subscription_data.dict().items():
         setattr(subscription, key, value)
     
     db.commit()
     db.refresh(subscription)
+    invalidate_user_limits(previous_user_id)
+    invalidate_user_limits(subscription.user_id)
     return subscription
 
 
@@ -125,6 +132,7 @@ def cancel_subscription(
     
     db.commit()
     db.refresh(subscription)
+    invalidate_user_limits(subscription.user_id)
     return subscription
 
 
@@ -154,9 +162,24 @@ def renew_subscription(
     
     db.commit()
     db.refresh(subscription)
+    invalidate_user_limits(subscription.user_id)
     return subscription
 
 
+@router.get("/usage", response_model=schemas.UsageQuotaResponse)
+def get_usage(
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Get the current user's request usage against their daily and monthly quotas.
+    
+    Served from the incrementally maintained usage counters, not from usage_logs.
+    """
+    limits = get_user_limits(current_user.id, db)
+    return get_usage_summary(current_user.id, limits, db)
+
+
 @router.get("/subscription-tiers", response_model=List[schemas.SubscriptionTierResponse])
 def list_subscription_tiers(db: Session = Depends(get_db)):
     """
@@ -228,6 +251,8 @@ def update_subscription_tier(
     
     db.commit()
     db.refresh(tier)
+    # Every user on this tier may have cached limits
+    invalidate_all_limits()
     return tier
 
 
@@ -257,5 +282,6 @@ def delete_subscription_tier(
     # Delete the tier
     db.delete(tier)
     db.commit()
+    invalidate_all_limits()
     
     return {"detail": f"Subscription tier {tier.name} deleted successfully"}
\ No newline at end of file
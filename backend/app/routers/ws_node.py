@@ -14,8 +14,11 @@ import random
 from pydantic import ValidationError
 
 from .. import models, auth, schemas
-from ..database import get_db
-from sqlalchemy.orm import Session
+from ..database import get_async_db
+from ..credential_filter import NODE_KEY_FILTER, hash_credential
+from ..prometheus import WEBSOCKET_MESSAGES
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -30,10 +33,19 @@ active_connections: Dict[str, WebSocket] = {}
 # node_uuid -> region
 node_regions: Dict[str, str] = {}
 
+# Message types counted by name in metrics; anything else is counted as "other"
+KNOWN_MESSAGE_TYPES = {"heartbeat", "diagnostic_response"}
+
 # API key header for WebSocket authentication
 API_KEY_HEADER = APIKeyHeader(name="Authorization")
 
-async def get_node_from_api_key(api_key: str, db: Session) -> Optional[models.ProbeNode]:
+async def _send_json(websocket: WebSocket, message: Dict[str, Any]):
+    """Send a message to a node, counting it by type for metrics."""
+    WEBSOCKET_MESSAGES.inc(direction="sent", type=message.get("type") or message.get("status", "unknown"))
+    await websocket.send_json(message)
+
+
+async def get_node_from_api_key(api_key: str, db: AsyncSession) -> Optional[models.ProbeNode]:
     """Validate API key and return the associated probe node."""
     if not api_key or not api_key.startswith("Bearer "):
         return None
@@ -41,13 +53,22 @@ async def get_node_from_api_key(api_key: str, db: Session) -> Optional[models.Pr
     # Extract the actual key from "Bearer <key>"
     key = api_key.split("Bearer ")[1].strip()
     
+    # Reject unknown API keys before touching the database
+    key_hash = hash_credential(key)
+    if not await NODE_KEY_FILTER.might_be_valid_async(key, key_hash, db):
+        return None
+    
     # Query for the node with this API key
-    node = db.query(models.ProbeNode).filter(models.ProbeNode.api_key == key).first()
+    result = await db.execute(select(models.ProbeNode).where(models.ProbeNode.api_key == key))
+    node = result.scalars().first()
+    if node is None:
+        # No node has this key at all
+        NODE_KEY_FILTER.remember_invalid(key_hash)
     return node
 
 
 @router.websocket("/node")
-async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(get_async_db)):
     """
     WebSocket endpoint for probe nodes to establish persistent connections.
     Nodes authenticate with their API key and maintain an open connection.
@@ -61,21 +82,36 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
     try:
         # Expect initial authentication message
         auth_data = await websocket.receive_json()
+        WEBSOCKET_MESSAGES.inc(direction="received", type="auth")
         
         try:
             # Validate auth data with our schema
             ws_auth = schemas.WebSocketNodeAuth(**auth_data)
             
-            # Get node from database
-            node = db.query(models.ProbeNode).filter(
-                models.ProbeNode.node_uuid == ws_auth.node_uuid,
-                models.ProbeNode.api_key == ws_auth.api_key
-            ).first()
+            # Get node from database, unless the API key cannot exist
+            key_hash = hash_credential(ws_auth.api_key)
+            node = None
+            if await NODE_KEY_FILTER.might_be_valid_async(ws_auth.api_key, key_hash, db):
+                result = await db.execute(
+                    select(models.ProbeNode).where(
+                        models.ProbeNode.node_uuid == ws_auth.node_uuid,
+                        models.ProbeNode.api_key == ws_auth.api_key
+                    )
+                )
+                node = result.scalars().first()
+                if node is None:
+                    # Only cache keys that belong to no node; a valid key sent
+                    # with the wrong UUID must keep working once it is fixed
+                    known_key = await db.scalar(
+                        select(models.ProbeNode.id).where(models.ProbeNode.api_key == ws_auth.api_key).limit(1)
+                    )
+                    if known_key is None:
+                        NODE_KEY_FILTER.remember_invalid(key_hash)
             
         except ValidationError:
             # Fallback for legacy clients that don't follow the schema yet
             if "api_key" not in auth_data or "node_uuid" not in auth_data:
-                await websocket.send_json({
+                await _send_json(websocket, {
                     "status": "error", 
                     "message": "Invalid authentication format",
                     "details": "Expected node_uuid and api_key"
@@ -88,7 +124,7 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
             node = await get_node_from_api_key(f"Bearer {api_key}", db)
             
         if not node:
-            await websocket.send_json({
+            await _send_json(websocket, {
                 "status": "error", 
                 "message": "Authentication failed",
                 "details": "Invalid node_uuid or api_key"
@@ -100,7 +136,7 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
         node_uuid = node.node_uuid
         if node_uuid in active_connections:
             # Only one connection per node allowed - close the new one
-            await websocket.send_json({
+            await _send_json(websocket, {
                 "status": "error", 
                 "message": "Node already connected",
                 "details": "Only one active connection per node is allowed"
@@ -120,7 +156,9 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
         node.last_connected = datetime.utcnow()
         node.connection_id = connection_id
         node.reconnect_count = node.reconnect_count + 1 if node.reconnect_count else 1
-        db.commit()
+        # Committing also returns the connection to the pool for the
+        # lifetime of the WebSocket
+        await db.commit()
         
         logger.info(f"Node {node.name} ({node_uuid}) connected via WebSocket (conn_id: {connection_id})")
         
@@ -130,7 +168,7 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
         jitter_factor = 0.1  # 10% jitter
         
         # Send confirmation with reconnection parameters
-        await websocket.send_json({
+        await _send_json(websocket, {
             "status": "connected",
             "message": f"Connected successfully as {node.name}",
             "node_uuid": node_uuid,
@@ -148,9 +186,14 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
         while True:
             # Wait for messages from the node
             data = await websocket.receive_json()
+            message_type = data.get("type") if isinstance(data, dict) else None
+            WEBSOCKET_MESSAGES.inc(
+                direction="received",
+                type=message_type if message_type in KNOWN_MESSAGE_TYPES else "other"
+            )
             
             if "type" not in data:
-                await websocket.send_json({"status": "error", "message": "Invalid message format"})
+                await _send_json(websocket, {"status": "error", "message": "Invalid message format"})
                 continue
                 
             # Handle heartbeat message
@@ -158,28 +201,30 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
                 try:
                     # Try to parse as our schema
                     heartbeat = schemas.WebSocketHeartbeatMessage(**data)
+                    values = {
+                        "last_heartbeat": datetime.utcnow(),
+                        "current_load": heartbeat.current_load,
+                    }
                     
-                    # Update node heartbeat in DB
-                    node = db.query(models.ProbeNode).filter(models.ProbeNode.node_uuid == node_uuid).first()
-                    if node:
-                        node.last_heartbeat = datetime.utcnow()
-                        node.current_load = heartbeat.current_load
-                        # Update other metrics from heartbeat
-                        db.commit()
-                        
                 except ValidationError:
                     # Legacy heartbeat format
-                    node = db.query(models.ProbeNode).filter(models.ProbeNode.node_uuid == node_uuid).first()
-                    if node:
-                        node.last_heartbeat = datetime.utcnow()
-                        if "load" in data:
-                            node.current_load = float(data["load"])
-                        if "error_count" in data:
-                            node.error_count = data["error_count"]
-                        db.commit()
+                    values = {"last_heartbeat": datetime.utcnow()}
+                    if "load" in data:
+                        values["current_load"] = float(data["load"])
+                    if "error_count" in data:
+                        values["error_count"] = data["error_count"]
+                
+                # Update node heartbeat in DB with a single UPDATE
+                await db.execute(
+                    update(models.ProbeNode)
+                    .where(models.ProbeNode.node_uuid == node_uuid)
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
                 
                 # Acknowledge heartbeat
-                await websocket.send_json({
+                await _send_json(websocket, {
                     "status": "ok", 
                     "type": "heartbeat_ack",
                     "server_time": datetime.utcnow().isoformat()
@@ -193,7 +238,7 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
                     logger.info(f"Received diagnostic result from {node_uuid} for request {data['request_id']}")
                     
                     # Acknowledge receipt
-                    await websocket.send_json({
+                    await _send_json(websocket, {
                         "status": "ok", 
                         "type": "result_received", 
                         "request_id": data["request_id"]
@@ -213,12 +258,17 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
                 del node_regions[node_uuid]
                 
             # Update node status in database
-            node = db.query(models.ProbeNode).filter(models.ProbeNode.node_uuid == node_uuid).first()
-            if node:
-                node.status = "disconnected"
-                node.connection_type = None
-                node.connection_id = None
-                db.commit()
+            try:
+                await db.rollback()
+                await db.execute(
+                    update(models.ProbeNode)
+                    .where(models.ProbeNode.node_uuid == node_uuid)
+                    .values(status="disconnected", connection_type=None, connection_id=None)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Error marking node {node_uuid} as disconnected: {str(e)}")
 
 
 async def send_diagnostic_job(node_uuid: str, tool: str, target: str, parameters: Dict[str, Any] = None, priority: int = 1, timeout: int = 30) -> Optional[str]:
@@ -257,7 +307,7 @@ async def send_diagnostic_job(node_uuid: str, tool: str, target: str, parameters
             "timestamp": datetime.utcnow().isoformat()
         }
         
-        await websocket.send_json(command_message)
+        await _send_json(websocket, command_message)
         logger.info(f"Sent diagnostic job to node {node_uuid}: {tool} {target} (priority: {priority})")
         return request_id
     except Exception as e:
@@ -276,6 +326,15 @@ def get_connected_nodes_in_region(region: Optional[str] = None) -> List[str]:
     ]
 
 
+def get_connected_nodes_by_region() -> Dict[str, int]:
+    """Get the number of connected nodes per region."""
+    counts: Dict[str, int] = {}
+    for node_uuid in list(active_connections):
+        region = node_regions.get(node_uuid) or "unknown"
+        counts[region] = counts.get(region, 0) + 1
+    return counts
+
+
 def get_connected_node_count() -> int:
     """Get count of currently connected nodes."""
     return len(active_connections)
\ No newline at end of file
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, EmailStr, validator, HttpUrl, conint, confloat, root_validator, PositiveInt
 from typing import Optional, List, Dict, Any, Union
-from datetime import datetime
+from datetime import date, datetime
 import re
 import uuid
 from enum import Enum
@@ -110,7 +110,8 @@ class ApiKeyUpdate(BaseModel):
 
 class ApiKeyInDB(ApiKeyBase):
     id: int
-    key: str
+    key: Optional[str] = None  # Only returned in full when the key is created
+    prefix: Optional[str] = None
     user_id: int
     is_active: bool
     created_at: datetime
@@ -461,6 +462,21 @@ class UsageLog(UsageLogInDB):
     pass
 
 
+class UsagePeriod(BaseModel):
+    """Request usage for a single quota period"""
+    used: int
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    period_start: date
+    resets_at: datetime
+
+
+class UsageQuotaResponse(BaseModel):
+    """Current daily and monthly quota usage"""
+    day: UsagePeriod
+    month: UsagePeriod
+
+
 # Probe Node Schemas
 
 class ProbeNodeSupportedTools(BaseModel):
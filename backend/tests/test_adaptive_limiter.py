@@ -0,0 +1,117 @@
+"""Tests for the global adaptive concurrency limiter."""
+
+import asyncio
+
+from app.middleware.rate_limit import AdaptiveConcurrencyLimiter
+
+
+def _limiter(**kwargs):
+    options = dict(initial_limit=10, min_limit=2, max_limit=100, max_queue=10, max_wait=1.0)
+    options.update(kwargs)
+    return AdaptiveConcurrencyLimiter(**options)
+
+
+def _fill(limiter):
+    """Hold every slot, as if the limit were fully used."""
+    while limiter._try_acquire():
+        pass
+
+
+def test_limit_grows_while_latency_is_stable():
+    limiter = _limiter()
+    _fill(limiter)
+    for _ in range(50):
+        limiter.release(0.02, route="/diagnostics/ping")
+        limiter._try_acquire()
+    assert limiter.limit > 10
+    assert limiter.decreases == 0
+
+
+def test_limit_shrinks_when_a_route_slows_down():
+    limiter = _limiter()
+    _fill(limiter)
+    for _ in range(20):
+        limiter.release(0.02, route="/keys")
+        limiter._try_acquire()
+    before = limiter.limit
+    for _ in range(10):
+        limiter.release(0.5, route="/keys")
+        limiter._try_acquire()
+    assert limiter.decreases >= 1
+    assert limiter.limit < before
+
+
+def test_route_mix_does_not_lower_the_limit():
+    limiter = _limiter()
+    _fill(limiter)
+    # Slow tool runs interleaved with fast listing requests, both at their normal latency
+    for i in range(200):
+        if i % 3 == 0:
+            limiter.release(2.0 + (i % 5) * 0.1, route="/diagnostics/traceroute")
+        else:
+            limiter.release(0.005, route="/apikeys")
+        limiter._try_acquire()
+    assert limiter.decreases == 0
+    assert limiter.limit >= 10
+
+
+def test_limit_never_drops_below_minimum():
+    limiter = _limiter(initial_limit=3)
+    limiter.release(0.01, route="/keys")
+    for _ in range(50):
+        limiter.last_decrease = 0.0
+        limiter.release(1.0, route="/keys")
+    assert limiter.current_limit == limiter.min_limit
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        limiter = _limiter(initial_limit=1, min_limit=1)
+        assert await limiter.acquire()
+
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.stats()['queue_depth'] == 1
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert limiter.stats()['queue_depth'] == 0
+
+        limiter.release()
+        assert limiter.in_flight == 0
+        assert await limiter.acquire()
+
+    asyncio.run(scenario())
+
+
+def test_slot_granted_to_cancelled_waiter_is_passed_on():
+    async def scenario():
+        limiter = _limiter(initial_limit=1, min_limit=1)
+        assert await limiter.acquire()
+
+        first = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+
+        # The first waiter is cancelled, but the slot is handed to it before it runs
+        first.cancel()
+        limiter.release()
+        await asyncio.gather(first, return_exceptions=True)
+
+        assert await second
+        assert limiter.in_flight == 1
+        assert limiter.stats()['queue_depth'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_waiter_is_shed_and_dequeued():
+    async def scenario():
+        limiter = _limiter(initial_limit=1, min_limit=1, max_wait=0.01)
+        assert await limiter.acquire()
+        assert not await limiter.acquire()
+        assert limiter.shed == 1
+        assert limiter.stats()['queue_depth'] == 0
+
+    asyncio.run(scenario())
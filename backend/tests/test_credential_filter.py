@@ -0,0 +1,69 @@
+"""Tests for the credential negative-lookup filters."""
+
+from app.credential_filter import CountingBloomFilter, CredentialFilter
+
+
+def test_added_members_are_always_found():
+    bloom = CountingBloomFilter(capacity=1000, error_rate=0.01)
+    members = [f"key-{i}" for i in range(1000)]
+    for member in members:
+        bloom.add(member)
+    assert all(member in bloom for member in members)
+
+
+def test_removing_a_member_keeps_the_others():
+    bloom = CountingBloomFilter(capacity=1000, error_rate=0.01)
+    members = [f"key-{i}" for i in range(500)]
+    for member in members:
+        bloom.add(member)
+
+    for member in members[::2]:
+        bloom.remove(member)
+
+    assert all(member in bloom for member in members[1::2])
+    assert sum(member in bloom for member in members[::2]) < 25
+
+
+def test_duplicate_adds_need_matching_removes():
+    bloom = CountingBloomFilter(capacity=100)
+    bloom.add("key")
+    bloom.add("key")
+    bloom.remove("key")
+    assert "key" in bloom
+    bloom.remove("key")
+    assert "key" not in bloom
+
+
+def test_false_positive_rate_is_near_target():
+    bloom = CountingBloomFilter(capacity=5000, error_rate=0.01)
+    for i in range(5000):
+        bloom.add(f"key-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_unknown_credentials_are_rejected_after_a_refresh():
+    rows = [(1, "alpha"), (2, "beta")]
+    credentials = CredentialFilter("test", lambda db, after_id: [row for row in rows if row[0] > after_id])
+    credentials.load(None)
+
+    assert credentials.might_be_valid("alpha", "hash-alpha", None)
+    # Created by another worker after the load; picked up by the refresh
+    rows.append((3, "gamma"))
+    credentials.last_refresh = 0.0
+    assert credentials.might_be_valid("gamma", "hash-gamma", None)
+
+    credentials.last_refresh = 0.0
+    assert not credentials.might_be_valid("delta", "hash-delta", None)
+    assert credentials.stats['negative_cache_rejections'] == 0
+    assert not credentials.might_be_valid("delta", "hash-delta", None)
+    assert credentials.stats['negative_cache_rejections'] == 1
+
+
+def test_forgotten_credentials_are_checked_again():
+    credentials = CredentialFilter("test", lambda db, after_id: [(1, "alpha")] if after_id < 1 else [])
+    credentials.load(None)
+    credentials.remember_invalid("hash-alpha")
+    assert not credentials.might_be_valid("alpha", "hash-alpha", None)
+    credentials.forget_invalid("hash-alpha")
+    assert credentials.might_be_valid("alpha", "hash-alpha", None)
@@ -0,0 +1,51 @@
+"""Tests for access control on the Prometheus endpoint."""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.config import settings
+from app.routers import metrics
+
+
+def _scrape(authorization=None):
+    headers = [(b"authorization", authorization.encode())] if authorization else []
+    request = Request({"type": "http", "method": "GET", "path": "/metrics", "headers": headers})
+    return asyncio.run(metrics.get_prometheus_metrics(request))
+
+
+def _status(authorization=None):
+    try:
+        return _scrape(authorization).status_code
+    except HTTPException as e:
+        return e.status_code
+
+
+@pytest.fixture
+def metrics_settings(monkeypatch):
+    def configure(token, public):
+        monkeypatch.setattr(settings, "METRICS_TOKEN", token)
+        monkeypatch.setattr(settings, "METRICS_PUBLIC", public)
+    return configure
+
+
+def test_disabled_without_token_by_default(metrics_settings):
+    metrics_settings("", False)
+    assert _status() == 403
+
+
+def test_token_is_required_when_set(metrics_settings):
+    metrics_settings("scrape-secret", True)
+    assert _status() == 401
+    assert _status("Bearer wrong") == 401
+
+    response = _scrape("Bearer scrape-secret")
+    assert response.status_code == 200
+    assert b"probeops_http_request_duration_seconds" in response.body
+
+
+def test_public_opt_out(metrics_settings):
+    metrics_settings("", True)
+    assert _status() == 200
@@ -0,0 +1,69 @@
+"""Tests for monthly partition naming and retention."""
+
+from datetime import date, datetime
+
+from app import partitions
+
+
+class FakeConnection:
+    """Records statements; catalog queries return the given partition names."""
+
+    def __init__(self, names):
+        self.names = names
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+        return self
+
+    def all(self):
+        return [(name,) for name in self.names]
+
+    def scalar(self):
+        # Every table is partitioned
+        return True
+
+
+def test_add_months_across_year_boundaries():
+    assert partitions.add_months(date(2026, 1, 1), 1) == date(2026, 2, 1)
+    assert partitions.add_months(date(2026, 11, 1), 2) == date(2027, 1, 1)
+    assert partitions.add_months(date(2026, 12, 1), 13) == date(2028, 1, 1)
+    assert partitions.add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+    assert partitions.add_months(date(2026, 3, 1), -15) == date(2024, 12, 1)
+
+
+def test_month_start():
+    assert partitions.month_start(date(2026, 2, 28)) == date(2026, 2, 1)
+
+
+def test_partition_name_round_trips_through_the_catalog():
+    name = partitions.partition_name("usage_logs", date(2026, 3, 1))
+    assert name == "usage_logs_p202603"
+
+    conn = FakeConnection([name, "usage_logs_default"])
+    assert partitions.list_partitions(conn, "usage_logs") == [
+        ("usage_logs_p202603", date(2026, 3, 1)),
+        ("usage_logs_default", None),
+    ]
+
+
+def test_only_partitions_entirely_before_the_cutoff_are_dropped():
+    conn = FakeConnection(["diagnostics_p202601", "diagnostics_p202602", "diagnostics_p202603", "diagnostics_default"])
+
+    dropped = partitions.drop_partitions_before(conn, "diagnostics", datetime(2026, 3, 1))
+
+    assert dropped == ["diagnostics_p202601", "diagnostics_p202602"]
+    assert not any("diagnostics_default" in statement for statement in conn.statements if "DROP" in statement)
+    assert not partitions.drop_partitions_before(conn, "diagnostics", datetime(2026, 1, 31, 23, 59))
+
+
+def test_startup_creates_current_and_next_month_for_every_table():
+    conn = FakeConnection([])
+
+    created = partitions.ensure_partitions(conn, months_ahead=partitions.PARTITION_STARTUP_MONTHS, today=date(2026, 12, 15))
+
+    created_tables = [statement.split()[5] for statement in conn.statements if statement.startswith("CREATE TABLE")]
+    assert created == 3 * len(partitions.PARTITIONED_TABLES)
+    assert "usage_logs_default" in created_tables
+    assert "usage_logs_p202612" in created_tables
+    assert "usage_logs_p202701" in created_tables
@@ -0,0 +1,40 @@
+"""Tests for the query plan check in the pre-deploy validation script."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "scripts" / "database"))
+
+from pre_deploy_validate import find_sequential_scans  # noqa: E402
+
+
+def _scan(node_type, relation, *children):
+    plan = {"Node Type": node_type, "Relation Name": relation}
+    if children:
+        plan["Plans"] = list(children)
+    return plan
+
+
+def test_index_scans_pass():
+    plan = {"Node Type": "Limit", "Plans": [_scan("Index Scan", "diagnostics")]}
+    assert find_sequential_scans(plan, ["diagnostics"]) == []
+
+
+def test_nested_sequential_scans_on_partitions_are_found():
+    plan = {
+        "Node Type": "Append",
+        "Plans": [
+            _scan("Index Scan", "usage_logs_p202601"),
+            _scan("Seq Scan", "usage_logs_p202602"),
+            {"Node Type": "Hash", "Plans": [_scan("Seq Scan", "usage_logs_default")]},
+        ],
+    }
+    assert find_sequential_scans(plan, ["usage_logs"]) == ["usage_logs_p202602", "usage_logs_default"]
+
+
+def test_unguarded_tables_are_ignored():
+    plan = {
+        "Node Type": "Nested Loop",
+        "Plans": [_scan("Seq Scan", "subscription_tiers"), _scan("Seq Scan", "diagnostic_rollups")],
+    }
+    assert find_sequential_scans(plan, ["diagnostics", "api_keys"]) == []
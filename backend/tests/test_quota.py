@@ -0,0 +1,135 @@
+"""Tests for daily and monthly quota counters."""
+
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.middleware import quota
+
+
+class StoredCounters:
+    """Stands in for a session reading usage_counters rows."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def query(self, model):
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+@pytest.fixture(autouse=True)
+def counters(monkeypatch):
+    monkeypatch.setattr(quota, "QUOTA_COUNTERS", {})
+    monkeypatch.setattr(quota, "PENDING_INCREMENTS", defaultdict(int))
+    monkeypatch.setattr(quota, "FLUSHING_INCREMENTS", {})
+
+
+def test_periods_roll_over_at_midnight_utc():
+    assert quota.current_periods(datetime(2026, 1, 31, 23, 59)) == {
+        quota.PERIOD_DAY: date(2026, 1, 31),
+        quota.PERIOD_MONTH: date(2026, 1, 1),
+    }
+    assert quota.current_periods(datetime(2026, 2, 1, 0, 0)) == {
+        quota.PERIOD_DAY: date(2026, 2, 1),
+        quota.PERIOD_MONTH: date(2026, 2, 1),
+    }
+
+
+def test_period_reset_times():
+    assert quota.period_reset_time(quota.PERIOD_DAY, date(2026, 12, 31)) == datetime(2027, 1, 1)
+    assert quota.period_reset_time(quota.PERIOD_MONTH, date(2026, 1, 1)) == datetime(2026, 2, 1)
+    assert quota.period_reset_time(quota.PERIOD_MONTH, date(2026, 12, 1)) == datetime(2027, 1, 1)
+
+
+def test_increments_after_rollover_start_new_counters(monkeypatch):
+    periods = quota.current_periods(datetime(2026, 1, 31, 23, 59))
+    monkeypatch.setattr(quota, "current_periods", lambda now=None: periods)
+    quota.increment_usage(7, 5)
+
+    rolled = {quota.PERIOD_DAY: date(2026, 2, 1), quota.PERIOD_MONTH: date(2026, 2, 1)}
+    monkeypatch.setattr(quota, "current_periods", lambda now=None: rolled)
+    quota.increment_usage(7)
+
+    assert quota.QUOTA_COUNTERS[(7, quota.PERIOD_DAY, date(2026, 1, 31))][0] == 5
+    assert quota.QUOTA_COUNTERS[(7, quota.PERIOD_DAY, date(2026, 2, 1))][0] == 1
+    assert quota.QUOTA_COUNTERS[(7, quota.PERIOD_MONTH, date(2026, 2, 1))][0] == 1
+
+
+def test_prune_keeps_ended_periods_until_flushed(monkeypatch):
+    rolled = {quota.PERIOD_DAY: date(2026, 2, 1), quota.PERIOD_MONTH: date(2026, 2, 1)}
+    monkeypatch.setattr(quota, "current_periods", lambda now=None: rolled)
+    ended = (7, quota.PERIOD_DAY, date(2026, 1, 31))
+    flushed = (8, quota.PERIOD_DAY, date(2026, 1, 31))
+    current = (8, quota.PERIOD_DAY, date(2026, 2, 1))
+    quota.QUOTA_COUNTERS.update({ended: (5, 0.0), flushed: (3, 0.0), current: (1, 0.0)})
+    quota.PENDING_INCREMENTS[ended] = 2
+
+    quota.prune_expired_counters()
+
+    assert set(quota.QUOTA_COUNTERS) == {ended, current}
+
+
+def test_flush_keeps_increments_made_during_the_write(monkeypatch):
+    key = (7, quota.PERIOD_DAY, date(2026, 2, 1))
+    monkeypatch.setattr(quota, "current_periods", lambda now=None: {quota.PERIOD_DAY: key[2]})
+    quota.increment_usage(7, 3)
+
+    def write(pending):
+        assert pending == {key: 3}
+        # A request finishing while the upsert runs
+        quota.increment_usage(7)
+        return [(7, quota.PERIOD_DAY, key[2], 10)], None
+
+    monkeypatch.setattr(quota, "_write_counters", write)
+    assert asyncio.run(quota.flush_usage_counters_async()) == 1
+
+    assert quota.PENDING_INCREMENTS == {key: 1}
+    # Total from the database plus the increment that is still pending
+    assert quota.QUOTA_COUNTERS[key][0] == 11
+
+
+def test_failed_flush_is_retried(monkeypatch):
+    kept = (7, quota.PERIOD_DAY, date(2026, 2, 1))
+    deleted = (8, quota.PERIOD_DAY, date(2026, 2, 1))
+    monkeypatch.setattr(quota, "current_periods", lambda now=None: {quota.PERIOD_DAY: kept[2]})
+    quota.increment_usage(7, 3)
+    quota.increment_usage(8, 2)
+
+    def write(pending):
+        quota.increment_usage(7)
+        return None, {7}
+
+    monkeypatch.setattr(quota, "_write_counters", write)
+    assert quota.flush_usage_counters() == 0
+
+    assert quota.PENDING_INCREMENTS == {kept: 4}
+    assert deleted not in quota.PENDING_INCREMENTS
+
+
+def test_load_during_a_flush_counts_its_increments(monkeypatch):
+    key = (7, quota.PERIOD_DAY, date(2026, 2, 1))
+    periods = {quota.PERIOD_DAY: key[2]}
+    monkeypatch.setattr(quota, "current_periods", lambda now=None: periods)
+    quota.increment_usage(7, 3)
+
+    def write(pending):
+        # The mirror expires and is reloaded before the upsert commits
+        stored = [SimpleNamespace(period=quota.PERIOD_DAY, period_start=key[2], count=10)]
+        quota._load_counters(7, periods, StoredCounters(stored))
+        assert quota.QUOTA_COUNTERS[key][0] == 13
+        return [(7, quota.PERIOD_DAY, key[2], 13)], None
+
+    monkeypatch.setattr(quota, "_write_counters", write)
+    assert quota.flush_usage_counters() == 1
+
+    assert quota.QUOTA_COUNTERS[key][0] == 13
+    assert quota.FLUSHING_INCREMENTS == {}
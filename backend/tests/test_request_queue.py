@@ -0,0 +1,51 @@
+"""Tests for the per-user concurrency queue."""
+
+import asyncio
+
+import pytest
+
+from app.middleware import rate_limit
+
+
+@pytest.fixture(autouse=True)
+def no_limit_lookups(monkeypatch):
+    def lookup(*args, **kwargs):
+        raise AssertionError("limits must not be looked up while processing the queue")
+
+    monkeypatch.setattr(rate_limit, "get_user_limits", lookup)
+    rate_limit.REQUEST_QUEUE.clear()
+    rate_limit.ACTIVE_REQUESTS.clear()
+    yield
+    rate_limit.REQUEST_QUEUE.clear()
+    rate_limit.ACTIVE_REQUESTS.clear()
+
+
+def test_queued_request_runs_once_capacity_frees_up():
+    async def scenario():
+        rate_limit.ACTIVE_REQUESTS[7] = {"first"}
+        waiter = asyncio.create_task(rate_limit.queue_request(7, "second", priority=0, max_concurrent=1))
+        await asyncio.sleep(0)
+        assert len(rate_limit.REQUEST_QUEUE) == 1
+        assert not waiter.done()
+
+        rate_limit.ACTIVE_REQUESTS[7].discard("first")
+        await rate_limit.process_queue()
+
+        assert await waiter
+        assert not rate_limit.REQUEST_QUEUE
+
+    asyncio.run(scenario())
+
+
+def test_queue_uses_each_entry_limit():
+    async def scenario():
+        rate_limit.ACTIVE_REQUESTS[7] = {"a", "b"}
+        small = asyncio.create_task(rate_limit.queue_request(7, "c", priority=0, max_concurrent=2))
+        large = asyncio.create_task(rate_limit.queue_request(7, "d", priority=0, max_concurrent=3))
+        await asyncio.sleep(0)
+
+        assert await large
+        assert not small.done()
+        small.cancel()
+
+    asyncio.run(scenario())
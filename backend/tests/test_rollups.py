@@ -0,0 +1,96 @@
+"""Tests for rollup window selection and latency sketches."""
+
+import math
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, String, create_engine, func, select
+from sqlalchemy.orm import Session, declarative_base
+
+from app.rollups import SKETCH_GAMMA, merge_sketches, rollup_window, sketch_percentiles, sketch_quantile
+
+Base = declarative_base()
+
+
+class Rollup(Base):
+    """Only the columns rollup_window filters on."""
+
+    __tablename__ = "rollups"
+
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String)
+    bucket_start = Column(DateTime)
+    count = Column(Integer)
+
+
+NOW = datetime(2026, 3, 10, 14, 25)
+HISTORY_START = datetime(2026, 3, 1)
+
+
+@pytest.fixture(scope="module")
+def session():
+    """Hourly rows with one event each, and daily rows for every finished day, as the compactor leaves them."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    today = NOW.replace(hour=0, minute=0)
+    with Session(engine) as db:
+        hour = HISTORY_START
+        while hour <= NOW:
+            db.add(Rollup(granularity='hour', bucket_start=hour, count=1))
+            if hour.hour == 0 and hour < today:
+                db.add(Rollup(granularity='day', bucket_start=hour, count=24))
+            hour += timedelta(hours=1)
+        db.commit()
+        yield db
+
+
+def _counted(db, since):
+    return db.execute(select(func.sum(Rollup.count)).where(rollup_window(Rollup, since, NOW))).scalar()
+
+
+@pytest.mark.parametrize("since", [
+    None,
+    HISTORY_START,
+    datetime(2026, 3, 3, 0, 0),
+    datetime(2026, 3, 3, 7, 45),
+    datetime(2026, 3, 9, 23, 59),
+    datetime(2026, 3, 10, 0, 0),
+    datetime(2026, 3, 10, 9, 30),
+    NOW,
+])
+def test_window_counts_every_hour_exactly_once(session, since):
+    start = (since or HISTORY_START).replace(minute=0)
+    expected_hours = int((NOW - start).total_seconds() // 3600) + 1
+    assert _counted(session, since) == expected_hours
+
+
+def test_merge_sketches_adds_bucket_counts():
+    # Sketches loaded from JSON have string keys
+    assert merge_sketches({"0": 2, "10": 1}, {10: 3, 20: 1}, {}) == {0: 2, 10: 4, 20: 1}
+
+
+def test_sketch_quantile_is_within_relative_error():
+    values = list(range(1, 1001))
+    sketch = {}
+    for value in values:
+        # Same bucketing as the compactor: floor(ln(ms) / ln(gamma))
+        bucket = math.floor(math.log(value) / math.log(SKETCH_GAMMA))
+        sketch[bucket] = sketch.get(bucket, 0) + 1
+
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch_quantile(sketch, q) - exact) / exact <= SKETCH_GAMMA - 1
+
+
+def test_sketch_quantile_edge_cases():
+    assert sketch_quantile({}, 0.5) is None
+    # Sub-millisecond times are all in bucket 0
+    assert sketch_quantile({0: 5}, 0.99) == 1.0
+    assert sketch_percentiles({}) == {"p50": None, "p95": None, "p99": None}
+
+
+def test_merged_sketch_matches_sketch_of_all_values():
+    first = {5: 10, 30: 2}
+    second = {5: 5, 40: 3}
+    combined = {5: 15, 30: 2, 40: 3}
+    assert sketch_percentiles(merge_sketches(first, second)) == sketch_percentiles(combined)
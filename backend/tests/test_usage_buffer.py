@@ -0,0 +1,88 @@
+"""Tests for batched usage logging."""
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.middleware import usage_buffer
+from app.models import ApiKey, SubscriptionTier, User
+
+
+class FakeSession:
+    """Stands in for a session; rejects rows referencing ids that do not exist."""
+
+    def __init__(self, existing, inserted):
+        self.existing = existing
+        self.inserted = inserted
+
+    def execute(self, statement, rows):
+        for row in rows:
+            for field, model in usage_buffer.USAGE_REFERENCES:
+                if row.get(field) is not None and row[field] not in self.existing[model]:
+                    raise IntegrityError("INSERT INTO usage_logs", row, Exception(f"{field} violates foreign key"))
+        self.inserted.extend(dict(row) for row in rows)
+
+    def query(self, column):
+        self._ids = self.existing[column.class_]
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        return [(i,) for i in self._ids]
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def database(monkeypatch):
+    existing = {User: {1}, SubscriptionTier: {1}, ApiKey: {1}}
+    inserted = []
+
+    monkeypatch.setattr(usage_buffer, "SessionLocal", lambda: FakeSession(existing, inserted))
+    monkeypatch.setattr(usage_buffer, "_failed_attempts", 0)
+    usage_buffer.USAGE_QUEUE.clear()
+    yield existing, inserted
+    usage_buffer.USAGE_QUEUE.clear()
+
+
+def _event(**fields):
+    event = {'user_id': 1, 'tier_id': 1, 'api_key_id': 1, 'endpoint': '/diagnostics/ping'}
+    event.update(fields)
+    return event
+
+
+def test_rows_referencing_deleted_tier_or_key_are_kept_without_the_reference(database):
+    _, inserted = database
+    usage_buffer.USAGE_QUEUE.extend([_event(), _event(tier_id=2), _event(api_key_id=3), _event(user_id=4)])
+
+    assert usage_buffer.flush_usage() == 4
+    assert not usage_buffer.USAGE_QUEUE
+    assert [(row['user_id'], row['tier_id'], row['api_key_id']) for row in inserted] == [
+        (1, 1, 1), (1, None, 1), (1, 1, None), (None, 1, 1),
+    ]
+
+
+def test_batch_failing_repeatedly_is_dropped(database, monkeypatch):
+    _, inserted = database
+
+    # References are never cleared, so the batch keeps failing
+    monkeypatch.setattr(usage_buffer, "_detach_missing_references", lambda db, batch: None)
+    usage_buffer.USAGE_QUEUE.extend([_event(api_key_id=3)])
+    dropped = usage_buffer.USAGE_STATS['dropped']
+
+    for _ in range(usage_buffer.USAGE_MAX_FLUSH_ATTEMPTS - 1):
+        assert usage_buffer.flush_usage() == 0
+        assert len(usage_buffer.USAGE_QUEUE) == 1
+
+    assert usage_buffer.flush_usage() == 0
+    assert not usage_buffer.USAGE_QUEUE
+    assert usage_buffer.USAGE_STATS['dropped'] == dropped + 1
+    assert not inserted
@@ -577,21 +577,24 @@ const ApiKeys = () => {
                         }}
                       >
                         <Box component="span" sx={{ mr: 1, maxWidth: '260px', overflow: 'hidden', textOverflow: 'ellipsis', whiteSpace: 'nowrap' }}>
-                          {apiKey.key}
+                          {apiKey.key || `${apiKey.prefix}…`}
                         </Box>
-                        <IconButton 
-                          size="small" 
-                          onClick={() => handleCopyApiKey(apiKey)}
-                          sx={{ 
-                            ml: 'auto', 
-                            color: 'inherit',
-                            '&:hover': {
-                              color: theme.palette.primary.main
-                            }
-                          }}
-                        >
-                          <CopyIcon fontSize="small" />
-                        </IconButton>
+                        {/* The full key is only known right after it is created */}
+                        {apiKey.key && (
+                          <IconButton 
+                            size="small" 
+                            onClick={() => handleCopyApiKey(apiKey)}
+                            sx={{ 
+                              ml: 'auto', 
+                              color: 'inherit',
+                              '&:hover': {
+                                color: theme.palette.primary.main
+                              }
+                            }}
+                          >
+                            <CopyIcon fontSize="small" />
+                          </IconButton>
+                        )}
                       </Box>
                     </TableCell>
                     <TableCell>
@@ -92,6 +92,7 @@ const ApiTokenDisplay = () => {
             id: response.data.id || Date.now(),
             name: newTokenName,
             key: response.data.key || response.data.token || response.data.value,
+            prefix: response.data.prefix,
             created_at: new Date().toISOString(),
             expires_at: response.data.expires_at || null
           };
@@ -232,24 +233,31 @@ const ApiTokenDisplay = () => {
                           overflow: 'hidden',
                           textOverflow: 'ellipsis'
                         }}>
-                          {showTokenValue[token.id] ? token.key : '••••••••••••••••'}
+                          {!token.key
+                            ? (token.prefix ? `${token.prefix}…` : '••••••••••••••••')
+                            : showTokenValue[token.id] ? token.key : '••••••••••••••••'}
                         </Typography>
-                        <Tooltip title={showTokenValue[token.id] ? "Hide token" : "Show token"}>
-                          <IconButton 
-                            size="small" 
-                            onClick={() => toggleTokenVisibility(token.id)}
-                          >
-                            {showTokenValue[token.id] ? <VisibilityOffIcon fontSize="small" /> : <VisibilityIcon fontSize="small" />}
-                          </IconButton>
-                        </Tooltip>
-                        <Tooltip title="Copy to clipboard">
-                          <IconButton 
-                            size="small" 
-                            onClick={() => handleCopyToken(token.key)}
-                          >
-                            <CopyIcon fontSize="small" />
-                          </IconButton>
-                        </Tooltip>
+                        {/* The full token is only known right after it is created */}
+                        {token.key && (
+                          <>
+                            <Tooltip title={showTokenValue[token.id] ? "Hide token" : "Show token"}>
+                              <IconButton 
+                                size="small" 
+                                onClick={() => toggleTokenVisibility(token.id)}
+                              >
+                                {showTokenValue[token.id] ? <VisibilityOffIcon fontSize="small" /> : <VisibilityIcon fontSize="small" />}
+                              </IconButton>
+                            </Tooltip>
+                            <Tooltip title="Copy to clipboard">
+                              <IconButton 
+                                size="small" 
+                                onClick={() => handleCopyToken(token.key)}
+                              >
+                                <CopyIcon fontSize="small" />
+                              </IconButton>
+                            </Tooltip>
+                          </>
+                        )}
                       </Box>
                     </TableCell>
                     <TableCell>{new Date(token.created_at).toLocaleDateString()}</TableCell>
@@ -7,7 +7,8 @@ This script verifies that the database schema is ready for deployment:
 1. Checks that all migrations are present and in correct order
 2. Tests that database connection works
 3. Verifies the current database state matches expected schema
-4. Creates a validation report
+4. Checks that hot queries are served by indexes (no sequential scans)
+5. Creates a validation report
 
 Run before deployment to avoid database-related failures.
 
@@ -41,6 +42,74 @@ logging.basicConfig(
 )
 logger = logging.getLogger('pre_deploy_validate')
 
+# Hot queries whose plans must not fall back to a sequential scan on the
+# listed tables. Parameter values are placeholders; only the plan shape matters.
+HOT_QUERY_PLANS = [
+    {
+        "name": "diagnostic history",
+        "sql": "SELECT * FROM diagnostics WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 10",
+        "params": {"user_id": 1},
+        "tables": ["diagnostics"],
+    },
+    {
+        "name": "diagnostics in a time window",
+        "sql": "SELECT count(*) FROM diagnostics WHERE user_id = :user_id AND created_at >= now() - interval '7 days'",
+        "params": {"user_id": 1},
+        "tables": ["diagnostics"],
+    },
+    {
+        "name": "probe results",
+        "sql": "SELECT * FROM probe_results WHERE scheduled_probe_id = :probe_id ORDER BY created_at DESC LIMIT 50",
+        "params": {"probe_id": 1},
+        "tables": ["probe_results"],
+    },
+    {
+        "name": "usage per user",
+        "sql": "SELECT count(*) FROM usage_logs WHERE user_id = :user_id AND timestamp >= now() - interval '1 day'",
+        "params": {"user_id": 1},
+        "tables": ["usage_logs"],
+    },
+    {
+        "name": "node authentication",
+        "sql": "SELECT * FROM probe_nodes WHERE api_key = :api_key",
+        "params": {"api_key": "plan-check"},
+        "tables": ["probe_nodes"],
+    },
+    {
+        "name": "API key lookup",
+        "sql": "SELECT * FROM api_keys WHERE prefix = :prefix",
+        "params": {"prefix": "plancheck"},
+        "tables": ["api_keys"],
+    },
+    {
+        "name": "active probes per user",
+        "sql": "SELECT count(*) FROM scheduled_probes WHERE user_id = :user_id AND is_active",
+        "params": {"user_id": 1},
+        "tables": ["scheduled_probes"],
+    },
+    {
+        "name": "active API keys per user",
+        "sql": "SELECT count(*) FROM api_keys WHERE user_id = :user_id AND is_active",
+        "params": {"user_id": 1},
+        "tables": ["api_keys"],
+    },
+]
+
+
+def find_sequential_scans(plan: dict, tables: list) -> list:
+    """
+    Walk an EXPLAIN (FORMAT JSON) plan and return the relations in `tables`
+    (or their partitions, named <table>_...) that are read with a Seq Scan.
+    """
+    found = []
+    relation = plan.get("Relation Name")
+    if plan.get("Node Type") == "Seq Scan" and relation:
+        if any(relation == table or relation.startswith(f"{table}_") for table in tables):
+            found.append(relation)
+    for child in plan.get("Plans", []):
+        found.extend(find_sequential_scans(child, tables))
+    return found
+
 class DeploymentValidator:
     """Validates database readiness before deployment."""
     
@@ -140,6 +209,58 @@ class DeploymentValidator:
         logger.info(f"Database state validation passed (revision: {current_revision})")
         return True
     
+    def validate_query_plans(self) -> bool:
+        """
+        Run EXPLAIN on the hot query catalog and fail on sequential scans.
+        
+        Sequential scans are disabled for the check, so the planner only picks
+        one when no usable index exists. This keeps the check meaningful on
+        small databases, where a sequential scan would otherwise be cheapest.
+        
+        Returns:
+            Boolean indicating if the validation passed
+        """
+        import sqlalchemy as sa
+        
+        passed = True
+        inspector = sa.inspect(self.migration_manager.engine)
+        
+        with self.migration_manager.engine.connect() as conn:
+            conn.execute(sa.text("SET enable_seqscan = off"))
+            for query in HOT_QUERY_PLANS:
+                missing = [table for table in query["tables"] if not inspector.has_table(table)]
+                if missing:
+                    logger.warning(f"Skipping plan check '{query['name']}': missing table(s) {', '.join(missing)}")
+                    continue
+                
+                try:
+                    plan = conn.execute(
+                        sa.text(f"EXPLAIN (FORMAT JSON) {query['sql']}"), query["params"]
+                    ).scalar()
+                except Exception as e:
+                    self.issues.append(f"Plan check '{query['name']}' failed to run: {str(e)}")
+                    logger.error(f"Plan check '{query['name']}' failed to run: {str(e)}")
+                    passed = False
+                    conn.rollback()
+                    conn.execute(sa.text("SET enable_seqscan = off"))
+                    continue
+                
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scans = find_sequential_scans(plan[0]["Plan"], query["tables"])
+                if scans:
+                    self.issues.append(
+                        f"Query plan regression in '{query['name']}': sequential scan on {', '.join(sorted(set(scans)))}"
+                    )
+                    logger.error(f"Plan check '{query['name']}' uses a sequential scan on {', '.join(sorted(set(scans)))}")
+                    passed = False
+                else:
+                    logger.info(f"Plan check '{query['name']}' passed")
+        
+        if not passed:
+            self.validation_passed = False
+        return passed
+    
     def create_validation_report(self) -> dict:
         """
         Create a validation report.
@@ -218,6 +339,7 @@ class DeploymentValidator:
         
         self.validate_migrations()
         self.validate_database_state()
+        self.validate_query_plans()
         
         # Create and save report
         report = self.create_validation_report()
@@ -235,6 +357,7 @@ class DeploymentValidator:
                 self.validation_passed = True
                 self.validate_migrations()
                 self.validate_database_state()
+                self.validate_query_plans()
                 
                 # Update report
                 report = self.create_validation_report()